@@ -0,0 +1,275 @@
+
+"""
+Opens growing number (up to 10000) of
+wayround_i2p.xmpp.client_asyncio.XMPPAsyncC2SClient connections to local
+stub server, sending stream header and stanzas to each of them, and prints
+thread count and stanzas received per second for each number of
+connections.
+
+Thread count must not grow with number of connections, and dispatcher
+threads must be gone when all connections are closed.
+
+Stub server runs in separate process, so both sides of 10000 connections
+fit into default open files limit.
+
+Also checks, that io machine wait() waits for its state, and that send()
+callers are blocked while server does not read.
+
+usage: xmpp_test_asyncio_connections.py [max_connections [stanzas]]
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+
+import wayround_i2p.xmpp.client_asyncio
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+def stub_server_stream(stanzas):
+
+    ret = bytes(
+        wayround_i2p.xmpp.core.start_stream_tpl(
+            'example.org', 'test@example.org'
+            ),
+        'utf-8'
+        )
+
+    for i in range(stanzas):
+        ret += bytes(
+            '<message from="user{}@example.org/res" id="m{}">'
+            '<body>text</body></message>'.format(i % 10, i),
+            'utf-8'
+            )
+
+    return ret
+
+
+def stub_server(port_queue, server_data):
+
+    async def serve(reader, writer):
+        writer.write(server_data)
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    loop = asyncio.new_event_loop()
+
+    server = loop.run_until_complete(
+        asyncio.start_server(serve, '127.0.0.1', 0, backlog=1024)
+        )
+
+    port_queue.put(server.sockets[0].getsockname()[1])
+
+    loop.run_forever()
+
+    return
+
+
+def run_connections(loop, port, count, stanzas):
+
+    received = [0]
+    received_lock = threading.Lock()
+    all_received = threading.Event()
+
+    def on_new_stanza(signal_name, stanza_processor, stanza):
+        with received_lock:
+            received[0] += 1
+            if received[0] == count * stanzas:
+                all_received.set()
+
+    time_start = time.monotonic()
+
+    clients = []
+    for i in range(count):
+        client = wayround_i2p.xmpp.client_asyncio.XMPPAsyncC2SClient(loop)
+        client.signal.connect(
+            'stanza_processor_new_stanza',
+            on_new_stanza
+            )
+        client.start(
+            'test@example.org', 'example.org',
+            host='127.0.0.1', port=port
+            )
+        clients.append(client)
+
+    if not all_received.wait(600):
+        print("Timedout. Received {} of {}".format(
+            received[0], count * stanzas
+            ))
+
+    time_spent = time.monotonic() - time_start
+
+    threads = threading.active_count()
+
+    for i in clients:
+        i.stop()
+
+    for i in clients:
+        i.wait('stopped', 10)
+
+    return threads, received[0] / time_spent
+
+
+def check_wait_and_backpressure(loop, check):
+
+    gate = asyncio.Event()
+
+    async def serve(reader, writer):
+        await gate.wait()
+        while await reader.read(65536) != b'':
+            pass
+        writer.close()
+
+    server = asyncio.run_coroutine_threadsafe(
+        asyncio.start_server(serve, '127.0.0.1', 0),
+        loop
+        ).result()
+    port = server.sockets[0].getsockname()[1]
+
+    client = wayround_i2p.xmpp.client_asyncio.XMPPAsyncC2SClient(
+        loop,
+        output_parameters={
+            'high_watermark': 64 * 1024,
+            'low_watermark': 16 * 1024
+            }
+        )
+    client.start(
+        'test@example.org', 'example.org',
+        host='127.0.0.1', port=port
+        )
+
+    io_machine = client.io_machine
+
+    print("io machine wait():")
+
+    check("wait('working')", io_machine.wait('working', 1))
+    check(
+        "wait('stopped') times out while working",
+        io_machine.wait('stopped', 0.1) == False
+        )
+
+    stanza = (
+        '<message to="someone@example.org" type="chat"><body>{}</body>'
+        '</message>'.format('x' * 1000)
+        )
+    count = 50000
+
+    jobs = []
+
+    def producer():
+        for i in range(count):
+            jobs.append(io_machine.send(stanza))
+
+    producer_thread = threading.Thread(target=producer)
+    producer_thread.start()
+
+    time.sleep(1)
+
+    print("send() backpressure:")
+
+    check("producer is blocked", producer_thread.is_alive())
+    check("not all sent while server does not read", len(jobs) < count)
+
+    loop.call_soon_threadsafe(gate.set)
+
+    producer_thread.join(60)
+
+    check("producer is done", not producer_thread.is_alive())
+
+    for i in jobs:
+        i.wait(10)
+
+    check(
+        "all jobs are done without error",
+        len(jobs) == count
+        and all(i.is_done() and i.error is None for i in jobs)
+        )
+
+    client.stop()
+
+    check("wait('stopped')", io_machine.wait('stopped', 10))
+    check("stat() is 'stopped'", io_machine.stat() == 'stopped')
+
+    loop.call_soon_threadsafe(server.close)
+
+    return
+
+
+def main():
+
+    max_connections = 10000
+    stanzas = 20
+
+    if len(sys.argv) > 1:
+        max_connections = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        stanzas = int(sys.argv[2])
+
+    check = xmpp_test_common.Checks()
+
+    port_queue = multiprocessing.Queue()
+
+    server_process = multiprocessing.Process(
+        target=stub_server,
+        args=(port_queue, stub_server_stream(stanzas)),
+        daemon=True
+        )
+    server_process.start()
+
+    port = port_queue.get()
+
+    loop = asyncio.new_event_loop()
+
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+
+    threads_before = threading.active_count()
+
+    print("threads before connecting: {}".format(threads_before))
+
+    thread_counts = []
+
+    count = 1
+    while count <= max_connections:
+        threads, rate = run_connections(loop, port, count, stanzas)
+        thread_counts.append(threads)
+        print(
+            "{:5} connections: {:3} threads, {:.0f} stanzas/s".format(
+                count, threads, rate
+                )
+            )
+        count *= 10
+
+    # dispatcher threads are stopped in background
+    time.sleep(1)
+
+    threads_after = threading.active_count()
+
+    print("threads after disconnecting: {}".format(threads_after))
+
+    server_process.terminate()
+
+    check(
+        "thread count does not grow",
+        len(set(thread_counts)) == 1
+        )
+    check("threads gone after disconnect", threads_after == threads_before)
+
+    check_wait_and_backpressure(loop, check)
+
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
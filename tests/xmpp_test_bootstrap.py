@@ -0,0 +1,210 @@
+
+"""
+Checks pipelined wayround_i2p.xmpp.client.bootstrap() against simulated
+server, answering each stanza after round trip time: bind, session and
+roster requests and initial presence must be sent at once and in order,
+results must be same as of sequential bind(), session() and Roster.get(),
+and bootstrap must take about one round trip instead of one per step.
+
+Session request must be skipped if session feature is optional.
+
+Stream is replaced by object with signal, so no connection is needed.
+
+usage: xmpp_test_bootstrap.py [rtt_seconds]
+"""
+
+import logging
+import sys
+import threading
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.client
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+FULL_JID = 'user@example.org/bootstrap'
+
+FEATURES = (
+    '<stream:features xmlns:stream="http://etherx.jabber.org/streams">'
+    '<bind xmlns="urn:ietf:params:xml:ns:xmpp-bind"/>'
+    '<session xmlns="urn:ietf:params:xml:ns:xmpp-session">{}</session>'
+    '<ver xmlns="urn:xmpp:features:rosterver"/>'
+    '</stream:features>'
+    )
+
+
+class FakeServer(xmpp_test_common.FakeIOMachine):
+
+    """
+    Answers iq stanzas after `rtt' seconds
+    """
+
+    def __init__(self, rtt):
+        super().__init__()
+        self.rtt = rtt
+
+    def send(self, obj):
+
+        # parsed from bytes, as by server: namespaces of generated
+        # elements are only in xmlns attributes
+        obj = lxml.etree.fromstring(
+            b'<stream xmlns="jabber:client">'
+            + lxml.etree.tostring(obj)
+            + b'</stream>'
+            )[0]
+
+        self.sent.append(obj)
+
+        if obj.tag == '{jabber:client}iq':
+
+            payload = ''
+
+            if obj.find('{urn:ietf:params:xml:ns:xmpp-bind}bind') is not None:
+                payload = (
+                    '<bind xmlns="urn:ietf:params:xml:ns:xmpp-bind">'
+                    '<jid>{}</jid></bind>'.format(FULL_JID)
+                    )
+
+            elif obj.find('{jabber:iq:roster}query') is not None:
+                payload = (
+                    '<query xmlns="jabber:iq:roster" ver="v1">'
+                    '<item jid="contact@example.org" subscription="both"/>'
+                    '</query>'
+                    )
+
+            threading.Timer(
+                self.rtt,
+                self.receive,
+                args=(
+                    '<iq xmlns="jabber:client" id="{}" type="result">'
+                    '{}</iq>'.format(obj.get('id'), payload),
+                    )
+                ).start()
+
+        return
+
+    def get_sent_kinds(self):
+        ret = []
+        for i in self.sent:
+            kind = lxml.etree.QName(i).localname
+            if len(i) != 0:
+                kind = lxml.etree.QName(i[0]).localname
+            ret.append(kind)
+        return ret
+
+
+def new_client(rtt):
+
+    client = wayround_i2p.xmpp.client.XMPPC2SClient.__new__(
+        wayround_i2p.xmpp.client.XMPPC2SClient
+        )
+
+    client.stanza_processor = wayround_i2p.xmpp.core.StanzaProcessor(
+        dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher('inline')
+        )
+
+    server = FakeServer(rtt)
+
+    client.stanza_processor.connect_io_machine(server)
+
+    client_jid = wayround_i2p.xmpp.core.JID.new_from_str(FULL_JID)
+
+    roster = wayround_i2p.xmpp.client.Roster(client, client_jid)
+    presence = wayround_i2p.xmpp.client.Presence(client, client_jid)
+
+    return client, server, roster, presence
+
+
+def main():
+
+    rtt = 0.2
+
+    if len(sys.argv) > 1:
+        rtt = float(sys.argv[1])
+
+    check = xmpp_test_common.Checks()
+
+    features = lxml.etree.fromstring(FEATURES.format(''))
+
+    client, server, roster, presence = new_client(rtt)
+
+    time_start = time.monotonic()
+    sequential = {
+        'jid': wayround_i2p.xmpp.client.bind(client, 'bootstrap'),
+        'session': wayround_i2p.xmpp.client.session(client, 'example.org'),
+        'roster': roster.get(wait=True, versioning=True)
+        }
+    presence.presence()
+    time_sequential = time.monotonic() - time_start
+
+    client, server, roster, presence = new_client(rtt)
+
+    time_start = time.monotonic()
+    result = wayround_i2p.xmpp.client.bootstrap(
+        client,
+        features,
+        'example.org',
+        resource='bootstrap',
+        roster=roster,
+        presence=presence
+        )
+    time_bootstrap = time.monotonic() - time_start
+
+    print("round trip time {:.0f} ms:".format(rtt * 1000))
+    print("    sequential:  {:.0f} ms".format(time_sequential * 1000))
+    print("    bootstrap(): {:.0f} ms".format(time_bootstrap * 1000))
+
+    check(
+        "all sent at once, in order",
+        server.get_sent_kinds() == ['bind', 'session', 'query', 'presence']
+        )
+    check("bound JID", result['jid'] == FULL_JID)
+    check(
+        "session result",
+        isinstance(result['session'], wayround_i2p.xmpp.core.Stanza)
+        and result['session'].get_typ() == 'result'
+        )
+    check(
+        "roster result",
+        list(result['roster'].keys()) == ['contact@example.org']
+        and roster.store.get_ver() == 'v1'
+        )
+    check(
+        "same results as sequential",
+        result['jid'] == sequential['jid']
+        and result['roster'].keys() == sequential['roster'].keys()
+        )
+    check("one round trip", time_bootstrap < rtt * 2)
+    check("faster than sequential", time_bootstrap < time_sequential / 2)
+    check(
+        "no requests left waiting",
+        client.stanza_processor.get_wait_callbacks_count() == 0
+        )
+
+    print("optional session:")
+
+    client, server, roster, presence = new_client(rtt)
+
+    result = wayround_i2p.xmpp.client.bootstrap(
+        client,
+        lxml.etree.fromstring(FEATURES.format('<optional/>')),
+        'example.org',
+        resource='bootstrap'
+        )
+
+    check("session request skipped", server.get_sent_kinds() == ['bind'])
+    check(
+        "result without session and roster",
+        result == {'jid': FULL_JID, 'session': None, 'roster': None}
+        )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,167 @@
+
+"""
+Compares Message.broadcast() with Message.message() per recipient, and
+shows per domain fairness and rate limiting of broadcast().
+
+Client is replaced by recording object, so no connection is needed.
+
+usage: xmpp_test_broadcast.py [recipients [domains]]
+"""
+
+import logging
+import sys
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.client
+import wayround_i2p.xmpp.core
+
+
+class RecordingJob:
+
+    error = None
+
+    def wait(self, timeout=None):
+        return True
+
+
+class RecordingStanzaProcessor:
+
+    def __init__(self, client):
+        self.client = client
+        self.id_generator = wayround_i2p.xmpp.core.StanzaIDGenerator()
+
+    def send(self, stanza, wait=False):
+        self.client.send(stanza.to_bytes())
+        return stanza.get_ide()
+
+
+class RecordingClient:
+
+    def __init__(self):
+        self.sent = []
+        self.stanza_processor = RecordingStanzaProcessor(self)
+
+    def send(self, data):
+        self.sent.append(data)
+        return RecordingJob()
+
+    def get_recipients(self):
+        root = lxml.etree.fromstring(
+            b'<r xmlns="jabber:client">' + b''.join(self.sent) + b'</r>'
+            )
+        return [i.get('to') for i in root]
+
+
+def new_message_client():
+
+    ret = wayround_i2p.xmpp.client.Message.__new__(
+        wayround_i2p.xmpp.client.Message
+        )
+    ret.client = RecordingClient()
+    ret.client_jid = wayround_i2p.xmpp.core.JID.new_from_str(
+        'bot@example.org/notifier'
+        )
+
+    return ret
+
+
+def main():
+
+    count = 20000
+    domains = 100
+
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        domains = int(sys.argv[2])
+
+    recipients = [
+        'user{}@domain{}.org'.format(i, i % domains) for i in range(count)
+        ]
+
+    body = {'': 'Notification text & details'}
+
+    message = new_message_client()
+
+    time_start = time.monotonic()
+    for i in recipients:
+        message.message(to_jid=i, typ='chat', body=body)
+    time_message = time.monotonic() - time_start
+
+    calls_message = len(message.client.sent)
+
+    message = new_message_client()
+
+    time_start = time.monotonic()
+    results = message.broadcast(recipients, body)
+    time_broadcast = time.monotonic() - time_start
+
+    calls_broadcast = len(message.client.sent)
+
+    print("{} recipients in {} domains".format(count, domains))
+    print(
+        "    message():   {:.1f} us per recipient, {} send() calls".format(
+            time_message / count * 1000000,
+            calls_message
+            )
+        )
+    print(
+        "    broadcast(): {:.1f} us per recipient, {} send() calls".format(
+            time_broadcast / count * 1000000,
+            calls_broadcast
+            )
+        )
+    print(
+        "    all sent: {}".format(
+            set(results.values()) == set(['sent'])
+            and sorted(message.client.get_recipients()) == sorted(recipients)
+            )
+        )
+
+    # one big and one small domain: small domain must not wait for big one
+
+    message = new_message_client()
+
+    recipients = (
+        ['user{}@big.org'.format(i) for i in range(100)]
+        + ['user{}@small.org'.format(i) for i in range(5)]
+        )
+
+    time_start = time.monotonic()
+    message.broadcast(
+        recipients,
+        body,
+        domain_rate=50,
+        domain_burst=10,
+        batch_size=10
+        )
+    time_spent = time.monotonic() - time_start
+
+    order = message.client.get_recipients()
+
+    print("fairness and rate limit (50 per second per domain, burst 10):")
+    print(
+        "    last small.org message position: {} of {}".format(
+            max(
+                i for i in range(len(order))
+                if order[i].endswith('@small.org')
+                ) + 1,
+            len(order)
+            )
+        )
+    print(
+        "    time: {:.2f} s (expected about {:.2f} s)".format(
+            time_spent,
+            (100 - 10) / 50
+            )
+        )
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,133 @@
+
+"""
+Fakes and helpers, shared by xmpp_test_* scripts. Not a test itself:
+scripts import it from their own directory.
+"""
+
+import os
+import threading
+
+import lxml.etree
+
+import wayround_i2p.utils.threading
+import wayround_i2p.xmpp.core
+
+
+class Checks:
+
+    """
+    Callable, printing result of named check and collecting failed ones.
+
+    result() prints failed checks and returns exit code for script
+    """
+
+    def __init__(self):
+        self.errors = []
+        return
+
+    def __call__(self, name, value):
+        print("    {:44}: {}".format(name, value))
+        if not value:
+            self.errors.append(name)
+        return
+
+    def result(self):
+
+        ret = 0
+
+        if len(self.errors) != 0:
+            print("FAILED: {}".format(', '.join(self.errors)))
+            ret = 1
+
+        return ret
+
+
+class GatedSink:
+
+    """
+    Output file object. Blocks write() until gate is opened
+    """
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.written = []
+        return
+
+    def write(self, data):
+        self.gate.wait()
+        self.written.append(data)
+        return len(data)
+
+
+def new_writer(sink, xml_target=None, **kwargs):
+    """
+    Started XMPPOutputStreamWriter, writing to `sink'. New parser target
+    is created if `xml_target' is None
+    """
+
+    if xml_target is None:
+        xml_target = wayround_i2p.xmpp.core.XMPPStreamParserTarget()
+
+    parser = lxml.etree.XMLParser(target=xml_target, huge_tree=True)
+
+    ret = wayround_i2p.xmpp.core.XMPPOutputStreamWriter(
+        sink,
+        parser,
+        xml_target=xml_target,
+        **kwargs
+        )
+    ret.start()
+
+    return ret
+
+
+class PipeStreamer:
+
+    """
+    Stands for wayround_i2p.utils.stream.SocketStreamer in
+    XMPPIOStreamRWMachine.set_objects(): data written to strin is read
+    from strout
+    """
+
+    def __init__(self):
+        r_fd, w_fd = os.pipe()
+        self.strout = os.fdopen(r_fd, 'rb', buffering=0)
+        self.strin = os.fdopen(w_fd, 'wb', buffering=0)
+        return
+
+    def close(self):
+        self.strin.close()
+        self.strout.close()
+        return
+
+
+class FakeIOMachine:
+
+    """
+    Stands for XMPPIOStreamRWMachine in StanzaProcessor.connect_io_machine():
+    records sent objects, and emits 'in_element_readed' for receive()d
+    text. send() raises OSError while `fail' is True
+    """
+
+    def __init__(self):
+        self.signal = wayround_i2p.utils.threading.Signal(
+            self,
+            ['in_element_readed']
+            )
+        self.sent = []
+        self.fail = False
+        return
+
+    def send(self, obj):
+        if self.fail:
+            raise OSError("test send error")
+        self.sent.append(obj)
+        return
+
+    def receive(self, text):
+        self.signal.emit(
+            'in_element_readed',
+            self,
+            lxml.etree.fromstring(text)
+            )
+        return
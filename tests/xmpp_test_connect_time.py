@@ -0,0 +1,117 @@
+
+"""
+Measures time from TCP connection to bound resource (and to end of Bot
+connection sequence) and disconnection time, using
+wayround_i2p.xmpp.client_bot.Bot against real server.
+
+usage: xmpp_test_connect_time.py jid password [host [count]]
+
+Run on two revisions to compare them.
+"""
+
+import logging
+import statistics
+import sys
+import time
+
+import wayround_i2p.xmpp.client
+import wayround_i2p.xmpp.client_bot
+import wayround_i2p.xmpp.core
+
+
+def main():
+
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return 1
+
+    jid = wayround_i2p.xmpp.core.JID.new_from_str(sys.argv[1])
+    if jid.resource is None:
+        jid.resource = 'connect-time'
+
+    password = sys.argv[2]
+
+    host = jid.domain
+    if len(sys.argv) > 3:
+        host = sys.argv[3]
+
+    count = 5
+    if len(sys.argv) > 4:
+        count = int(sys.argv[4])
+
+    bound_times = []
+
+    # bind() and bootstrap() both pass bind result to _bind_result(). Old
+    # revisions have only bind()
+    hooked_name = '_bind_result'
+    if not hasattr(wayround_i2p.xmpp.client, hooked_name):
+        hooked_name = 'bind'
+
+    original_bind = getattr(wayround_i2p.xmpp.client, hooked_name)
+
+    def bind(*args, **kwargs):
+        ret = original_bind(*args, **kwargs)
+        bound_times.append(time.monotonic())
+        return ret
+
+    setattr(wayround_i2p.xmpp.client, hooked_name, bind)
+
+    to_bound = []
+    to_connected = []
+    to_disconnected = []
+
+    for i in range(count):
+
+        bot = wayround_i2p.xmpp.client_bot.Bot()
+
+        time_start = time.monotonic()
+
+        res = bot.connect(
+            wayround_i2p.xmpp.core.JID.new_from_str(jid.full()),
+            wayround_i2p.xmpp.core.C2SConnectionInfo(host=host),
+            wayround_i2p.xmpp.core.Authentication(
+                service='xmpp',
+                hostname=jid.domain,
+                authid=jid.user,
+                realm=jid.domain,
+                password=password
+                )
+            )
+
+        time_connected = time.monotonic()
+
+        if res != 0:
+            print("connection error: {}".format(res))
+            return 1
+
+        bot.disconnect()
+
+        time_disconnected = time.monotonic()
+
+        if len(bound_times) != i + 1:
+            print("bind result was not seen")
+            return 1
+
+        to_bound.append(bound_times[-1] - time_start)
+        to_connected.append(time_connected - time_start)
+        to_disconnected.append(time_disconnected - time_connected)
+
+    for name, values in [
+            ('connect to bound', to_bound),
+            ('connect to session and presence', to_connected),
+            ('disconnect', to_disconnected)
+            ]:
+        print(
+            "{}: median {:.1f} ms, min {:.1f} ms".format(
+                name,
+                statistics.median(values) * 1000,
+                min(values) * 1000
+                )
+            )
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,89 @@
+
+"""
+Measures time between bytes becoming readable for XMPPInputStreamReader and
+`element_readed' signal of parser target, which is receiving parsed stanzas.
+
+Prints p50 and p99 latencies.
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+
+COUNT = 1000
+PAUSE = 0.002
+
+
+def main():
+
+    r_fd, w_fd = os.pipe()
+
+    read_from = os.fdopen(r_fd, 'rb', buffering=0)
+
+    target = wayround_i2p.xmpp.core.XMPPStreamParserTarget()
+
+    parser = lxml.etree.XMLParser(target=target, huge_tree=True)
+
+    reader = wayround_i2p.xmpp.core.XMPPInputStreamReader(read_from, parser)
+
+    sent = {}
+    latencies = []
+    all_received = threading.Event()
+
+    def on_element_readed(signal_name, parser_target, element):
+        latencies.append(time.monotonic() - sent[element.get('id')])
+        if len(latencies) == COUNT:
+            all_received.set()
+
+    target.signal.connect('element_readed', on_element_readed)
+
+    reader.start()
+
+    os.write(
+        w_fd,
+        bytes(
+            wayround_i2p.xmpp.core.start_stream_tpl(
+                'test@example.org', 'example.org'
+                ),
+            'utf-8'
+            )
+        )
+
+    for i in range(COUNT):
+        ide = str(i)
+        sent[ide] = time.monotonic()
+        os.write(
+            w_fd,
+            bytes('<message id="{}"><body>{}</body></message>'.format(
+                ide, ide
+                ), 'utf-8')
+            )
+        time.sleep(PAUSE)
+
+    if not all_received.wait(60):
+        print("Timedout. Received {} of {}".format(len(latencies), COUNT))
+
+    reader.stop()
+
+    os.close(w_fd)
+    read_from.close()
+
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print("stanzas: {}".format(len(latencies)))
+        print("p50: {:.3f} ms".format(quantiles[49] * 1000))
+        print("p99: {:.3f} ms".format(quantiles[98] * 1000))
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,141 @@
+
+"""
+Compares JID parsing ways: old uncompiled regexp (as JID.new_from_string()
+used to do it), parse_jid() without and with cache, FrozenJID and bulk
+jids_to_bare().
+
+Prints parses per second, also for invalid JIDs, which cached parse_jid()
+must reject without parsing again, and checks, that jid_to_bare() and
+jid_is_full() still accept strings, failing parse_jid() checks, and that
+FrozenJID subclasses get objects of own class from cache.
+"""
+
+import logging
+import re
+import timeit
+
+import wayround_i2p.xmpp.core
+
+
+COUNT = 100000
+
+DISTINCT = 1000
+
+JIDS = [
+    'user{}@example{}.org/resource{}'.format(i, i % 10, i % 3)
+    for i in range(DISTINCT)
+    ]
+
+INVALID_JIDS = [
+    'user {}@example{}.org/resource{}'.format(i, i % 10, i % 3)
+    for i in range(DISTINCT)
+    ]
+
+
+def old_regexp(in_str):
+
+    res = re.match(
+        (r'^((?P<localpart>.+?)@)?(?P<domainpart>.+?)'
+         r'(/(?P<resourcepart>.+?))?$'),
+        in_str
+        )
+
+    return (
+        res.group('localpart'),
+        res.group('domainpart'),
+        res.group('resourcepart')
+        )
+
+
+def run(func, jids=JIDS):
+
+    jids = jids * (COUNT // DISTINCT)
+
+    def loop():
+        for i in jids:
+            try:
+                func(i)
+            except ValueError:
+                pass
+
+    return COUNT / timeit.timeit(loop, number=1)
+
+
+def main():
+
+    parse_jid = wayround_i2p.xmpp.core.parse_jid
+    frozen = wayround_i2p.xmpp.core.FrozenJID
+
+    for name, func in [
+            ('old regexp', old_regexp),
+            ('parse_jid() uncached', wayround_i2p.xmpp.core._parse_jid),
+            ('parse_jid() cached', parse_jid),
+            ('FrozenJID.new_from_str()', frozen.new_from_str),
+            ('JID.new_from_str().bare()',
+             lambda x: wayround_i2p.xmpp.core.JID.new_from_str(x).bare()),
+            ('FrozenJID.new_from_str().bare()',
+             lambda x: frozen.new_from_str(x).bare())
+            ]:
+        print("{:36}: {:10.0f} parses/s".format(name, run(func)))
+
+    for name, func in [
+            ('parse_jid() uncached, invalid',
+             wayround_i2p.xmpp.core._parse_jid),
+            ('parse_jid() cached, invalid', parse_jid)
+            ]:
+        print(
+            "{:36}: {:10.0f} parses/s".format(name, run(func, INVALID_JIDS))
+            )
+
+    jids = JIDS * (COUNT // DISTINCT)
+
+    time_spent = timeit.timeit(
+        lambda: wayround_i2p.xmpp.core.jids_to_bare(jids),
+        number=1
+        )
+
+    print(
+        "{:36}: {:10.0f} parses/s".format(
+            'jids_to_bare()',
+            COUNT / time_spent
+            )
+        )
+
+    lenient = (
+        wayround_i2p.xmpp.core.jid_to_bare(INVALID_JIDS[1])
+        == 'user 1@example1.org'
+        and wayround_i2p.xmpp.core.jid_is_full(INVALID_JIDS[1])
+        )
+
+    print("jid_to_bare(), jid_is_full() accept invalid JIDs: {}".format(
+        lenient
+        ))
+
+    class SubFrozenJID(frozen):
+        __slots__ = ()
+
+    base_jid = frozen.new_from_str(JIDS[0])
+    sub_jid = SubFrozenJID.new_from_str(JIDS[0])
+
+    own_class = (
+        type(base_jid) is frozen
+        and type(sub_jid) is SubFrozenJID
+        and type(sub_jid.bare_obj()) is SubFrozenJID
+        and SubFrozenJID.new_from_str(JIDS[0]) is sub_jid
+        and frozen.new_from_str(JIDS[0]) is base_jid
+        )
+
+    print("FrozenJID subclasses get own class objects: {}".format(
+        own_class
+        ))
+
+    ret = 0
+    if not lenient or not own_class:
+        ret = 1
+
+    return ret
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
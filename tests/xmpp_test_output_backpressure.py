@@ -0,0 +1,132 @@
+
+"""
+Checks backpressure of wayround_i2p.xmpp.core.XMPPOutputStreamWriter:
+while output is blocked, send() callers must be stopped at high watermark
+and resumed after queue is written down to low watermark; all objects must
+be written in order and their jobs must be done.
+
+Also prints send() time per object for growing queue length, which must
+not grow with queue length.
+
+usage: xmpp_test_output_backpressure.py
+"""
+
+import logging
+import threading
+import time
+
+import xmpp_test_common
+
+
+STANZA = (
+    '<message to="someone@example.org" type="chat">'
+    '<body>some text to be sent {:05}</body></message>'
+    )
+
+COUNT = 100
+
+
+def main():
+
+    check = xmpp_test_common.Checks()
+
+    stanzas = [STANZA.format(i) for i in range(COUNT)]
+    size = len(stanzas[0])
+
+    high_watermark = 10 * size
+    low_watermark = 3 * size
+
+    sink = xmpp_test_common.GatedSink()
+
+    writer = xmpp_test_common.new_writer(
+        sink,
+        high_watermark=high_watermark,
+        low_watermark=low_watermark
+        )
+
+    # first object is taken by writer, which is blocked in write()
+    jobs = [writer.send(stanzas[0])]
+
+    time_start = time.monotonic()
+    while (writer.get_output_queue_stat()['objects'] != 0
+            and time.monotonic() - time_start < 5):
+        time.sleep(0.01)
+
+    def producer():
+        for i in stanzas[1:]:
+            jobs.append(writer.send(i))
+
+    producer_thread = threading.Thread(target=producer)
+    producer_thread.start()
+
+    time.sleep(0.5)
+
+    queue_stat = writer.get_output_queue_stat()
+
+    print("blocked output:")
+
+    check("producer is blocked", producer_thread.is_alive())
+    check("backpressure is on", queue_stat['backpressure'])
+    check(
+        "queued bytes reached high watermark",
+        high_watermark <= queue_stat['bytes'] < high_watermark + size
+        )
+    check("objects sent before block", len(jobs) == 11)
+
+    sink.gate.set()
+
+    producer_thread.join(10)
+
+    for i in jobs:
+        i.wait(10)
+
+    print("released output:")
+
+    check("producer is done", not producer_thread.is_alive())
+    check(
+        "all jobs are done without error",
+        len(jobs) == COUNT
+        and all(i.is_done() and i.error is None for i in jobs)
+        )
+    check(
+        "objects are written in order",
+        b''.join(sink.written) == bytes(''.join(stanzas), 'utf-8')
+        )
+    check(
+        "backpressure is off",
+        not writer.get_output_queue_stat()['backpressure']
+        )
+
+    writer.stop()
+
+    print("send() time per object by queue length:")
+
+    for count in [1000, 10000, 100000]:
+
+        sink = xmpp_test_common.GatedSink()
+        writer = xmpp_test_common.new_writer(
+            sink,
+            high_watermark=(1024 ** 3)
+            )
+
+        time_start = time.monotonic()
+        for i in range(count):
+            writer.send(stanzas[0])
+        time_spent = time.monotonic() - time_start
+
+        sink.gate.set()
+        writer.stop()
+
+        print(
+            "    {:6} objects: {:.2f} us".format(
+                count,
+                time_spent / count * 1000000
+                )
+            )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
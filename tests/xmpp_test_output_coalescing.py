@@ -0,0 +1,174 @@
+
+"""
+Checks write coalescing of wayround_i2p.xmpp.core.XMPPOutputStreamWriter:
+objects queued while output is busy must be joined into writes not larger
+than coalesce_max_bytes, in order, each object still reported to parser
+target, and counters must add up. With coalesce_delay, objects sent with
+small pauses must be joined too.
+
+Prints number of writes with and without coalescing.
+
+usage: xmpp_test_output_coalescing.py
+"""
+
+import logging
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+STANZA = (
+    '<message to="someone@example.org" type="chat">'
+    '<body>some text to be sent {:05}</body></message>'
+    )
+
+COUNT = 1000
+
+MAX_BYTES = 4096
+
+
+def new_writer(sink, **kwargs):
+
+    target = wayround_i2p.xmpp.core.XMPPStreamParserTarget()
+
+    reported = []
+
+    target.signal.connect(
+        'element_readed',
+        lambda signal_name, parser_target, element: reported.append(
+            element.find('body').text
+            )
+        )
+
+    ret = xmpp_test_common.new_writer(sink, xml_target=target, **kwargs)
+
+    ret.send(
+        wayround_i2p.xmpp.core.start_stream_tpl(
+            'test@example.org', 'example.org'
+            )
+        )
+
+    return ret, reported
+
+
+def main():
+
+    check = xmpp_test_common.Checks()
+
+    stanzas = [STANZA.format(i) for i in range(COUNT)]
+    expected_reported = [
+        'some text to be sent {:05}'.format(i) for i in range(COUNT)
+        ]
+
+    for coalesce in [False, True]:
+
+        sink = xmpp_test_common.GatedSink()
+
+        writer, reported = new_writer(
+            sink,
+            coalesce=coalesce,
+            coalesce_max_bytes=MAX_BYTES
+            )
+
+        # elements, as str stanzas are not reported without reparse
+        jobs = [writer.send(lxml.etree.fromstring(i)) for i in stanzas]
+
+        sink.gate.set()
+
+        for i in jobs:
+            i.wait(10)
+
+        writer.stop()
+
+        stat = writer.get_output_stat()
+
+        # stream header is written first, and may be coalesced with
+        # first objects
+        written = sink.written
+
+        print(
+            "coalesce={}: {} objects in {} writes".format(
+                coalesce, COUNT, len(written) - 1
+                )
+            )
+
+        check(
+            "objects are written in order",
+            b''.join(written).endswith(bytes(''.join(stanzas), 'utf-8'))
+            )
+        check("all objects reported", reported == expected_reported)
+        check(
+            "writes not larger than coalesce_max_bytes",
+            all(len(i) <= MAX_BYTES for i in written)
+            )
+        check(
+            "counters add up",
+            stat['objects'] == COUNT + 1
+            and stat['writes'] == len(written)
+            and (stat['coalesced_objects']
+                 + stat['writes'] - stat['coalesced_writes']
+                 == stat['objects'])
+            )
+
+        if coalesce:
+            check(
+                "writes are coalesced",
+                stat['coalesced_writes'] > 0
+                and len(written) < COUNT // 10
+                )
+        else:
+            check("writes are not coalesced", len(written) == COUNT + 1)
+
+    sink = xmpp_test_common.GatedSink()
+    sink.gate.set()
+
+    writer, reported = new_writer(
+        sink,
+        coalesce=True,
+        coalesce_max_bytes=MAX_BYTES,
+        coalesce_delay=0.1
+        )
+
+    time.sleep(0.2)
+
+    time_start = time.monotonic()
+
+    jobs = []
+    for i in stanzas[:10]:
+        jobs.append(writer.send(i))
+        time.sleep(0.001)
+
+    jobs[0].wait(10)
+    first_done = time.monotonic() - time_start
+
+    for i in jobs:
+        i.wait(10)
+
+    writer.stop()
+
+    written = sink.written[1:]
+
+    print(
+        "coalesce_delay=0.1: 10 objects in {} writes, first done"
+        " in {:.0f} ms".format(
+            len(written),
+            first_done * 1000
+            )
+        )
+
+    check("paced objects are coalesced", len(written) < 10)
+    check(
+        "objects are written in order",
+        b''.join(written) == bytes(''.join(stanzas[:10]), 'utf-8')
+        )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
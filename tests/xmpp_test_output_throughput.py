@@ -0,0 +1,161 @@
+
+"""
+Compares queued XMPPOutputStreamWriter.send() with old way of sending, where
+each layer (client, io machine and stream machine) started new thread for
+every outgoing stanza.
+
+Prints messages per second on burst and peak thread count at 1000 msg/s.
+Queued writer is measured feeding written data to parser, and reporting
+it to parser target directly (xml_target passed, default of stream
+machines), which must be faster for both str and element stanzas.
+"""
+
+import logging
+import threading
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+
+BURST_COUNT = 20000
+RATE = 1000
+RATE_SECONDS = 3
+
+STANZA = (
+    '<message to="someone@example.org" type="chat">'
+    '<body>some text to be sent</body></message>'
+    )
+
+STANZA_ELEMENT = lxml.etree.fromstring(STANZA)
+
+
+class Sink:
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+
+def threaded_send(writer, obj, layers=3):
+    """
+    Emulation of thread per layer per send
+    """
+    if layers == 0:
+        writer.send(obj)
+    else:
+        threading.Thread(
+            target=threaded_send,
+            args=(writer, obj, layers - 1)
+            ).start()
+    return
+
+
+def new_writer(mode):
+
+    target = wayround_i2p.xmpp.core.XMPPStreamParserTarget()
+    parser = lxml.etree.XMLParser(target=target, huge_tree=True)
+
+    if mode == 'queued, direct':
+        writer = wayround_i2p.xmpp.core.XMPPOutputStreamWriter(
+            Sink(),
+            parser,
+            xml_target=target
+            )
+    else:
+        writer = wayround_i2p.xmpp.core.XMPPOutputStreamWriter(Sink(), parser)
+    writer.start()
+    writer.send(
+        wayround_i2p.xmpp.core.start_stream_tpl(
+            'test@example.org', 'example.org'
+            )
+        ).wait()
+
+    return writer
+
+
+def burst(mode, obj):
+
+    writer = new_writer(mode)
+
+    time_start = time.monotonic()
+
+    for i in range(BURST_COUNT):
+        if mode == 'threaded':
+            threaded_send(writer, obj)
+        else:
+            writer.send(obj)
+
+    while threading.active_count() > 2:
+        time.sleep(0.001)
+
+    writer.send('').wait()
+
+    time_spent = time.monotonic() - time_start
+
+    writer.stop()
+
+    return BURST_COUNT / time_spent
+
+
+def paced(mode):
+
+    writer = new_writer(mode)
+
+    peak = [threading.active_count()]
+    stop_flag = threading.Event()
+
+    def monitor():
+        while not stop_flag.is_set():
+            peak[0] = max(peak[0], threading.active_count())
+            time.sleep(0.001)
+
+    monitor_thread = threading.Thread(target=monitor)
+    monitor_thread.start()
+
+    time_start = time.monotonic()
+
+    for i in range(RATE * RATE_SECONDS):
+
+        if mode == 'threaded':
+            threaded_send(writer, STANZA)
+        else:
+            writer.send(STANZA)
+
+        delay = time_start + (i + 1) / RATE - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    stop_flag.set()
+    monitor_thread.join()
+
+    writer.stop()
+
+    # minus main, writer and monitor threads
+    return peak[0] - 3
+
+
+def main():
+
+    for mode in ['threaded', 'queued', 'queued, direct']:
+        print("{}:".format(mode))
+        print("    burst, str: {:.0f} msg/s".format(burst(mode, STANZA)))
+        print(
+            "    burst, element: {:.0f} msg/s".format(
+                burst(mode, STANZA_ELEMENT)
+                )
+            )
+        print(
+            "    peak extra threads at {} msg/s: {}".format(RATE, paced(mode))
+            )
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
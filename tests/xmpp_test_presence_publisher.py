@@ -0,0 +1,107 @@
+
+"""
+Simulates bot, changing its status very often, publishing through
+wayround_i2p.xmpp.client.PresencePublisher, and prints how many presences
+reached Presence.presence() and publisher counters.
+
+Presence.presence() is replaced by recording function, so no connection
+is needed. It also checks, that publisher lock is not held while
+presence is sent.
+
+usage: xmpp_test_presence_publisher.py [seconds [rate [burst]]]
+"""
+
+import logging
+import sys
+import time
+
+import wayround_i2p.xmpp.client
+
+
+def main():
+
+    seconds = 3.0
+    rate = 1.0
+    burst = 5
+
+    if len(sys.argv) > 1:
+        seconds = float(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        rate = float(sys.argv[2])
+
+    if len(sys.argv) > 3:
+        burst = int(sys.argv[3])
+
+    sent = []
+    sent_under_lock = []
+
+    def record(**kwargs):
+        # publisher lock is not reentrant: acquiring it here fails, if
+        # presence is sent with it held
+        if publisher._lock.acquire(timeout=1):
+            publisher._lock.release()
+        else:
+            sent_under_lock.append(kwargs)
+        sent.append((time.monotonic(), kwargs['show'], kwargs['status']))
+
+    presence = wayround_i2p.xmpp.client.Presence.__new__(
+        wayround_i2p.xmpp.client.Presence
+        )
+    presence.presence = record
+
+    publisher = wayround_i2p.xmpp.client.PresencePublisher(
+        presence,
+        rate=rate,
+        burst=burst
+        )
+
+    shows = [None, 'away', 'away', 'dnd']
+
+    i = 0
+    time_start = time.monotonic()
+    while time.monotonic() - time_start < seconds:
+        # many repeated states, as from status updating loop
+        publisher.publish(
+            show=shows[(i // 100) % len(shows)],
+            status='queue length {}'.format(i // 250)
+            )
+        i += 1
+        time.sleep(0.001)
+
+    last_state = (
+        shows[((i - 1) // 100) % len(shows)],
+        'queue length {}'.format((i - 1) // 250)
+        )
+
+    time.sleep(1 / rate + 0.2)
+
+    print("published {} in {:.1f} s".format(i, seconds))
+    print(
+        "sent {} ({:.2f} per second, limit {} per second, burst {})".format(
+            len(sent),
+            len(sent) / seconds,
+            rate,
+            burst
+            )
+        )
+    print("last state sent: {}".format(sent[-1][1:] == last_state))
+    print(
+        "sent with publisher lock held: {}".format(len(sent_under_lock))
+        )
+
+    for k, v in sorted(publisher.get_stat().items()):
+        print("    {:22}: {}".format(k, v))
+
+    ret = 0
+
+    if sent[-1][1:] != last_state or len(sent_under_lock) != 0:
+        print("FAILED")
+        ret = 1
+
+    return ret
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
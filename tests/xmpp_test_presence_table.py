@@ -0,0 +1,135 @@
+
+"""
+Presence flood on wayround_i2p.xmpp.client.PresenceTable: applies received
+presence stanzas from many resources of many contacts in several threads,
+checks, that best resource index is consistent with resources, and prints
+update and get_best() times.
+
+usage: xmpp_test_presence_table.py [contacts [resources [stanzas]]]
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+import timeit
+
+import lxml.etree
+
+import wayround_i2p.xmpp.client
+import wayround_i2p.xmpp.core
+
+
+THREADS = 8
+
+
+def make_stanzas(contacts, resources, count):
+
+    rnd = random.Random(1)
+
+    ret = []
+
+    for i in range(count):
+
+        from_jid = 'contact{}@example.org/res{}'.format(
+            rnd.randrange(contacts),
+            rnd.randrange(resources)
+            )
+
+        if rnd.random() < 0.2:
+            text = (
+                '<presence xmlns="jabber:client" from="{}"'
+                ' type="unavailable"/>'.format(from_jid)
+                )
+        else:
+            text = (
+                '<presence xmlns="jabber:client" from="{}">'
+                '<show>{}</show><status>status {}</status>'
+                '<priority>{}</priority></presence>'.format(
+                    from_jid,
+                    rnd.choice(['away', 'chat', 'dnd', 'xa']),
+                    i,
+                    rnd.randrange(-10, 11)
+                    )
+                )
+
+        ret.append(
+            wayround_i2p.xmpp.core.LazyStanza(lxml.etree.fromstring(text))
+            )
+
+    return ret
+
+
+def main():
+
+    contacts = 1000
+    resources = 5
+    count = 200000
+
+    if len(sys.argv) > 1:
+        contacts = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        resources = int(sys.argv[2])
+
+    if len(sys.argv) > 3:
+        count = int(sys.argv[3])
+
+    stanzas = make_stanzas(contacts, resources, count)
+
+    table = wayround_i2p.xmpp.client.PresenceTable()
+
+    def worker(part):
+        for i in part:
+            table.update_from_stanza(i)
+
+    threads = []
+    for i in range(THREADS):
+        threads.append(
+            threading.Thread(target=worker, args=(stanzas[i::THREADS],))
+            )
+
+    time_start = time.monotonic()
+
+    for i in threads:
+        i.start()
+
+    for i in threads:
+        i.join()
+
+    time_spent = time.monotonic() - time_start
+
+    errors = 0
+    for i in table.get_available_jids():
+        best = max(table.get_resources(i), key=lambda x: x._rank)
+        if table.get_best(i) is not best:
+            errors += 1
+
+    print("{} presences in {} threads".format(count, THREADS))
+    print("    available contacts: {}".format(len(table)))
+    print("    index errors:       {}".format(errors))
+    print(
+        "    update:             {:.2f} us per presence".format(
+            time_spent / count * 1000000
+            )
+        )
+
+    jid = table.get_available_jids()[0]
+
+    print(
+        "    get_best():         {:.2f} us".format(
+            timeit.timeit(lambda: table.get_best(jid), number=100000) * 10
+            )
+        )
+
+    ret = 0
+    if errors != 0:
+        ret = 1
+
+    return ret
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
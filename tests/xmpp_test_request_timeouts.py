@@ -0,0 +1,246 @@
+
+"""
+Checks wayround_i2p.xmpp.core.TimerWheel and timeouts of
+wayround_i2p.xmpp.core.StanzaProcessor.send_request(): timers must fire
+after their timeouts (also timeouts longer than one wheel turn), removed
+timers must not fire, wheel thread must exit when no timers left, and
+requests must be forgotten on response, timeout, cancel and send error.
+Pending requests of many processors must be timed by one thread.
+
+Prints timer add/remove time and time to expire many pending requests.
+
+Stream is replaced by object with signal, so no connection is needed.
+
+usage: xmpp_test_request_timeouts.py [requests]
+"""
+
+import concurrent.futures
+import logging
+import sys
+import threading
+import time
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+RESOLUTION = 0.05
+
+PROCESSORS = 300
+
+
+def new_request():
+    return wayround_i2p.xmpp.core.Stanza(
+        tag='iq',
+        typ='get',
+        to_jid='example.org',
+        objects=[
+            wayround_i2p.xmpp.core.IQRoster()
+            ]
+        )
+
+
+def main():
+
+    requests = 10000
+
+    if len(sys.argv) > 1:
+        requests = int(sys.argv[1])
+
+    check = xmpp_test_common.Checks()
+
+    print("timer wheel:")
+
+    # 8 slots of 0.05 s: wheel turn is 0.4 s
+    wheel = wayround_i2p.xmpp.core.TimerWheel(resolution=RESOLUTION, slots=8)
+
+    fired = {}
+    lock = threading.Lock()
+
+    def on_timer(name):
+        with lock:
+            fired[name] = time.monotonic() - time_start
+
+    time_start = time.monotonic()
+
+    wheel.add(0.1, on_timer, 'short')
+    removed = wheel.add(0.2, on_timer, 'removed')
+    wheel.add(0.7, on_timer, 'long')
+
+    check("remove() of pending timer", wheel.remove(removed) == True)
+
+    time.sleep(1.0)
+
+    check("timers fired", sorted(fired.keys()) == ['long', 'short'])
+    check(
+        "short timer fired in time",
+        0.1 <= fired.get('short', 0) < 0.1 + RESOLUTION * 3
+        )
+    check(
+        "timer longer than wheel turn fired in time",
+        0.7 <= fired.get('long', 0) < 0.7 + RESOLUTION * 3
+        )
+    check("remove() of removed timer", wheel.remove(removed) == False)
+    check("no timers left", len(wheel) == 0)
+    check("wheel thread exited", wheel._thread is None)
+
+    wheel = wayround_i2p.xmpp.core.TimerWheel()
+
+    handles = []
+
+    time_start = time.monotonic()
+    for i in range(requests):
+        handles.append(wheel.add(60, on_timer, i))
+    time_add = time.monotonic() - time_start
+
+    time_start = time.monotonic()
+    for i in handles:
+        wheel.remove(i)
+    time_remove = time.monotonic() - time_start
+
+    print(
+        "    add: {:.2f} us, remove: {:.2f} us".format(
+            time_add / requests * 1000000,
+            time_remove / requests * 1000000
+            )
+        )
+
+    print("send_request():")
+
+    io_machine = xmpp_test_common.FakeIOMachine()
+
+    processor = wayround_i2p.xmpp.core.StanzaProcessor(
+        dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher('inline')
+        )
+    processor.connect_io_machine(io_machine)
+
+    future = processor.send_request(new_request(), timeout=5)
+
+    ide = io_machine.sent[-1].get('id')
+
+    check("request sent with id", ide is not None)
+    check("request waits", processor.get_wait_callbacks_count() == 1)
+
+    io_machine.receive(
+        '<iq xmlns="jabber:client" from="example.org" id="{}"'
+        ' type="result"/>'.format(ide)
+        )
+
+    result = future.result(1)
+
+    check(
+        "response is result",
+        isinstance(result, wayround_i2p.xmpp.core.Stanza)
+        and result.get_ide() == ide
+        and result.get_typ() == 'result'
+        )
+    check(
+        "request forgotten on response",
+        processor.get_wait_callbacks_count() == 0
+        )
+
+    future = processor.send_request(new_request(), timeout=0.2)
+    check(
+        "timeout raises TimeoutError",
+        isinstance(
+            future.exception(5),
+            concurrent.futures.TimeoutError
+            )
+        )
+    check(
+        "request forgotten on timeout",
+        processor.get_wait_callbacks_count() == 0
+        )
+
+    future = processor.send_request(new_request(), timeout=None)
+    future.cancel()
+    check(
+        "request forgotten on cancel",
+        processor.get_wait_callbacks_count() == 0
+        )
+
+    io_machine.fail = True
+    future = processor.send_request(new_request(), timeout=5)
+    io_machine.fail = False
+    check(
+        "send error is future exception",
+        isinstance(future.exception(1), OSError)
+        )
+    check(
+        "request forgotten on send error",
+        processor.get_wait_callbacks_count() == 0
+        )
+
+    try:
+        processor.send_request(new_request(), timeout=0)
+    except ValueError:
+        result = True
+    else:
+        result = False
+    check("timeout=0 raises ValueError", result)
+
+    futures = []
+
+    time_start = time.monotonic()
+    for i in range(requests):
+        futures.append(processor.send_request(new_request(), timeout=0.5))
+    time_send = time.monotonic() - time_start
+
+    concurrent.futures.wait(futures, 10)
+    time_expire = time.monotonic() - time_start
+
+    check(
+        "all pending requests timed out",
+        all(
+            isinstance(i.exception(0), concurrent.futures.TimeoutError)
+            for i in futures
+            )
+        )
+    check(
+        "all pending requests forgotten",
+        processor.get_wait_callbacks_count() == 0
+        )
+
+    print(
+        "    {} requests: {:.1f} us per send_request(),"
+        " all expired in {:.2f} s".format(
+            requests,
+            time_send / requests * 1000000,
+            time_expire
+            )
+        )
+
+    print("many processors:")
+
+    threads = threading.active_count()
+
+    futures = []
+    for i in range(PROCESSORS):
+        processor = wayround_i2p.xmpp.core.StanzaProcessor(
+            dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher('inline')
+            )
+        processor.connect_io_machine(xmpp_test_common.FakeIOMachine())
+        futures.append(processor.send_request(new_request(), timeout=0.5))
+
+    check(
+        "{} pending processors share timer thread".format(PROCESSORS),
+        threading.active_count() <= threads + 1
+        )
+
+    concurrent.futures.wait(futures, 10)
+
+    check(
+        "all timed out",
+        all(
+            isinstance(i.exception(0), concurrent.futures.TimeoutError)
+            for i in futures
+            )
+        )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,168 @@
+
+"""
+Compares roster kept as dict of dicts with sets of groups (as
+Roster._item_element_to_dict() makes) with
+wayround_i2p.xmpp.roster.MemoryRosterStore on synthetic roster: memory
+used, time of "who is in group" and "who has subscription 'both'"
+questions and time of roster push.
+
+usage: xmpp_test_roster_indexes.py [count]
+"""
+
+import logging
+import sys
+import timeit
+import tracemalloc
+
+import wayround_i2p.xmpp.roster
+
+
+SUBSCRIPTIONS = ['both', 'from', 'none', 'to']
+
+
+def make_item_args(count):
+
+    ret = []
+
+    for i in range(count):
+        ret.append(
+            {
+                'jid': 'contact{}@example{}.org'.format(i, i % 50),
+                'name': 'Contact {}'.format(i),
+                'subscription': SUBSCRIPTIONS[i % len(SUBSCRIPTIONS)],
+                'ask': (i % 10 == 0 and 'subscribe' or None),
+                'approved': False,
+                # new str objects for each item, as when parsed from XML
+                'groups': [
+                    ''.join(['Group ', str(i % 30)]),
+                    ''.join(['Team ', str(i % 7)])
+                    ]
+                }
+            )
+
+    return ret
+
+
+def make_dicts(item_args):
+
+    ret = {}
+
+    for i in item_args:
+        ret[i['jid']] = {
+            'groups':       set(i['groups']),
+            'approved':     i['approved'],
+            'ask':          i['ask'],
+            'name':         i['name'],
+            'subscription': i['subscription']
+            }
+
+    return ret
+
+
+def make_store(item_args):
+
+    ret = wayround_i2p.xmpp.roster.MemoryRosterStore()
+
+    ret.replace(
+        [wayround_i2p.xmpp.roster.RosterItem(**i) for i in item_args]
+        )
+
+    return ret
+
+
+def measure_memory(func):
+
+    tracemalloc.start()
+    ret = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return ret, size
+
+
+def main():
+
+    count = 50000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    number = 20
+
+    # arguments are made inside of measurement, so memory of strings kept
+    # by each representation is counted
+
+    dicts, dicts_size = measure_memory(
+        lambda: make_dicts(make_item_args(count))
+        )
+    store, store_size = measure_memory(
+        lambda: make_store(make_item_args(count))
+        )
+
+    item_args = make_item_args(2)
+
+    print("roster of {} items".format(count))
+
+    print("memory (store includes indexes):")
+    print("    dicts: {:.1f} MiB".format(dicts_size / 1024 / 1024))
+    print("    store: {:.1f} MiB".format(store_size / 1024 / 1024))
+
+    tests = [
+        (
+            'group',
+            lambda: set(
+                k for k, v in dicts.items() if 'Group 7' in v['groups']
+                ),
+            lambda: store.get_jids_by_group('Group 7')
+            ),
+        (
+            'subscription',
+            lambda: set(
+                k for k, v in dicts.items() if v['subscription'] == 'both'
+                ),
+            lambda: store.get_jids_by_subscription('both')
+            ),
+        (
+            'ask',
+            lambda: set(
+                k for k, v in dicts.items() if v['ask'] == 'subscribe'
+                ),
+            lambda: store.get_jids_by_ask('subscribe')
+            )
+        ]
+
+    for name, scan, lookup in tests:
+
+        if scan() != lookup():
+            print("{}: results differ".format(name))
+            return 1
+
+        print("{} (scan / index):".format(name))
+        print(
+            "    {:.3f} ms / {:.3f} ms".format(
+                timeit.timeit(scan, number=number) / number * 1000,
+                timeit.timeit(lookup, number=number) / number * 1000
+                )
+            )
+
+    push = [
+        wayround_i2p.xmpp.roster.RosterItem(
+            jid=item_args[1]['jid'],
+            subscription='both',
+            groups=['Group 0']
+            )
+        ]
+
+    print("push:")
+    print(
+        "    {:.3f} ms".format(
+            timeit.timeit(lambda: store.update(push), number=number)
+            / number * 1000
+            )
+        )
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
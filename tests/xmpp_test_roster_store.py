@@ -0,0 +1,140 @@
+
+"""
+Measures roster stores from wayround_i2p.xmpp.roster on synthetic roster:
+time to save full roster, to apply push and to load roster on
+reconnection, and size of full roster result compared with versioned
+result, which server sends if roster did not change.
+
+Also checks, that both stores pass is_roster_store() check, used by
+wayround_i2p.xmpp.client.Roster.
+
+usage: xmpp_test_roster_store.py [count]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+import wayround_i2p.xmpp.roster
+
+
+def make_items(count):
+
+    ret = []
+
+    for i in range(count):
+        ret.append(
+            wayround_i2p.xmpp.core.IQRosterItem(
+                jid='contact{}@example{}.org'.format(i, i % 50),
+                group=['Group {}'.format(i % 20)],
+                name='Contact {}'.format(i),
+                subscription='both'
+                )
+            )
+
+    return ret
+
+
+def main():
+
+    count = 5000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    items = make_items(count)
+
+    full_result = wayround_i2p.xmpp.core.Stanza(
+        tag='iq',
+        typ='result',
+        ide='roster-1',
+        objects=[wayround_i2p.xmpp.core.IQRoster(item=items, ver='v1')]
+        ).to_bytes()
+
+    versioned_result = wayround_i2p.xmpp.core.Stanza(
+        tag='iq',
+        typ='result',
+        ide='roster-1'
+        ).to_bytes()
+
+    print("roster of {} items".format(count))
+    print("    full result:      {} bytes".format(len(full_result)))
+    print("    versioned result: {} bytes".format(len(versioned_result)))
+
+    push = wayround_i2p.xmpp.core.IQRoster.new_from_element(
+        lxml.etree.fromstring(
+            '<query xmlns="jabber:iq:roster" ver="v2">'
+            '<item jid="contact1@example1.org" subscription="remove"/>'
+            '</query>'
+            )
+        )
+
+    fd, filename = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+
+    ret = 0
+
+    try:
+
+        for name, new_store in [
+                ('memory', wayround_i2p.xmpp.roster.MemoryRosterStore),
+                ('sqlite', lambda: wayround_i2p.xmpp.roster.SQLiteRosterStore(
+                    filename
+                    ))
+                ]:
+
+            store = new_store()
+
+            time_start = time.monotonic()
+            store.replace(items, 'v1')
+            time_replace = time.monotonic() - time_start
+
+            time_start = time.monotonic()
+            store.update(push.get_item(), push.get_ver())
+            time_update = time.monotonic() - time_start
+
+            time_start = time.monotonic()
+            reloaded = new_store()
+            time_load = time.monotonic() - time_start
+
+            is_store = wayround_i2p.xmpp.roster.is_roster_store(store)
+
+            print("{}:".format(name))
+            print("    is roster store: {}".format(is_store))
+            print("    replace: {:.1f} ms".format(time_replace * 1000))
+            print("    push:    {:.2f} ms".format(time_update * 1000))
+            print(
+                "    load:    {:.1f} ms, {} items, ver {}".format(
+                    time_load * 1000,
+                    len(reloaded),
+                    reloaded.get_ver()
+                    )
+                )
+
+            if not is_store:
+                ret = 1
+
+            if isinstance(store, wayround_i2p.xmpp.roster.SQLiteRosterStore):
+                store.close()
+                reloaded.close()
+
+    finally:
+        os.unlink(filename)
+
+    if wayround_i2p.xmpp.roster.is_roster_store({}):
+        print("dict is considered roster store")
+        ret = 1
+
+    if ret != 0:
+        print("FAILED")
+
+    return ret
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
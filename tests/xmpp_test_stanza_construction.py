@@ -0,0 +1,87 @@
+
+"""
+Measures time and allocated memory per constructed stanza in each
+validation mode of wayround_i2p.xmpp.core.Stanza, for stanzas built with
+constructor and for stanzas parsed with new_from_element() and
+serialized back with gen_element().
+"""
+
+import logging
+import timeit
+import tracemalloc
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+
+COUNT = 10000
+
+ELEMENT = lxml.etree.fromstring(
+    '<message xmlns="jabber:client" id="stanza-1" from="a@example.org/r"'
+    ' to="b@example.org" type="chat"><thread>t1</thread>'
+    '<body>Some message text</body></message>'
+    )
+
+
+def construct(validation):
+    return wayround_i2p.xmpp.core.Stanza(
+        tag='message',
+        ide='stanza-1',
+        from_jid='a@example.org/r',
+        to_jid='b@example.org',
+        typ='chat',
+        body=[wayround_i2p.xmpp.core.MessageBody('Some message text')],
+        validation=validation
+        )
+
+
+def parse_and_generate(validation):
+    return wayround_i2p.xmpp.core.Stanza.new_from_element(
+        ELEMENT,
+        validation=validation
+        ).gen_element()
+
+
+def measure(func, validation):
+
+    time_spent = timeit.timeit(lambda: func(validation), number=COUNT)
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    result = func(validation)
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+
+    return (
+        time_spent / COUNT * 1000000,
+        sum(i.count_diff for i in stats),
+        sum(i.size_diff for i in stats)
+        )
+
+
+def main():
+
+    for func in [construct, parse_and_generate]:
+
+        print("{}:".format(func.__name__))
+
+        for validation in wayround_i2p.xmpp.core.STANZA_VALIDATION_MODES:
+            us, blocks, size = measure(func, validation)
+            print(
+                "    {:8}: {:8.2f} us, {} blocks, {} bytes kept".format(
+                    validation,
+                    us,
+                    blocks,
+                    size
+                    )
+                )
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
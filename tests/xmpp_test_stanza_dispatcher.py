@@ -0,0 +1,253 @@
+
+"""
+Checks modes of wayround_i2p.xmpp.core.StanzaDispatcher: all dispatched
+calls must be done, 'inline' calls must be done in dispatching thread,
+'ordered' calls with same key must be done in order of dispatch(), and
+dispatcher must work again after stop().
+
+dispatch() must not block stream reader: callback, waiting for response
+while its lane is flooded, must get response as soon as reader gets it.
+
+Prints time per dispatched call in each mode.
+
+usage: xmpp_test_stanza_dispatcher.py [calls [keys]]
+"""
+
+import logging
+import queue
+import sys
+import threading
+import time
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+FLOOD = 20
+
+
+class ReaderIOMachine(xmpp_test_common.FakeIOMachine):
+
+    """
+    receive()s texts in own thread, as stream reader. Answers iq stanzas
+    after FLOOD messages
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.incoming = queue.Queue()
+        self.thread = threading.Thread(target=self._reader)
+        self.thread.start()
+        return
+
+    def _reader(self):
+        while True:
+            text = self.incoming.get()
+            if text is None:
+                break
+            self.receive(text)
+        return
+
+    def send(self, obj):
+
+        super().send(obj)
+
+        if obj.tag == 'iq':
+
+            for i in range(FLOOD):
+                self.incoming.put(
+                    '<message xmlns="jabber:client" from="a@example.org/r"'
+                    ' id="flood{}"><body>flood</body></message>'.format(i)
+                    )
+
+            self.incoming.put(
+                '<iq xmlns="jabber:client" from="example.org" id="{}"'
+                ' type="result"/>'.format(obj.get('id'))
+                )
+
+        return
+
+    def stop(self):
+        self.incoming.put(None)
+        self.thread.join()
+        return
+
+
+def main():
+
+    count = 20000
+    keys = 50
+
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        keys = int(sys.argv[2])
+
+    check = xmpp_test_common.Checks()
+
+    for mode in ['inline', 'thread', 'pool', 'ordered']:
+
+        dispatcher = wayround_i2p.xmpp.core.StanzaDispatcher(
+            mode,
+            workers=4,
+            queue_size=1000
+            )
+
+        lock = threading.Lock()
+        done = threading.Event()
+        calls = []
+        threads = set()
+
+        def callback(key, number):
+            with lock:
+                calls.append((key, number))
+                threads.add(threading.current_thread())
+                if len(calls) == count:
+                    done.set()
+
+        time_start = time.monotonic()
+
+        for i in range(count):
+            key = 'contact{}@example.org/res'.format(i % keys)
+            dispatcher.dispatch(key, callback, key, i)
+
+        all_done = done.wait(60)
+
+        time_spent = time.monotonic() - time_start
+
+        dispatcher.stop()
+
+        print(
+            "{}: {:.1f} us per call".format(
+                mode,
+                time_spent / count * 1000000
+                )
+            )
+
+        check("all calls done", all_done and len(calls) == count)
+        check(
+            "stat counts calls",
+            dispatcher.get_stat()['dispatched'] == count
+            )
+
+        if mode == 'inline':
+            check(
+                "calls done in dispatching thread",
+                threads == set([threading.current_thread()])
+                )
+
+        if mode == 'ordered':
+
+            last = {}
+            in_order = True
+            for key, number in calls:
+                if last.get(key, -1) > number:
+                    in_order = False
+                last[key] = number
+
+            check("calls with same key done in order", in_order)
+            check("calls done by several workers", len(threads) > 1)
+
+        if mode in ['pool', 'ordered']:
+
+            check(
+                "worker threads exit on stop()",
+                not any(i.is_alive() for i in threads)
+                )
+
+            # dispatcher must be usable again after stop()
+            again = threading.Event()
+            dispatcher.dispatch('key', again.set)
+            check("dispatch works after stop()", again.wait(10))
+            dispatcher.stop()
+
+    # exceptions in callbacks must not stop workers
+
+    dispatcher = wayround_i2p.xmpp.core.StanzaDispatcher('pool', workers=1)
+
+    def fail():
+        raise Exception("test exception")
+
+    after_error = threading.Event()
+
+    logging.disable(logging.ERROR)
+    dispatcher.dispatch('key', fail)
+    dispatcher.dispatch('key', after_error.set)
+    check("worker survives callback error", after_error.wait(10))
+    dispatcher.stop()
+    logging.disable(logging.NOTSET)
+
+    print("response while lane is flooded:")
+
+    io_machine = ReaderIOMachine()
+
+    processor = wayround_i2p.xmpp.core.StanzaProcessor(
+        dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher(
+            'ordered',
+            workers=1,
+            queue_size=4
+            )
+        )
+    processor.connect_io_machine(io_machine)
+
+    response = []
+    flood = []
+    flood_done = threading.Event()
+
+    def on_new_stanza(signal_name, stanza_processor, stanza):
+
+        if stanza.get_ide() == 'trigger':
+            time_start = time.monotonic()
+            response.append(
+                processor.send(
+                    wayround_i2p.xmpp.core.Stanza(
+                        tag='iq',
+                        typ='get',
+                        to_jid='example.org'
+                        ),
+                    wait=5
+                    )
+                )
+            response.append(time.monotonic() - time_start)
+
+        elif stanza.get_ide().startswith('flood'):
+            flood.append(stanza.get_ide())
+            if len(flood) == FLOOD:
+                flood_done.set()
+
+    processor.signal.connect('new_stanza', on_new_stanza)
+
+    io_machine.incoming.put(
+        '<message xmlns="jabber:client" from="a@example.org/r"'
+        ' id="trigger"><body>trigger</body></message>'
+        )
+
+    flood_done.wait(10)
+
+    io_machine.stop()
+    processor.dispatcher.stop()
+
+    check(
+        "response received",
+        len(response) == 2
+        and isinstance(response[0], wayround_i2p.xmpp.core.Stanza)
+        and response[0].get_typ() == 'result'
+        )
+    check("response received in time", len(response) == 2 and response[1] < 1)
+    check(
+        "flood delivered in order",
+        flood == ['flood{}'.format(i) for i in range(FLOOD)]
+        )
+    check(
+        "overflows counted",
+        processor.dispatcher.get_stat()['overflows'] > 0
+        )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
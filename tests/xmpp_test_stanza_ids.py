@@ -0,0 +1,151 @@
+
+"""
+Checks wayround_i2p.xmpp.core.StanzaIDGenerator: ids must be unique when
+generated from many threads, have expected format (also in compact mode),
+differ between generators, and be used by StanzaProcessor.send().
+
+Prints id generation time compared with previous uuid4 per stanza scheme.
+
+usage: xmpp_test_stanza_ids.py [ids]
+"""
+
+import logging
+import sys
+import threading
+import timeit
+import uuid
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+THREADS = 8
+
+
+def main():
+
+    count = 100000
+
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    check = xmpp_test_common.Checks()
+
+    print("ids:")
+
+    for compact in [False, True]:
+
+        generator = wayround_i2p.xmpp.core.StanzaIDGenerator(compact=compact)
+
+        results = []
+
+        def worker():
+            results.append([generator() for i in range(count // THREADS)])
+
+        threads = []
+        for i in range(THREADS):
+            threads.append(threading.Thread(target=worker))
+
+        for i in threads:
+            i.start()
+
+        for i in threads:
+            i.join()
+
+        ids = []
+        for i in results:
+            ids += i
+
+        prefix, counter = ids[0].split('-')
+
+        # compact prefix has no leading zeros, so it can be shorter
+        if compact:
+            base = 32
+            prefix_length = 16
+        else:
+            base = 16
+            prefix_length = 32
+
+        check(
+            "compact={}: unique from {} threads".format(compact, THREADS),
+            len(set(ids)) == len(ids) == (count // THREADS) * THREADS
+            )
+        check(
+            "compact={}: prefix and counter".format(compact),
+            0 < len(prefix) <= prefix_length
+            and all(i.startswith(prefix + '-') for i in ids)
+            and sorted(int(i.split('-')[1], base) for i in ids)
+            == list(range(1, len(ids) + 1))
+            )
+        check(
+            "compact={}: new prefix per generator".format(compact),
+            wayround_i2p.xmpp.core.StanzaIDGenerator(compact=compact).prefix
+            != prefix
+            )
+
+    check(
+        "int_to_base32()",
+        all(
+            int(wayround_i2p.xmpp.core.int_to_base32(i), 32) == i
+            for i in list(range(1000)) + [2 ** 80 - 1, 2 ** 127]
+            )
+        )
+
+    generator = wayround_i2p.xmpp.core.StanzaIDGenerator('test', start=5)
+    check(
+        "explicit prefix and start",
+        [generator(), generator()] == ['test-5', 'test-6']
+        )
+
+    io_machine = xmpp_test_common.FakeIOMachine()
+
+    processor = wayround_i2p.xmpp.core.StanzaProcessor(
+        dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher('inline'),
+        id_generator=wayround_i2p.xmpp.core.StanzaIDGenerator('replay')
+        )
+    processor.connect_io_machine(io_machine)
+
+    ide = processor.send(
+        wayround_i2p.xmpp.core.Stanza(tag='message', typ='chat'),
+        ide_mode='generate_implicit'
+        )
+
+    check(
+        "StanzaProcessor uses id_generator",
+        ide == 'replay-1' and io_machine.sent[0].get('id') == 'replay-1'
+        )
+
+    print("generation time:")
+
+    old_counter = [0]
+
+    def old_scheme():
+        old_counter[0] += 1
+        return '{}-stanza-{}'.format(uuid.uuid4().hex, hex(old_counter[0]))
+
+    for name, function in [
+            ('uuid4 per stanza', old_scheme),
+            (
+                'StanzaIDGenerator()',
+                wayround_i2p.xmpp.core.StanzaIDGenerator()
+                ),
+            (
+                'StanzaIDGenerator(compact=True)',
+                wayround_i2p.xmpp.core.StanzaIDGenerator(compact=True)
+                )
+            ]:
+        print(
+            "    {:32}: {:.3f} us, {} chars".format(
+                name,
+                timeit.timeit(function, number=count) / count * 1000000,
+                len(function())
+                )
+            )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,157 @@
+
+"""
+Checks routing of received stanzas by
+wayround_i2p.xmpp.core.StanzaProcessor.add_route(): callbacks must get only
+stanzas matching tag, type and child element, each matching callback must
+be called once per stanza, 'new_stanza' signal must still get every
+stanza and removed routes must not be called.
+
+Prints route lookup time with few and with many routes.
+
+Stream is replaced by object with signal, so no connection is needed.
+
+usage: xmpp_test_stanza_routes.py
+"""
+
+import logging
+import timeit
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+DISCO_INFO = '{http://jabber.org/protocol/disco#info}query'
+
+ROSTER = '{jabber:iq:roster}query'
+
+STANZAS = [
+    '<message xmlns="jabber:client" from="a@example.org/r" id="m1"'
+    ' type="chat"><body>1</body></message>',
+    '<message xmlns="jabber:client" from="a@example.org/r" id="m2"'
+    ' type="normal"><body>2</body></message>',
+    '<iq xmlns="jabber:client" from="example.org" id="i1" type="get">'
+    '<query xmlns="http://jabber.org/protocol/disco#info"/></iq>',
+    '<iq xmlns="jabber:client" from="example.org" id="i2" type="set">'
+    '<query xmlns="jabber:iq:roster"/></iq>',
+    '<presence xmlns="jabber:client" from="b@example.org/r" id="p1"/>',
+    '<message xmlns="jabber:client" from="a@example.org/r" id="m3"'
+    ' type="chat"><body>3</body></message>'
+    ]
+
+
+class Recorder:
+
+    def __init__(self):
+        self.ids = []
+
+    def __call__(self, signal_name, stanza_processor, stanza):
+        self.ids.append(stanza.get_ide())
+        return
+
+
+def main():
+
+    check = xmpp_test_common.Checks()
+
+    io_machine = xmpp_test_common.FakeIOMachine()
+
+    processor = wayround_i2p.xmpp.core.StanzaProcessor(
+        dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher('inline')
+        )
+    processor.connect_io_machine(io_machine)
+
+    all_stanzas = Recorder()
+    chat = Recorder()
+    messages = Recorder()
+    disco_get = Recorder()
+    roster = Recorder()
+    presence = Recorder()
+    removed = Recorder()
+
+    processor.signal.connect('new_stanza', all_stanzas)
+
+    processor.add_route(chat, tag='message', typ='chat')
+    processor.add_route(messages, tag='message')
+    # same callback with overlapping route must be called once
+    processor.add_route(messages, typ='chat')
+    processor.add_route(disco_get, tag='iq', typ='get', child=DISCO_INFO)
+    processor.add_route(roster, child=ROSTER)
+    processor.add_route(presence, tag='presence')
+    processor.add_route(removed, tag='message')
+    processor.remove_route(removed, tag='message')
+
+    for i in STANZAS:
+        io_machine.receive(i)
+
+    print("routes:")
+
+    check(
+        "'new_stanza' gets all stanzas",
+        all_stanzas.ids == ['m1', 'm2', 'i1', 'i2', 'p1', 'm3']
+        )
+    check("tag and type route", chat.ids == ['m1', 'm3'])
+    check("overlapping routes call once", messages.ids == ['m1', 'm2', 'm3'])
+    check("tag, type and child route", disco_get.ids == ['i1'])
+    check("child route", roster.ids == ['i2'])
+    check("tag route", presence.ids == ['p1'])
+    check("removed route not called", removed.ids == [])
+
+    print("arguments:")
+
+    for name, kwargs, exception in [
+            ("not callable callback", {'callback': None}, TypeError),
+            ("invalid tag", {'tag': 'stream'}, ValueError),
+            ("child without namespace", {'child': 'query'}, ValueError)
+            ]:
+        if not 'callback' in kwargs:
+            kwargs['callback'] = chat
+        try:
+            processor.add_route(**kwargs)
+        except exception:
+            result = True
+        else:
+            result = False
+        check("{} raises {}".format(name, exception.__name__), result)
+
+    stanza = wayround_i2p.xmpp.core.LazyStanza(
+        lxml.etree.fromstring(STANZAS[0])
+        )
+
+    print("route lookup:")
+
+    for count in [10, 1000]:
+
+        processor = wayround_i2p.xmpp.core.StanzaProcessor(
+            dispatcher=wayround_i2p.xmpp.core.StanzaDispatcher('inline')
+            )
+
+        for i in range(count):
+            processor.add_route(
+                Recorder(),
+                tag='iq',
+                typ='get',
+                child='{{urn:example:{}}}query'.format(i)
+                )
+
+        processor.add_route(chat, tag='message', typ='chat')
+
+        number = 20000
+        print(
+            "    {:5} routes: {:.2f} us".format(
+                count,
+                timeit.timeit(
+                    lambda: processor.get_route_callbacks(stanza),
+                    number=number
+                    ) / number * 1000000
+                )
+            )
+
+    return check.result()
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
@@ -0,0 +1,130 @@
+
+"""
+Compares old stanza sending path (Stanza.to_str() and encoding of resulting
+str by output writer, which feeds it to parser) with sending of element,
+serialized once to UTF-8 bytes.
+
+Both paths are timed through XMPPOutputStreamWriter.send(), writing to null
+sink, until last stanza is written.
+
+Prints bytes copied and time spent per stanza.
+"""
+
+import logging
+import sys
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+COUNT = 10000
+
+
+def make_stanza():
+    return wayround_i2p.xmpp.core.Stanza(
+        tag='message',
+        ide='stanza-1',
+        to_jid='someone@example.org',
+        typ='chat',
+        body=[
+            wayround_i2p.xmpp.core.MessageBody(
+                'Some message text. Немного текста. ' * 10
+                )
+            ]
+        )
+
+
+class NullSink:
+
+    def write(self, data):
+        return len(data)
+
+
+def old_path(stanza):
+    """
+    Returns sizes of all buffers created on the way to socket
+    """
+
+    tostring_result = lxml.etree.tostring(stanza.gen_element())
+    text = str(tostring_result, 'utf-8')
+    data = bytes(text, encoding='utf-8')
+
+    return [
+        sys.getsizeof(tostring_result),
+        sys.getsizeof(text),
+        sys.getsizeof(data)
+        ]
+
+
+def new_path(stanza):
+
+    data = lxml.etree.tostring(stanza.gen_element(), encoding='utf-8')
+
+    return [sys.getsizeof(data)]
+
+
+def old_send(writer, stanza):
+    return writer.send(stanza.to_str())
+
+
+def new_send(writer, stanza):
+    return writer.send(stanza.gen_element())
+
+
+def time_writer(send, stanza, reparse):
+
+    writer = xmpp_test_common.new_writer(NullSink(), reparse=reparse)
+
+    # stream must be opened for parser to accept stanzas
+    writer.send(
+        wayround_i2p.xmpp.core.start_stream_tpl(
+            'someone@example.org', 'example.org'
+            )
+        ).wait()
+
+    time_start = time.monotonic()
+
+    for i in range(COUNT):
+        job = send(writer, stanza)
+
+    job.wait()
+
+    ret = time.monotonic() - time_start
+
+    writer.stop()
+
+    return ret
+
+
+def main():
+
+    stanza = make_stanza()
+
+    for name, func, send, reparse in [
+            ('old', old_path, old_send, True),
+            ('new', new_path, new_send, False)
+            ]:
+
+        copies = func(stanza)
+
+        time_spent = time_writer(send, stanza, reparse)
+
+        print("{}:".format(name))
+        print("    buffers per stanza:      {}".format(len(copies)))
+        print("    bytes copied per stanza: {}".format(sum(copies)))
+        print(
+            "    time per stanza:         {:.2f} us".format(
+                time_spent / COUNT * 1000000
+                )
+            )
+
+    return 0
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
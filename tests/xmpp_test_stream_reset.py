@@ -0,0 +1,157 @@
+
+"""
+Checks in place reset of wayround_i2p.xmpp.core.XMPPIOStreamRWMachine (as
+done after STARTTLS and SASL): output machine writes to pipe, which is read
+by input machine of same IO machine.
+
+After reset() new stream must be reported by new parser targets, with same
+stream workers (and threads) kept. reset() must return False if writer does
+not get to reset in time.
+
+Prints reset() time compared with restart() time.
+"""
+
+import logging
+import threading
+import time
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+MESSAGE = '<message id="{}"><body>text</body></message>'
+
+
+class SlowSink:
+
+    def write(self, data):
+        time.sleep(1)
+        return len(data)
+
+
+class SlowStreamer:
+    strin = SlowSink()
+
+
+def main():
+
+    check = xmpp_test_common.Checks()
+
+    events = []
+    received = threading.Condition()
+
+    def on_signal(signal_name, parser_target, *args, **kwargs):
+        with received:
+            element_id = None
+            if signal_name.endswith('element_readed'):
+                element_id = args[0].get('id')
+            events.append((signal_name, parser_target, element_id))
+            received.notify_all()
+
+    def wait_events(count):
+        with received:
+            received.wait_for(lambda: len(events) >= count, 10)
+
+    streamer = xmpp_test_common.PipeStreamer()
+
+    io_machine = wayround_i2p.xmpp.core.XMPPIOStreamRWMachine()
+    io_machine.set_objects(streamer)
+    io_machine.signal.connect(True, on_signal)
+
+    io_machine.start()
+
+    header = wayround_i2p.xmpp.core.start_stream_tpl(
+        'test@example.org', 'example.org'
+        )
+
+    io_machine.send(header)
+    # sent as element: str stanzas are not reported to output target
+    # without reparse
+    io_machine.send(lxml.etree.fromstring(MESSAGE.format('before')))
+
+    wait_events(4)
+
+    in_worker = io_machine.in_machine.stream_worker
+    out_worker = io_machine.out_machine.stream_worker
+    threads = threading.active_count()
+
+    in_target = io_machine.in_machine.xml_target
+    out_target = io_machine.out_machine.xml_target
+
+    time_start = time.monotonic()
+    reset_result = io_machine.reset()
+    time_reset = time.monotonic() - time_start
+
+    io_machine.send(header)
+    io_machine.send(lxml.etree.fromstring(MESSAGE.format('after')))
+
+    wait_events(8)
+
+    print("in place reset:")
+
+    check("reset() result", reset_result)
+    check(
+        "stream workers kept",
+        io_machine.in_machine.stream_worker is in_worker
+        and io_machine.out_machine.stream_worker is out_worker
+        )
+    check("thread count kept", threading.active_count() == threads)
+    check(
+        "parser targets replaced",
+        io_machine.in_machine.xml_target is not in_target
+        and io_machine.out_machine.xml_target is not out_target
+        )
+
+    for direction, old_target, new_target in [
+            ('in', in_target, io_machine.in_machine.xml_target),
+            ('out', out_target, io_machine.out_machine.xml_target)
+            ]:
+        for name, target, element_id in [
+                ('old', old_target, 'before'),
+                ('new', new_target, 'after')
+                ]:
+            check(
+                "{} stream: {} target events".format(direction, name),
+                [(i[0], i[2]) for i in events if i[1] is target]
+                == [
+                    (direction + '_start', None),
+                    (direction + '_element_readed', element_id)
+                    ]
+                )
+
+    time_start = time.monotonic()
+    io_machine.restart()
+    time_restart = time.monotonic() - time_start
+
+    io_machine.stop()
+    streamer.close()
+
+    print("    reset():   {:.2f} ms".format(time_reset * 1000))
+    print("    restart(): {:.2f} ms".format(time_restart * 1000))
+
+    print("reset timeout:")
+
+    out_machine = wayround_i2p.xmpp.core.XMPPStreamMachine(mode='writer')
+    out_machine.set_objects(SlowStreamer())
+    out_machine.start()
+
+    out_machine.send(header)
+
+    time_start = time.monotonic()
+    reset_result = out_machine.reset(timeout=0.1)
+    time_reset = time.monotonic() - time_start
+
+    check("reset() result is False", reset_result is False)
+    check("reset() returned in time", time_reset < 0.5)
+
+    out_machine.stop()
+
+    return check.result()
+
+
+logging.basicConfig(level='CRITICAL')
+
+exit(main())
@@ -0,0 +1,188 @@
+
+"""
+Checks wayround_i2p.xmpp.core.StreamTracer on
+wayround_i2p.xmpp.core.XMPPIOStreamRWMachine, which output is read by its
+own input through pipe: with tracer set, written bytes, read bytes and
+(if enabled) parser events must be recorded with their sources, and
+written to file. Without tracer nothing must be recorded.
+
+Prints stream time for many stanzas without and with tracer.
+
+usage: xmpp_test_stream_tracer.py [stanzas]
+"""
+
+import io
+import logging
+import sys
+import threading
+import time
+
+import wayround_i2p.xmpp.core
+
+import xmpp_test_common
+
+
+MESSAGE = '<message id="{}"><body>text</body></message>'
+
+
+def main():
+
+    count = 2000
+
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    check = xmpp_test_common.Checks()
+
+    received = []
+    received_condition = threading.Condition()
+
+    def on_element(signal_name, parser_target, element):
+        with received_condition:
+            received.append(element.get('id'))
+            received_condition.notify_all()
+
+    def send_and_wait(ids):
+        # output is traced after write, so jobs are waited too
+        with received_condition:
+            count = len(received) + len(ids)
+        jobs = []
+        for i in ids:
+            jobs.append(io_machine.send(MESSAGE.format(i)))
+        for i in jobs:
+            i.wait(10)
+        with received_condition:
+            received_condition.wait_for(lambda: len(received) >= count, 10)
+
+    streamer = xmpp_test_common.PipeStreamer()
+
+    io_machine = wayround_i2p.xmpp.core.XMPPIOStreamRWMachine()
+    io_machine.set_objects(streamer)
+    io_machine.signal.connect('in_element_readed', on_element)
+
+    io_machine.start()
+
+    io_machine.send(
+        wayround_i2p.xmpp.core.start_stream_tpl(
+            'test@example.org', 'example.org'
+            )
+        )
+
+    reader = io_machine.in_machine.stream_worker
+    writer = io_machine.out_machine.stream_worker
+    in_target = io_machine.in_machine.xml_target
+
+    print("tracer:")
+
+    check(
+        "no tracer by default",
+        wayround_i2p.xmpp.core.get_stream_tracer() is None
+        )
+
+    unused_tracer = wayround_i2p.xmpp.core.StreamTracer()
+
+    send_and_wait(['untraced'])
+
+    check("nothing recorded without tracer", unused_tracer.get_records() == [])
+
+    trace_file = io.StringIO()
+
+    tracer = wayround_i2p.xmpp.core.StreamTracer(
+        file=trace_file,
+        parser_events=True
+        )
+    wayround_i2p.xmpp.core.set_stream_tracer(tracer)
+
+    send_and_wait(['traced'])
+
+    records = tracer.get_records()
+
+    out_data = b''.join(i[3] for i in records if i[1] == 'out')
+    in_data = b''.join(i[3] for i in records if i[1] == 'in')
+    message = bytes(MESSAGE.format('traced'), 'utf-8')
+
+    check(
+        "'out' records written bytes",
+        out_data == message
+        and all(i[2] == id(writer) for i in records if i[1] == 'out')
+        )
+    check(
+        "'in' records read bytes",
+        in_data == message
+        and all(i[2] == id(reader) for i in records if i[1] == 'in')
+        )
+    check(
+        "'parser' records parser target events",
+        ('start', ('{jabber:client}message', {'id': 'traced'}))
+        in [
+            i[3] for i in records
+            if i[1] == 'parser' and i[2] == id(in_target)
+            ]
+        )
+    check(
+        "records written to file",
+        len(trace_file.getvalue().splitlines()) == len(records)
+        )
+
+    tracer = wayround_i2p.xmpp.core.StreamTracer(size=2)
+    wayround_i2p.xmpp.core.set_stream_tracer(tracer)
+
+    send_and_wait(['small{}'.format(i) for i in range(5)])
+
+    records = tracer.get_records()
+
+    check(
+        "no 'parser' records if disabled",
+        all(i[1] != 'parser' for i in records)
+        )
+    check("only last `size' records kept", len(records) == 2)
+
+    wayround_i2p.xmpp.core.set_stream_tracer(None)
+
+    send_and_wait(['unset'])
+
+    check("nothing recorded after unset", tracer.get_records() == records)
+
+    try:
+        wayround_i2p.xmpp.core.set_stream_tracer(object())
+    except TypeError:
+        result = True
+    else:
+        result = False
+    check("set_stream_tracer() checks type", result)
+
+    print("{} stanzas:".format(count))
+
+    for name, tracer in [
+            ('no tracer', None),
+            ('tracer', wayround_i2p.xmpp.core.StreamTracer()),
+            (
+                'tracer with parser events',
+                wayround_i2p.xmpp.core.StreamTracer(parser_events=True)
+                )
+            ]:
+
+        wayround_i2p.xmpp.core.set_stream_tracer(tracer)
+
+        time_start = time.monotonic()
+        send_and_wait([str(i) for i in range(count)])
+        time_spent = time.monotonic() - time_start
+
+        print(
+            "    {:26}: {:.1f} us per stanza".format(
+                name,
+                time_spent / count * 1000000
+                )
+            )
+
+    wayround_i2p.xmpp.core.set_stream_tracer(None)
+
+    io_machine.stop()
+    streamer.close()
+
+    return check.result()
+
+
+logging.basicConfig(level='CRITICAL')
+
+exit(main())
@@ -0,0 +1,223 @@
+
+"""
+Checks, that stanzas rendered by wayround_i2p.xmpp.templates are equal to
+Stanza.to_str() and Stanza.to_bytes() of same stanzas, and compares
+rendering time with building and serializing Stanza.
+"""
+
+import logging
+import timeit
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+import wayround_i2p.xmpp.templates
+
+
+COUNT = 10000
+
+TEXTS = [
+    'Some message text',
+    'Немного текста',
+    'a & b < c > d " e \' f',
+    'line 1\nline 2\r\nline 3\ttab',
+    ']]> <![CDATA[ &amp; &#10;',
+    ''
+    ]
+
+
+def chat_message_pairs():
+
+    ret = []
+
+    for text in TEXTS:
+        for ide in [None, 'id-1', text]:
+            for from_jid in [None, 'a@example.org/r']:
+                for thread in [None, 'thread-1', text]:
+
+                    thread_obj = None
+                    if thread is not None:
+                        thread_obj = wayround_i2p.xmpp.core.MessageThread(
+                            thread
+                            )
+
+                    stanza = wayround_i2p.xmpp.core.Stanza(
+                        tag='message',
+                        typ='chat',
+                        ide=ide,
+                        from_jid=from_jid,
+                        to_jid='b@example.org',
+                        thread=thread_obj,
+                        body=[wayround_i2p.xmpp.core.MessageBody(text)]
+                        )
+
+                    rendered = wayround_i2p.xmpp.templates.chat_message(
+                        'b@example.org',
+                        text,
+                        ide=ide,
+                        from_jid=from_jid,
+                        thread=thread
+                        )
+
+                    ret.append((stanza, rendered))
+
+    return ret
+
+
+def presence_pairs():
+
+    ret = []
+
+    for typ in [None, 'unavailable', 'subscribe']:
+        for show in [None, 'away', 'dnd']:
+            for status in [None] + TEXTS:
+                for priority in [None, 0, 5]:
+                    for to_jid in [None, 'b@example.org']:
+
+                        status_list = []
+                        if status is not None:
+                            status_list.append(
+                                wayround_i2p.xmpp.core.PresenceStatus(status)
+                                )
+
+                        show_obj = None
+                        if show is not None:
+                            show_obj = wayround_i2p.xmpp.core.PresenceShow(
+                                show
+                                )
+
+                        stanza = wayround_i2p.xmpp.core.Stanza(
+                            tag='presence',
+                            typ=typ,
+                            to_jid=to_jid,
+                            show=show_obj,
+                            status=status_list,
+                            priority=priority
+                            )
+
+                        rendered = wayround_i2p.xmpp.templates.presence(
+                            to_jid=to_jid,
+                            typ=typ,
+                            show=show,
+                            status=status,
+                            priority=priority
+                            )
+
+                        ret.append((stanza, rendered))
+
+    return ret
+
+
+def iq_get_pairs():
+
+    ret = []
+
+    for xmlns in ['jabber:iq:roster', 'http://jabber.org/protocol/disco#info']:
+        for ide in ['id-1', 'a"b&c']:
+            for to_jid in [None, 'example.org']:
+
+                stanza = wayround_i2p.xmpp.core.Stanza(
+                    tag='iq',
+                    typ='get',
+                    ide=ide,
+                    to_jid=to_jid,
+                    objects=[wayround_i2p.xmpp.templates._Query(xmlns)]
+                    )
+
+                rendered = wayround_i2p.xmpp.templates.iq_get(
+                    xmlns,
+                    ide,
+                    to_jid=to_jid
+                    )
+
+                ret.append((stanza, rendered))
+
+    return ret
+
+
+def canonical(data):
+    if isinstance(data, str):
+        data = bytes(data, 'utf-8')
+    return lxml.etree.tostring(lxml.etree.fromstring(data), method='c14n')
+
+
+def check():
+
+    errors = 0
+    total = 0
+
+    for pairs in [chat_message_pairs(), presence_pairs(), iq_get_pairs()]:
+        for stanza, rendered in pairs:
+            total += 1
+
+            # to_str() writes non ASCII characters as character references,
+            # so it is compared after canonicalization, and to_bytes() is
+            # compared byte to byte
+
+            if (canonical(rendered) != canonical(stanza.to_str())
+                    or rendered != stanza.to_bytes()):
+                errors += 1
+                print("mismatch:")
+                print("    expected: {}".format(stanza.to_str()))
+                print("    rendered: {}".format(str(rendered, 'utf-8')))
+
+    for value in ['\x00', '\x1b', '\ud800', '\uffff']:
+        try:
+            wayround_i2p.xmpp.templates.chat_message('b@example.org', value)
+        except ValueError:
+            pass
+        else:
+            errors += 1
+            print("invalid value {} not rejected".format(repr(value)))
+        total += 1
+
+    print("checked: {}, errors: {}".format(total, errors))
+
+    return errors
+
+
+def benchmark():
+
+    def stanza_path():
+        return wayround_i2p.xmpp.core.Stanza(
+            tag='message',
+            typ='chat',
+            ide='id-1',
+            to_jid='b@example.org',
+            body=[wayround_i2p.xmpp.core.MessageBody(TEXTS[2])]
+            ).to_bytes()
+
+    def template_path():
+        return wayround_i2p.xmpp.templates.chat_message(
+            'b@example.org',
+            TEXTS[2],
+            ide='id-1'
+            )
+
+    for name, func in [('stanza', stanza_path), ('template', template_path)]:
+        time_spent = timeit.timeit(func, number=COUNT)
+        print(
+            "{:8}: {:.2f} us per chat message".format(
+                name,
+                time_spent / COUNT * 1000000
+                )
+            )
+
+    return
+
+
+def main():
+
+    ret = 0
+
+    if check() != 0:
+        ret = 1
+
+    benchmark()
+
+    return ret
+
+
+logging.basicConfig(level='WARNING')
+
+exit(main())
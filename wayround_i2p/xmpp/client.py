@@ -3,6 +3,8 @@
 XMPP client class to be used by users
 """
 
+import collections
+import concurrent.futures
 import logging
 import select
 import threading
@@ -14,8 +16,11 @@ import wayround_i2p.utils.stream
 import wayround_i2p.utils.threading
 import wayround_i2p.utils.types
 
+import wayround_i2p.xmpp.client_asyncio
 import wayround_i2p.xmpp.core
 import wayround_i2p.xmpp.muc
+import wayround_i2p.xmpp.roster
+import wayround_i2p.xmpp.templates
 
 
 class XMPPC2SClient:
@@ -53,9 +58,14 @@ class XMPPC2SClient:
     'features' (self, element)
     """
 
-    def __init__(self, socket):
+    def __init__(self, socket, output_parameters=None, dispatcher=None):
         """
         :param socket.socket socket:
+        :param dict output_parameters: additional keyword arguments for
+            wayround_i2p.xmpp.core.XMPPOutputStreamWriter
+        :param wayround_i2p.xmpp.core.StanzaDispatcher dispatcher: used
+            to call 'new_stanza' handlers. see
+            wayround_i2p.xmpp.core.StanzaProcessor
         """
 
         self.socket = socket
@@ -71,14 +81,20 @@ class XMPPC2SClient:
             self._connection_event_proxy
             )
 
-        self.io_machine = wayround_i2p.xmpp.core.XMPPIOStreamRWMachine()
+        self.io_machine = wayround_i2p.xmpp.core.XMPPIOStreamRWMachine(
+            output_parameters=output_parameters
+            )
         self.io_machine.set_objects(self.sock_streamer)
         self.io_machine.signal.connect(
             True,
             self._io_event_proxy
             )
 
-        self.stanza_processor = wayround_i2p.xmpp.core.StanzaProcessor()
+        self._own_dispatcher = dispatcher is None
+
+        self.stanza_processor = wayround_i2p.xmpp.core.StanzaProcessor(
+            dispatcher=dispatcher
+            )
         self.stanza_processor.connect_io_machine(self.io_machine)
         self.stanza_processor.signal.connect(
             True,
@@ -95,6 +111,10 @@ class XMPPC2SClient:
             ['features']
             )
 
+        # notified on streamer signals and on streamer and IO Machine start
+        # and stop
+        self._state_condition = threading.Condition()
+
         self._clear(init=True)
 
     def _clear(self, init=False):
@@ -133,7 +153,7 @@ class XMPPC2SClient:
 
             threading.Thread(
                 name="Socket Streamer Starting Thread",
-                target=self.sock_streamer.start
+                target=self._start_sock_streamer
                 ).start()
 
             ######### MACHINES
@@ -207,7 +227,11 @@ class XMPPC2SClient:
             self._stop_io_machine()
 
             logging.debug("Waiting Socket Streamer stop")
-            self.sock_streamer.stop()
+            self._stop_sock_streamer()
+
+            if self._own_dispatcher:
+                logging.debug("Waiting Stanza Dispatcher stop")
+                self.stanza_processor.dispatcher.stop()
 
             self.wait('stopped')
             logging.debug("Client considered stopped")
@@ -216,18 +240,30 @@ class XMPPC2SClient:
 
         return
 
-    def wait(self, what='stopped'):
+    def wait(self, what='stopped', timeout=None):
+        """
+        Returns as soon as IO Machine or socket streamer is started or
+        stopped by this client, or streamer signals its state change
+
+        Returns False if timeout (in seconds) expired, True otherwise
+        """
 
         allowed_what = ['stopped', 'working']
 
         if not what in allowed_what:
             raise ValueError("`what' must be in {}".format(allowed_what))
 
-        while True:
-            time.sleep(0.1)
-            if self.stat() == what:
-                break
+        with self._state_condition:
+            ret = self._state_condition.wait_for(
+                lambda: self.stat() == what,
+                timeout
+                )
+
+        return ret
 
+    def _notify_state_change(self):
+        with self._state_condition:
+            self._state_condition.notify_all()
         return
 
     def stat(self):
@@ -243,12 +279,13 @@ class XMPPC2SClient:
         if self.io_machine:
             v2 = self.io_machine.stat()
 
-        logging.debug("""
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("""
 Client stat:
 self.sock_streamer.stat() == {}
 self.io_machine.stat() == {}
 """.format(v1, v2)
-            )
+                )
 
         if v1 == v2 == 'working':
             ret = 'working'
@@ -264,11 +301,11 @@ self.io_machine.stat() == {}
     def restart(self):
         self.io_machine.restart()
 
+    def start_ssl(self):
+        self.sock_streamer.start_ssl()
+
     def send(self, data):
-        threading.Thread(
-            target=self.io_machine.send,
-            args=(data,)
-            ).start()
+        return self.io_machine.send(data)
 
     def has_connection(self):
         return self.stat() == 'working'
@@ -285,12 +322,22 @@ self.io_machine.stat() == {}
             ret = self.io_machine.out_machine.xml_target.open
         return ret
 
+    def _start_sock_streamer(self):
+        self.sock_streamer.start()
+        self._notify_state_change()
+
+    def _stop_sock_streamer(self):
+        self.sock_streamer.stop()
+        self._notify_state_change()
+
     def _start_io_machine(self):
         self.io_machine.start()
+        self._notify_state_change()
 
     def _stop_io_machine(self):
         if self.io_machine:
             self.io_machine.stop()
+        self._notify_state_change()
 
     def _restart_io_machine(self):
         self._stop_io_machine()
@@ -300,16 +347,18 @@ self.io_machine.stat() == {}
         self._input_stream_closed_event.set()
 
     def _connection_event_proxy(self, event, streamer, sock):
+        self._notify_state_change()
         self.signal.emit('streamer_' + event, streamer, sock)
 
     def _io_event_proxy(self, event, parser_target, attrs):
         self.signal.emit('io_' + event, parser_target, attrs)
 
-        logging.debug(
-            "{}: {}, {}, args: {}".format(
-                self, event, parser_target, attrs
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(
+                "{}: {}, {}, args: {}".format(
+                    self, event, parser_target, attrs
+                    )
                 )
-            )
 
         if event == 'in_element_readed':
             el = attrs
@@ -320,6 +369,12 @@ self.io_machine.stat() == {}
         self.signal.emit('stanza_processor_' + event, stanza_processor, stanza)
 
 
+CLIENT_CLASSES = (
+    XMPPC2SClient,
+    wayround_i2p.xmpp.client_asyncio.XMPPAsyncC2SClient
+    )
+
+
 class Roster:
 
     """
@@ -361,27 +416,52 @@ class Roster:
         'subscription': str
         }
     }
+
+    Received roster and pushes are kept in `store' (MemoryRosterStore by
+    default, or any object with wayround_i2p.xmpp.roster.ROSTER_STORE_METHODS
+    methods), together with roster version.
+    get_item() and get_items() answer from store without requests. If
+    get() is called with versioning=True (see
+    is_roster_versioning_supported()), stored version is sent to server
+    and server sends only changes since it.
     """
 
-    def __init__(self, client, client_jid):
+    def __init__(self, client, client_jid, store=None):
 
-        if not isinstance(client, XMPPC2SClient):
-            raise TypeError("`client' must be of type XMPPC2SClient")
+        if not isinstance(client, CLIENT_CLASSES):
+            raise TypeError(
+                "`client' must be of type XMPPC2SClient or XMPPAsyncC2SClient"
+                )
 
         if not isinstance(client_jid, wayround_i2p.xmpp.core.JID):
             raise TypeError(
                 "`client_jid' must be of type wayround_i2p.xmpp.core.JID"
                 )
 
+        if store is None:
+            store = wayround_i2p.xmpp.roster.MemoryRosterStore()
+
+        if not wayround_i2p.xmpp.roster.is_roster_store(store):
+            raise TypeError(
+                "`store' must be None or roster store (see "
+                "wayround_i2p.xmpp.roster.ROSTER_STORE_METHODS)"
+                )
+
         self.client = client
         self.client_jid = client_jid
+        self.store = store
 
         self.signal = wayround_i2p.utils.threading.Signal(
             self,
             ['push', 'push_invalid', 'push_invalid_from']
             )
 
-        self.client.signal.connect('stanza_processor_new_stanza', self._push)
+        self.client.stanza_processor.add_route(
+            self._push,
+            tag='iq',
+            typ='set',
+            child='{jabber:iq:roster}query'
+            )
 
     def _item_element_to_dict(self, element):
 
@@ -398,17 +478,57 @@ class Roster:
 
         return element.get('jid'), data
 
-    def get(self, from_jid=None, to_jid=None, wait=None):
+    def get(self, from_jid=None, to_jid=None, wait=None, versioning=False):
         """
         :param str from_jid:
         :param str to_jid:
+        :param bool versioning: send stored roster version. Use only if
+            server supports it (see is_roster_versioning_supported())
         """
 
-        ret = None
+        res = self.client.stanza_processor.send(
+            self._gen_get_stanza(
+                from_jid=from_jid,
+                to_jid=to_jid,
+                versioning=versioning
+                ),
+            wait=wait
+            )
 
-        query = wayround_i2p.xmpp.core.IQRoster()
+        return self.get_result(res)
 
-        stanza = wayround_i2p.xmpp.core.Stanza(
+    def get_request(
+            self,
+            from_jid=None, to_jid=None, timeout=10, versioning=False
+            ):
+        """
+        Same as get(), but does not wait. Returns
+        concurrent.futures.Future (see StanzaProcessor.send_request()),
+        which result is to be passed to get_result()
+        """
+
+        return self.client.stanza_processor.send_request(
+            self._gen_get_stanza(
+                from_jid=from_jid,
+                to_jid=to_jid,
+                versioning=versioning
+                ),
+            timeout=timeout
+            )
+
+    def _gen_get_stanza(self, from_jid=None, to_jid=None, versioning=False):
+
+        ver = None
+
+        if versioning:
+            # empty ver means "nothing cached" (RFC 6121 2.6.3)
+            ver = self.store.get_ver()
+            if ver is None:
+                ver = ''
+
+        query = wayround_i2p.xmpp.core.IQRoster(ver=ver)
+
+        ret = wayround_i2p.xmpp.core.Stanza(
             tag='iq',
             from_jid=from_jid,
             to_jid=to_jid,
@@ -418,10 +538,14 @@ class Roster:
                 ]
             )
 
-        res = self.client.stanza_processor.send(
-            stanza,
-            wait=wait
-            )
+        return ret
+
+    def get_result(self, res):
+        """
+        Convert response to roster get request to get() result
+        """
+
+        ret = None
 
         if isinstance(res, wayround_i2p.xmpp.core.Stanza):
             if res.is_error():
@@ -430,15 +554,51 @@ class Roster:
 
                 query = res.get_element().find('{jabber:iq:roster}query')
 
-                if query != None:
-                    ret = wayround_i2p.xmpp.core.IQRoster.new_from_element(
+                if query is None:
+                    # versioned request and roster not changed since stored
+                    # version. changes (if any) will come as pushes
+                    ret = dict(
+                        (k, v.to_iq_roster_item())
+                        for k, v in self.store.get_items().items()
+                        )
+
+                else:
+                    roster = wayround_i2p.xmpp.core.IQRoster.new_from_element(
                         query
                         )
 
-                    ret = ret.get_item_dict()
+                    self.store.replace(roster.get_item(), roster.get_ver())
+
+                    ret = roster.get_item_dict()
 
         return ret
 
+    def get_item(self, jid):
+        """
+        Stored wayround_i2p.xmpp.roster.RosterItem for bare `jid' or None.
+        No request is made
+        """
+        return self.store.get_item(jid)
+
+    def get_items(self):
+        """
+        Stored roster: dict with bare JIDs as keys and
+        wayround_i2p.xmpp.roster.RosterItem as values. No request is made
+        """
+        return self.store.get_items()
+
+    def get_groups(self):
+        return self.store.get_groups()
+
+    def get_jids_by_group(self, group):
+        return self.store.get_jids_by_group(group)
+
+    def get_jids_by_subscription(self, subscription):
+        return self.store.get_jids_by_subscription(subscription)
+
+    def get_jids_by_ask(self, ask):
+        return self.store.get_jids_by_ask(ask)
+
     def set(
         self,
         subject_jid,
@@ -513,6 +673,7 @@ class Roster:
         else:
             wrong_from = True
 
+        roster = None
         roster_data = None
 
         query = stanza.get_element().find('{jabber:iq:roster}query')
@@ -538,11 +699,300 @@ class Roster:
             if wrong_from:
                 self.signal.emit('push_invalid_from', self, roster_data)
             else:
+                self.store.update(roster.get_item(), roster.get_ver())
                 self.signal.emit('push', self, roster_data)
 
         return
 
 
+# show values ordered from most to least available, None is plain available
+PRESENCE_SHOW_ORDER = ['chat', None, 'away', 'xa', 'dnd']
+
+_PRESENCE_SHOW_RANK = dict(
+    (PRESENCE_SHOW_ORDER[i], i) for i in range(len(PRESENCE_SHOW_ORDER))
+    )
+
+
+class PresenceResource:
+
+    """
+    Presence of one available resource, as stored by PresenceTable
+
+    timestamp - time.monotonic() of presence reception
+    """
+
+    __slots__ = ('jid', 'priority', 'show', 'status', 'timestamp', '_rank')
+
+    def __init__(
+            self,
+            jid, priority=0, show=None, status=None, timestamp=None
+            ):
+
+        if not isinstance(jid, wayround_i2p.xmpp.core.FrozenJID):
+            raise TypeError(
+                "`jid' must be of type wayround_i2p.xmpp.core.FrozenJID"
+                )
+
+        if not isinstance(priority, int) or not -128 <= priority <= 127:
+            raise ValueError(
+                "`priority' must be int and -128 <= `priority' <= 127"
+                )
+
+        if not show in _PRESENCE_SHOW_RANK:
+            raise ValueError(
+                "`show' must be in {}".format(PRESENCE_SHOW_ORDER)
+                )
+
+        if status is not None and not isinstance(status, str):
+            raise TypeError("`status' must be None or str")
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        self.jid = jid
+        self.priority = priority
+        self.show = show
+        self.status = status
+        self.timestamp = timestamp
+
+        # higher is better: priority first, then show, then newer presence
+        self._rank = (priority, -_PRESENCE_SHOW_RANK[show], timestamp)
+
+        return
+
+    def __repr__(self):
+        return (
+            "<PresenceResource jid={!r} priority={!r} show={!r}"
+            " status={!r}>".format(
+                str(self.jid), self.priority, self.show, self.status
+                )
+            )
+
+
+class PresenceTable:
+
+    """
+    Available resources of contacts, keyed by bare FrozenJID, with index of
+    best resource of each contact.
+
+    Best resource is resource with highest priority, then with most
+    available show (see PRESENCE_SHOW_ORDER), then with newest presence.
+    get_best() is dict lookup. Index is updated on each change: when best
+    resource becomes worse or unavailable, only resources of same contact
+    are looked through.
+
+    Thread safe. JIDs may be given as str or FrozenJID.
+
+    Note: resources with negative priority are listed too, though RFC 6121
+    8.5.2.1 says, messages to bare JID are not delivered to them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resources = {}
+        self._best = {}
+        return
+
+    def update_from_stanza(self, stanza):
+        """
+        Apply received presence stanza. Stanzas of types other than
+        available (None), 'unavailable' and 'error' are ignored.
+
+        Returns True if table is changed
+        """
+
+        if not isinstance(stanza, wayround_i2p.xmpp.core.Stanza):
+            raise TypeError(
+                "`stanza' must be of type wayround_i2p.xmpp.core.Stanza"
+                )
+
+        ret = False
+
+        typ = stanza.get_typ()
+        from_jid = stanza.get_from_jid()
+
+        if (stanza.get_tag() == 'presence'
+                and from_jid is not None
+                and typ in [None, 'unavailable', 'error']):
+
+            jid = wayround_i2p.xmpp.core.FrozenJID.new_from_str(from_jid)
+
+            if jid is None:
+                logging.warning(
+                    "Presence from invalid JID `{}' ignored".format(from_jid)
+                    )
+
+            elif typ is None:
+
+                show = stanza.get_show()
+                if show is not None:
+                    show = show.get_text()
+
+                status = None
+                for i in stanza.get_status():
+                    if status is None or i.get_xmllang() is None:
+                        status = i.get_text()
+
+                priority = stanza.get_priority()
+                if priority is None:
+                    priority = 0
+
+                ret = self.set_available(
+                    PresenceResource(
+                        jid,
+                        priority=priority,
+                        show=show,
+                        status=status
+                        )
+                    )
+
+            else:
+                ret = self.set_unavailable(jid)
+
+        return ret
+
+    def set_available(self, resource):
+        """
+        Add or replace resource. Returns True
+        """
+
+        if not isinstance(resource, PresenceResource):
+            raise TypeError("`resource' must be of type PresenceResource")
+
+        bare = resource.jid.bare_obj()
+
+        with self._lock:
+
+            resources = self._resources.setdefault(bare, {})
+
+            old = resources.get(resource.jid)
+            resources[resource.jid] = resource
+
+            best = self._best.get(bare)
+
+            if best is None or resource._rank >= best._rank:
+                self._best[bare] = resource
+
+            elif best is old:
+                self._best[bare] = self._find_best(resources)
+
+        return True
+
+    def set_unavailable(self, jid):
+        """
+        Remove resource, or all resources of contact if `jid' is bare.
+        Returns True if something is removed
+        """
+
+        jid = self._frozen_jid(jid)
+
+        ret = False
+
+        bare = jid.bare_obj()
+
+        with self._lock:
+
+            resources = self._resources.get(bare)
+
+            if resources is not None:
+
+                if jid.resource is None:
+                    ret = True
+                    del self._resources[bare]
+                    del self._best[bare]
+
+                else:
+
+                    old = resources.pop(jid, None)
+
+                    if old is not None:
+
+                        ret = True
+
+                        if len(resources) == 0:
+                            del self._resources[bare]
+                            del self._best[bare]
+
+                        elif self._best[bare] is old:
+                            self._best[bare] = self._find_best(resources)
+
+        return ret
+
+    def _find_best(self, resources):
+        return max(resources.values(), key=lambda x: x._rank)
+
+    def _frozen_jid(self, jid):
+
+        if isinstance(jid, str):
+            res = wayround_i2p.xmpp.core.FrozenJID.new_from_str(jid)
+            if res is None:
+                raise ValueError("invalid JID `{}'".format(jid))
+            jid = res
+
+        if not isinstance(jid, wayround_i2p.xmpp.core.FrozenJID):
+            raise TypeError("`jid' must be str or FrozenJID")
+
+        return jid
+
+    def get_best(self, jid):
+        """
+        PresenceResource of best available resource of contact, or None if
+        contact is unavailable
+        """
+        with self._lock:
+            ret = self._best.get(self._frozen_jid(jid).bare_obj())
+        return ret
+
+    def get_resources(self, jid):
+        """
+        List of PresenceResource of available resources of contact
+        """
+        with self._lock:
+            ret = list(
+                self._resources.get(
+                    self._frozen_jid(jid).bare_obj(),
+                    {}
+                    ).values()
+                )
+        return ret
+
+    def is_available(self, jid):
+        """
+        If `jid' is bare - is any resource of contact available, else - is
+        this resource available
+        """
+
+        jid = self._frozen_jid(jid)
+
+        with self._lock:
+            resources = self._resources.get(jid.bare_obj())
+            if jid.resource is None:
+                ret = resources is not None
+            else:
+                ret = resources is not None and jid in resources
+
+        return ret
+
+    def get_available_jids(self):
+        """
+        List of bare FrozenJID of available contacts
+        """
+        with self._lock:
+            ret = list(self._resources.keys())
+        return ret
+
+    def clear(self):
+        with self._lock:
+            self._resources = {}
+            self._best = {}
+        return
+
+    def __len__(self):
+        with self._lock:
+            ret = len(self._resources)
+        return ret
+
+
 class Presence:
 
     """
@@ -558,12 +1008,17 @@ class Presence:
         (self, stanza.from_jid, stanza.to_jid, stanza)
 
         'error' (self, stanza)
+
+    Received presences are applied to `table' (PresenceTable) before
+    signals are emitted.
     """
 
     def __init__(self, client, client_jid):
 
-        if not isinstance(client, XMPPC2SClient):
-            raise TypeError("`client', must be of type XMPPC2SClient")
+        if not isinstance(client, CLIENT_CLASSES):
+            raise TypeError(
+                "`client', must be of type XMPPC2SClient or XMPPAsyncC2SClient"
+                )
 
         if not isinstance(client_jid, wayround_i2p.xmpp.core.JID):
             raise TypeError(
@@ -573,6 +1028,8 @@ class Presence:
         self.client = client
         self.client_jid = client_jid
 
+        self.table = PresenceTable()
+
         self.signal = wayround_i2p.utils.threading.Signal(
             self,
             [
@@ -581,9 +1038,9 @@ class Presence:
             ]
             )
 
-        self.client.signal.connect(
-            'stanza_processor_new_stanza',
-            self._in_stanza
+        self.client.stanza_processor.add_route(
+            self._in_stanza,
+            tag='presence'
             )
 
     def presence(
@@ -593,7 +1050,8 @@ class Presence:
         show=None,
         status=None,
         wait=False,
-        options=None
+        options=None,
+        priority=None
         ):
 
         if to_full_or_bare_jid and not isinstance(to_full_or_bare_jid, str):
@@ -633,6 +1091,9 @@ class Presence:
         if status:
             stanza.set_status([wayround_i2p.xmpp.core.PresenceStatus(status)])
 
+        if priority is not None:
+            stanza.set_priority(priority)
+
         ret = self.client.stanza_processor.send(stanza, wait=wait)
 
         return ret
@@ -701,23 +1162,303 @@ class Presence:
 
         return ret
 
-    def _in_stanza(self, event, client, stanza):
+    def _in_stanza(self, event, stanza_processor, stanza):
 
         """
         :param wayround_i2p.xmpp.core.Stanza stanza:
         """
 
-        if event == 'stanza_processor_new_stanza':
+        try:
+            self.table.update_from_stanza(stanza)
+        except (TypeError, ValueError):
+            logging.exception("Presence table not updated")
 
-            if stanza.get_tag() == 'presence':
+        self.signal.emit(
+            'presence',
+            self,
+            stanza.get_from_jid(),
+            stanza.get_to_jid(),
+            stanza
+            )
 
-                self.signal.emit(
-                    'presence',
-                    self,
-                    stanza.get_from_jid(),
-                    stanza.get_to_jid(),
-                    stanza
-                    )
+        return
+
+
+class PresencePublisher:
+
+    """
+    Rate limited sending of own presence through Presence.presence().
+
+    - presence, equal (by typ, show, status and priority) to last sent (or
+      pending) presence to same destination, is not sent;
+
+    - each destination (to_jid, None for broadcast) has token bucket of
+      `burst' presences, refilled with `rate' presences per second. If
+      bucket is empty, presence is delayed until token is available;
+
+    - delayed presences to same destination are coalesced: only last one is
+      sent.
+
+    Decisions are made under internal lock, but presences are sent with it
+    released, in order of decisions.
+
+    Only available and 'unavailable' presences are handled: subscription
+    and probe presences must be sent with Presence methods directly.
+    """
+
+    def __init__(self, presence, rate=1.0, burst=5):
+
+        if not isinstance(presence, Presence):
+            raise TypeError("`presence' must be of type Presence")
+
+        if rate <= 0:
+            raise ValueError("`rate' must be > 0")
+
+        if burst < 1:
+            raise ValueError("`burst' must be >= 1")
+
+        self.presence = presence
+
+        self._rate = rate
+        self._burst = burst
+
+        self._lock = threading.Lock()
+        self._destinations = {}
+
+        # Presence.presence() arguments, queued under self._lock and sent
+        # in order under self._send_lock
+        self._outgoing = collections.deque()
+        self._send_lock = threading.Lock()
+        self._timer_wheel = wayround_i2p.xmpp.core.TimerWheel(
+            resolution=0.05
+            )
+
+        self._stat = {
+            'requested': 0,
+            'sent': 0,
+            'suppressed_duplicates': 0,
+            'coalesced': 0,
+            'delayed': 0
+            }
+
+        return
+
+    def publish(
+            self,
+            to_jid=None, typ=None, show=None, status=None, priority=None
+            ):
+        """
+        Returns 'sent', 'duplicate', 'delayed' or 'coalesced'
+        """
+
+        if to_jid is not None and not isinstance(to_jid, str):
+            raise TypeError("`to_jid' must be None or str")
+
+        if not typ in [None, 'unavailable']:
+            raise ValueError("`typ' must be None or 'unavailable'")
+
+        if not show in [None, 'away', 'chat', 'dnd', 'xa']:
+            raise ValueError("Invalid `show' value")
+
+        if status is not None and not isinstance(status, str):
+            raise TypeError("`status' must be str or None")
+
+        if priority is not None and (
+                not isinstance(priority, int)
+                or not -128 <= priority <= 127
+                ):
+            raise ValueError(
+                "`priority' must be None or int and "
+                "-128 <= `priority' <= 127"
+                )
+
+        state = (typ, show, status, priority)
+
+        with self._lock:
+
+            self._stat['requested'] += 1
+
+            dest = self._destinations.get(to_jid)
+            if dest is None:
+                dest = {
+                    'sent': None,
+                    'pending': None,
+                    'timer': None,
+                    'tokens': float(self._burst),
+                    'refilled': time.monotonic()
+                    }
+                self._destinations[to_jid] = dest
+
+            if dest['pending'] is not None:
+
+                if dest['pending'] == state:
+                    ret = 'duplicate'
+                    self._stat['suppressed_duplicates'] += 1
+                else:
+                    ret = 'coalesced'
+                    dest['pending'] = state
+                    self._stat['coalesced'] += 1
+
+            elif dest['sent'] == state:
+                ret = 'duplicate'
+                self._stat['suppressed_duplicates'] += 1
+
+            else:
+
+                self._refill(dest)
+
+                if dest['tokens'] >= 1:
+                    ret = 'sent'
+                    self._queue(to_jid, dest, state)
+                else:
+                    ret = 'delayed'
+                    dest['pending'] = state
+                    self._stat['delayed'] += 1
+                    self._schedule(to_jid, dest)
+
+        self._flush()
+
+        return ret
+
+    def _refill(self, dest):
+        """
+        Must be called with self._lock acquired
+        """
+        now = time.monotonic()
+        dest['tokens'] = min(
+            float(self._burst),
+            dest['tokens'] + (now - dest['refilled']) * self._rate
+            )
+        dest['refilled'] = now
+        return
+
+    def _schedule(self, to_jid, dest):
+        """
+        Must be called with self._lock acquired
+        """
+        dest['timer'] = self._timer_wheel.add(
+            (1 - dest['tokens']) / self._rate,
+            self._on_timer,
+            to_jid
+            )
+        return
+
+    def _queue(self, to_jid, dest, state):
+        """
+        Must be called with self._lock acquired. Presence is sent by
+        following _flush() call
+        """
+
+        typ, show, status, priority = state
+
+        dest['tokens'] -= 1
+        dest['sent'] = state
+
+        self._stat['sent'] += 1
+
+        self._outgoing.append(
+            {
+                'to_full_or_bare_jid': to_jid,
+                'typ': typ,
+                'show': show,
+                'status': status,
+                'priority': priority,
+                'wait': False
+                }
+            )
+
+        return
+
+    def _flush(self):
+        """
+        Must be called with self._lock released. Sends queued presences in
+        order they were queued
+        """
+
+        with self._send_lock:
+
+            while True:
+
+                with self._lock:
+                    if len(self._outgoing) == 0:
+                        break
+                    kwargs = self._outgoing.popleft()
+
+                self.presence.presence(**kwargs)
+
+        return
+
+    def _on_timer(self, to_jid):
+
+        with self._lock:
+
+            dest = self._destinations.get(to_jid)
+
+            if dest is not None and dest['pending'] is not None:
+
+                dest['timer'] = None
+
+                self._refill(dest)
+
+                if dest['tokens'] >= 1:
+
+                    state = dest['pending']
+                    dest['pending'] = None
+
+                    if state == dest['sent']:
+                        self._stat['suppressed_duplicates'] += 1
+                    else:
+                        self._queue(to_jid, dest, state)
+                else:
+                    self._schedule(to_jid, dest)
+
+        try:
+            self._flush()
+        except:
+            logging.exception("Error sending delayed presence")
+
+        return
+
+    def get_stat(self):
+        """
+        dict with counters:
+
+        'requested'             - publish() calls
+        'sent'                  - presences sent
+        'suppressed_duplicates' - presences not sent as equal to last sent
+                                  or pending
+        'coalesced'             - pending presences replaced by newer ones
+        'delayed'               - presences delayed by rate limit
+        """
+        with self._lock:
+            ret = dict(self._stat)
+        return ret
+
+    def forget(self, to_jid=None):
+        """
+        Forget last sent presence to destination (for instance, after
+        reconnection), so next publish() to it is not suppressed.
+        Pending presence is dropped
+        """
+
+        with self._lock:
+            dest = self._destinations.pop(to_jid, None)
+            if dest is not None and dest['timer'] is not None:
+                self._timer_wheel.remove(dest['timer'])
+
+        return
+
+    def stop(self):
+        """
+        Drop pending presences
+        """
+
+        with self._lock:
+            for i in self._destinations.values():
+                if i['timer'] is not None:
+                    self._timer_wheel.remove(i['timer'])
+                    i['timer'] = None
+                i['pending'] = None
 
         return
 
@@ -726,8 +1467,10 @@ class Message:
 
     def __init__(self, client, client_jid):
 
-        if not isinstance(client, XMPPC2SClient):
-            raise TypeError("`client', must be of type XMPPC2SClient")
+        if not isinstance(client, CLIENT_CLASSES):
+            raise TypeError(
+                "`client', must be of type XMPPC2SClient or XMPPAsyncC2SClient"
+                )
 
         if not isinstance(client_jid, wayround_i2p.xmpp.core.JID):
             raise TypeError(
@@ -739,9 +1482,9 @@ class Message:
 
         self.signal = wayround_i2p.utils.threading.Signal(self, ['message'])
 
-        self.client.signal.connect(
-            'stanza_processor_new_stanza',
-            self._in_stanza
+        self.client.stanza_processor.add_route(
+            self._in_stanza,
+            tag='message'
             )
 
     def message(
@@ -793,22 +1536,223 @@ class Message:
 
         return ret
 
-    def _in_stanza(self, event, client, stanza):
-
+    def broadcast(
+            self,
+            recipients, body,
+            typ='chat', subject=None, thread=None, from_jid=None,
+            domain_rate=None, domain_burst=10, batch_size=100, wait=False
+            ):
         """
-        :param wayround_i2p.xmpp.core.Stanza stanza:
+        Send same message to many recipients. Synchronous.
+
+        Message is serialized once (see wayround_i2p.xmpp.templates), only
+        `to' and `id' are inserted for each recipient. Messages are written
+        in batches of up to `batch_size' messages, each batch with single
+        client send() call. Messages do not go through StanzaProcessor, so
+        replies are not waited for.
+
+        Recipients are grouped by domain and domains are served round
+        robin, one message per domain per round, so large domain does not
+        delay small ones. If `domain_rate' (messages per second) is given,
+        each domain has token bucket of `domain_burst' messages, and call
+        sleeps while all remaining domains are out of tokens.
+
+        `body' and `subject' are str or dicts as in message().
+
+        Returns dict with recipients as keys and results as values:
+
+            'sent'        - queued for writing (or written, if `wait');
+            'invalid jid' - recipient is not valid JID;
+            'error'       - sending (or writing, if `wait') failed.
         """
 
-        if event == 'stanza_processor_new_stanza':
+        if not typ in [None, 'normal', 'chat', 'groupchat', 'headline']:
+            raise ValueError("Wrong `typ' value")
+
+        if domain_rate is not None and domain_rate <= 0:
+            raise ValueError("`domain_rate' must be None or > 0")
+
+        if domain_burst < 1:
+            raise ValueError("`domain_burst' must be >= 1")
+
+        if batch_size < 1:
+            raise ValueError("`batch_size' must be >= 1")
+
+        template = wayround_i2p.xmpp.templates.StanzaTemplate(
+            self._gen_broadcast_stanza(typ, subject, body, thread, from_jid)
+            )
+
+        if sorted(template.get_fields()) != ['ide', 'to_jid']:
+            raise ValueError(
+                "message must not contain template placeholders"
+                )
+
+        ret = {}
+
+        queues = collections.OrderedDict()
+
+        for i in recipients:
+
+            if i in ret:
+                continue
+
+            jid = None
+            if isinstance(i, str):
+                jid = wayround_i2p.xmpp.core.FrozenJID.new_from_str(i)
+
+            if jid is None:
+                ret[i] = 'invalid jid'
+            else:
+                ret[i] = None
+                queues.setdefault(jid.domain, collections.deque()).append(i)
+
+        buckets = {}
+        if domain_rate is not None:
+            now = time.monotonic()
+            for i in queues.keys():
+                buckets[i] = [float(domain_burst), now]
+
+        id_generator = self.client.stanza_processor.id_generator
+
+        jobs = []
+        batch = []
+        batch_recipients = []
+
+        def flush():
+
+            if len(batch) != 0:
+
+                try:
+                    job = self.client.send(b''.join(batch))
+                except:
+                    logging.exception("Error sending broadcast batch")
+                    for j in batch_recipients:
+                        ret[j] = 'error'
+                else:
+                    for j in batch_recipients:
+                        ret[j] = 'sent'
+                    jobs.append((job, list(batch_recipients)))
+
+                batch.clear()
+                batch_recipients.clear()
+
+            return
+
+        while len(queues) != 0:
+
+            progressed = False
+
+            for domain in list(queues.keys()):
+
+                if domain_rate is not None:
+
+                    bucket = buckets[domain]
 
-            if stanza.get_tag() == 'message':
+                    now = time.monotonic()
+                    bucket[0] = min(
+                        float(domain_burst),
+                        bucket[0] + (now - bucket[1]) * domain_rate
+                        )
+                    bucket[1] = now
+
+                    if bucket[0] < 1:
+                        continue
+
+                    bucket[0] -= 1
+
+                queue = queues[domain]
+
+                recipient = queue.popleft()
+                if len(queue) == 0:
+                    del queues[domain]
+
+                try:
+                    data = template.render(
+                        to_jid=recipient,
+                        ide=id_generator()
+                        )
+                except (TypeError, ValueError):
+                    ret[recipient] = 'invalid jid'
+                    continue
+
+                batch.append(data)
+                batch_recipients.append(recipient)
 
-                self.signal.emit(
-                    'message',
-                    self,
-                    stanza
+                progressed = True
+
+                if len(batch) >= batch_size:
+                    flush()
+
+            if not progressed and len(queues) != 0:
+
+                # all remaining domains are out of tokens: do not keep
+                # rendered messages while waiting
+
+                flush()
+
+                time.sleep(
+                    (1 - max(buckets[i][0] for i in queues.keys()))
+                    / domain_rate
                     )
 
+        flush()
+
+        if wait:
+            for job, job_recipients in jobs:
+                job.wait()
+                if job.error is not None:
+                    for i in job_recipients:
+                        ret[i] = 'error'
+
+        return ret
+
+    def _gen_broadcast_stanza(self, typ, subject, body, thread, from_jid):
+
+        if from_jid == False:
+            from_jid = self.client_jid.full()
+
+        stanza = wayround_i2p.xmpp.core.Stanza(
+            tag='message',
+            ide=wayround_i2p.xmpp.templates.field('ide'),
+            from_jid=from_jid,
+            to_jid=wayround_i2p.xmpp.templates.field('to_jid'),
+            typ=typ,
+            validation='trusted'
+            )
+
+        if thread is not None:
+            stanza.set_thread(wayround_i2p.xmpp.core.MessageThread(thread))
+
+        for value, cls, setter in [
+                (subject, wayround_i2p.xmpp.core.MessageSubject,
+                 stanza.set_subject),
+                (body, wayround_i2p.xmpp.core.MessageBody,
+                 stanza.set_body)
+                ]:
+
+            if isinstance(value, str):
+                value = {None: value}
+
+            if value is not None:
+                objects = []
+                for i in value.keys():
+                    objects.append(cls(value[i], xmllang=i))
+                setter(objects)
+
+        return stanza
+
+    def _in_stanza(self, event, stanza_processor, stanza):
+
+        """
+        :param wayround_i2p.xmpp.core.Stanza stanza:
+        """
+
+        self.signal.emit(
+            'message',
+            self,
+            stanza
+            )
+
         return
 
 
@@ -871,8 +1815,10 @@ def drive_starttls(
 
     ret = 'ok'
 
-    if not isinstance(client, XMPPC2SClient):
-        raise TypeError("`client' must be of type XMPPC2SClient")
+    if not isinstance(client, CLIENT_CLASSES):
+        raise TypeError(
+            "`client' must be of type XMPPC2SClient or XMPPAsyncC2SClient"
+            )
 
     if not wayround_i2p.xmpp.core.is_features_element(features_element):
         raise ValueError("`features_element' must features element")
@@ -915,11 +1861,7 @@ def drive_starttls(
 
         logging.debug("Sending STARTTLS request")
 
-        client.send(
-            lxml.etree.tostring(
-                wayround_i2p.xmpp.core.STARTTLS().gen_element()
-                )
-            )
+        client.send(wayround_i2p.xmpp.core.STARTTLS().gen_element())
 
         logging.debug("POP")
         c_r_w_result = client_reactions_waiter.pop()
@@ -949,7 +1891,7 @@ def drive_starttls(
             )
         logging.debug("Calling streamer to wrap socket with TLS")
 
-        client.sock_streamer.start_ssl()
+        client.start_ssl()
 
         logging.debug("POP")
         c_r_w_result = client_reactions_waiter.pop()
@@ -968,16 +1910,15 @@ def drive_starttls(
 
     if ret == 'ok':
 
-        logging.debug("Restarting IO Machine")
-        client.io_machine.restart()
-
-        if not client.io_machine.stat() == 'working':
+        logging.debug("Resetting IO Machine")
+        if (not client.io_machine.reset()
+                or not client.io_machine.stat() == 'working'):
             ret = 'error'
-            logging.debug("IO Machine restart failed")
+            logging.debug("IO Machine reset failed")
 
     if ret == 'ok':
 
-        logging.debug("IO Machine restarted")
+        logging.debug("IO Machine reset")
         logging.debug("Starting new stream")
 
         client.io_machine.send(
@@ -1097,8 +2038,10 @@ def drive_sasl(
 
     ret = 'error'
 
-    if not isinstance(client, XMPPC2SClient):
-        raise TypeError("`client' must be of type XMPPC2SClient")
+    if not isinstance(client, CLIENT_CLASSES):
+        raise TypeError(
+            "`client' must be of type XMPPC2SClient or XMPPAsyncC2SClient"
+            )
 
     if not wayround_i2p.xmpp.core.is_features_element(features_element):
         raise ValueError("`features_element' must features element")
@@ -1191,15 +2134,14 @@ def drive_sasl(
             ret = 'error'
             logging.debug("Received `{}' - so it's and error".format(obj.tag))
         else:
-            logging.debug("Restarting IO Machine")
-            client.io_machine.restart()
-
-            if not client.io_machine.stat() == 'working':
+            logging.debug("Resetting IO Machine")
+            if (not client.io_machine.reset()
+                    or not client.io_machine.stat() == 'working'):
                 ret = 'error'
-                logging.debug("IO Machine restart failed")
+                logging.debug("IO Machine reset failed")
             else:
 
-                logging.debug("IO Machine restarted")
+                logging.debug("IO Machine reset")
                 logging.debug("Starting new stream")
 
                 client.io_machine.send(
@@ -1269,25 +2211,35 @@ def bind(client, resource=None, wait=True):
     if returned stanza has wrong stracture - None is returned
     """
 
-    if not isinstance(client, XMPPC2SClient):
-        raise TypeError("`client' must be a XMPPC2SClient")
+    if not isinstance(client, CLIENT_CLASSES):
+        raise TypeError(
+            "`client' must be a XMPPC2SClient or XMPPAsyncC2SClient"
+            )
 
     if resource and not isinstance(resource, str):
         raise TypeError("`resource' must be a str")
 
-    binding_stanza = wayround_i2p.xmpp.core.Stanza(
+    ret = client.stanza_processor.send(
+        _gen_bind_stanza(resource),
+        wait=wait
+        )
+
+    return _bind_result(ret)
+
+
+def _gen_bind_stanza(resource):
+    return wayround_i2p.xmpp.core.Stanza(
         tag='iq',
         typ='set',
         objects=[wayround_i2p.xmpp.core.Bind(
             typ='resource',
             value=resource
-            )]
+            )],
+        validation='trusted'
         )
 
-    ret = client.stanza_processor.send(
-        binding_stanza,
-        wait=wait
-        )
+
+def _bind_result(ret):
 
     if isinstance(ret, wayround_i2p.xmpp.core.Stanza):
         if ret.is_error():
@@ -1319,22 +2271,159 @@ def session(client, to_jid, wait=True):
     Driver for starting session. This is required by old protocol version
     (rfc 3920)
     """
-    if not isinstance(client, XMPPC2SClient):
-        raise TypeError("`client' must be a XMPPC2SClient")
+    if not isinstance(client, CLIENT_CLASSES):
+        raise TypeError(
+            "`client' must be a XMPPC2SClient or XMPPAsyncC2SClient"
+            )
 
     if to_jid and not isinstance(to_jid, str):
         raise TypeError("`resource' must be a str")
 
-    session_starting_stanza = wayround_i2p.xmpp.core.Stanza(
+    ret = client.stanza_processor.send(
+        _gen_session_stanza(to_jid),
+        wait=wait
+        )
+
+    return ret
+
+
+def _gen_session_stanza(to_jid):
+    return wayround_i2p.xmpp.core.Stanza(
         tag='iq',
         typ='set',
         to_jid=to_jid,
-        objects=[wayround_i2p.xmpp.core.Session()]
+        objects=[wayround_i2p.xmpp.core.Session()],
+        validation='trusted'
         )
 
-    ret = client.stanza_processor.send(
-        session_starting_stanza,
-        wait=wait
+
+def is_session_required(features_element):
+    """
+    True if features contain session feature, not marked as <optional/>
+    """
+
+    if not wayround_i2p.xmpp.core.is_features_element(features_element):
+        raise ValueError("`features_element' must features element")
+
+    ret = False
+
+    session_el = features_element.find(
+        '{urn:ietf:params:xml:ns:xmpp-session}session'
         )
 
+    if session_el is not None:
+        ret = session_el.find(
+            '{urn:ietf:params:xml:ns:xmpp-session}optional'
+            ) is None
+
+    return ret
+
+
+def is_roster_versioning_supported(features_element):
+    """
+    True if features contain roster versioning feature (RFC 6121 2.6.1)
+    """
+
+    if not wayround_i2p.xmpp.core.is_features_element(features_element):
+        raise ValueError("`features_element' must features element")
+
+    return features_element.find(
+        '{urn:xmpp:features:rosterver}ver'
+        ) is not None
+
+
+def bootstrap(
+        client,
+        features_element,
+        to_jid,
+        resource=None,
+        roster=None,
+        presence=None,
+        timeout=10
+        ):
+    """
+    Pipelined bind() and session() with optional roster get and initial
+    presence, to be called on features received after SASL.
+
+    Following is sent at once, without waiting for responses:
+
+    - bind request;
+    - session request, if is_session_required(features_element);
+    - roster get, if `roster' (Roster instance) is given, with stored
+      roster version if is_roster_versioning_supported(features_element);
+    - initial presence, if `presence' (Presence instance) is given.
+
+    Server processes stream stanzas in order, so each of them comes to
+    server after previous ones are processed. If binding fails, following
+    stanzas are rejected by server.
+
+    Returns dict with keys:
+
+    'jid'     - bind() result
+    'session' - session() result, or None if session is not required
+    'roster'  - Roster.get() result, or None if not requested
+    """
+
+    if not isinstance(client, CLIENT_CLASSES):
+        raise TypeError(
+            "`client' must be a XMPPC2SClient or XMPPAsyncC2SClient"
+            )
+
+    if resource and not isinstance(resource, str):
+        raise TypeError("`resource' must be a str")
+
+    if roster is not None and not isinstance(roster, Roster):
+        raise TypeError("`roster' must be None or Roster")
+
+    if presence is not None and not isinstance(presence, Presence):
+        raise TypeError("`presence' must be None or Presence")
+
+    stanza_processor = client.stanza_processor
+
+    futures = {
+        'jid': stanza_processor.send_request(
+            _gen_bind_stanza(resource),
+            timeout=timeout
+            ),
+        'session': None,
+        'roster': None
+        }
+
+    if is_session_required(features_element):
+        futures['session'] = stanza_processor.send_request(
+            _gen_session_stanza(to_jid),
+            timeout=timeout
+            )
+
+    if roster is not None:
+        futures['roster'] = roster.get_request(
+            timeout=timeout,
+            versioning=is_roster_versioning_supported(features_element)
+            )
+
+    if presence is not None:
+        presence.presence()
+
+    ret = {}
+
+    for i in ['jid', 'session', 'roster']:
+
+        res = None
+
+        if futures[i] is not None:
+            try:
+                res = futures[i].result()
+            except concurrent.futures.TimeoutError:
+                res = False
+            except:
+                logging.exception("Error sending {} request".format(i))
+                res = False
+
+        ret[i] = res
+
+    ret['jid'] = _bind_result(ret['jid'])
+
+    if roster is not None:
+        ret['roster'] = roster.get_result(ret['roster'])
+
     return ret
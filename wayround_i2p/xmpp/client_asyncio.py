@@ -0,0 +1,789 @@
+
+"""
+asyncio based XMPP client transport
+
+Any number of connections can be served by single event loop thread: socket
+data is fed to lxml parsers directly from asyncio protocol callbacks, no
+threads are created per connection. By default received stanzas are
+dispatched by worker threads shared by all clients (see
+XMPPAsyncC2SClient). tests/xmpp_test_asyncio_connections.py measures this.
+
+Stream machine and client here emit same signals as
+XMPPIOStreamRWMachine and XMPPC2SClient, so StanzaProcessor, Roster, Presence
+and Message can be used with them unchanged.
+
+NOTE: blocking drivers (drive_starttls(), drive_sasl(), bind(), session())
+      are waiting for server reactions, so they must be called from thread
+      other than event loop thread.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import ssl
+import threading
+
+import lxml.etree
+
+import wayround_i2p.utils.lxml
+import wayround_i2p.utils.threading
+
+import wayround_i2p.xmpp.core
+
+
+STREAMER_SIGNAL_NAMES = [
+    'start', 'stop', 'error', 'restart',
+    'ssl wrap error', 'ssl wrapped',
+    'ssl ununwrapable', 'ssl unwrap error', 'ssl unwrapped'
+    ]
+
+STREAM_SIGNAL_NAMES = ['start', 'stop', 'error', 'element_readed']
+
+# StanzaDispatcher of clients, created without dispatcher. Its worker threads
+# are shared by all connected clients and stopped when last one disconnects
+_shared_dispatcher = None
+_shared_dispatcher_users = 0
+_shared_dispatcher_lock = threading.Lock()
+
+
+def _is_loop_thread(loop):
+    ret = False
+    try:
+        ret = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        ret = False
+    return ret
+
+
+def _get_shared_dispatcher():
+
+    global _shared_dispatcher
+
+    with _shared_dispatcher_lock:
+
+        if _shared_dispatcher is None:
+            _shared_dispatcher = wayround_i2p.xmpp.core.StanzaDispatcher()
+
+        ret = _shared_dispatcher
+
+    return ret
+
+
+def _acquire_shared_dispatcher():
+
+    global _shared_dispatcher_users
+
+    with _shared_dispatcher_lock:
+        _shared_dispatcher_users += 1
+
+    return
+
+
+def _release_shared_dispatcher():
+
+    global _shared_dispatcher_users
+
+    with _shared_dispatcher_lock:
+
+        _shared_dispatcher_users -= 1
+
+        stop = _shared_dispatcher_users == 0
+
+    if stop:
+        # StanzaDispatcher.stop() waits for dispatched calls, which can be
+        # waiting for event loop, so it is not called in caller thread.
+        # Stopped dispatcher starts workers again on next dispatch()
+        threading.Thread(
+            target=_shared_dispatcher.stop,
+            name="Shared StanzaDispatcher stop",
+            daemon=True
+            ).start()
+
+    return
+
+
+def call_in_loop(loop, func, *args, **kwargs):
+    """
+    Call func in loop thread and return it's result
+
+    If called from loop thread, func is called directly. Else caller is
+    blocked until func is done.
+    """
+
+    if _is_loop_thread(loop):
+        ret = func(*args, **kwargs)
+    else:
+
+        fut = concurrent.futures.Future()
+
+        def _run():
+            try:
+                fut.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+            return
+
+        loop.call_soon_threadsafe(_run)
+
+        ret = fut.result()
+
+    return ret
+
+
+class XMPPAsyncIOStreamRWMachine:
+
+    """
+    asyncio counterpart of XMPPIOStreamRWMachine
+
+    Data is passed to data_received() by asyncio protocol and fed to input
+    parser in same (event loop) thread.
+
+    Outgoing data is reported to out_xml_target without parsing, unless
+    reparse_output is True (see XMPPOutputStreamWriter)
+
+    send() callers in other threads are blocked while transport has paused
+    writing (its write buffer is over high_watermark), or while data, passed
+    to loop but not written to transport yet, is over high_watermark.
+
+    Signals: same as of XMPPIOStreamRWMachine
+
+    'in_start'          (parser_target, attrs=attributes)
+    'in_error'          (parser_target, attrs=attributes)
+    'in_element_readed' (parser_target, element)
+    'in_stop'           (parser_target, attrs=attributes)
+
+    'out_start'          (parser_target, attrs=attributes)
+    'out_error'          (parser_target, attrs=attributes)
+    'out_element_readed' (parser_target, element)
+    'out_stop'           (parser_target, attrs=attributes)
+    """
+
+    def __init__(
+            self,
+            loop,
+            reparse_output=False,
+            high_watermark=(4 * 1024 ** 2),
+            low_watermark=(1 * 1024 ** 2)
+            ):
+        """
+        high_watermark, low_watermark - in bytes, used as transport write
+        buffer limits
+        """
+
+        if low_watermark > high_watermark:
+            raise ValueError("`low_watermark' must be <= `high_watermark'")
+
+        self._loop = loop
+        self._reparse_output = reparse_output
+
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
+
+        self.signal = wayround_i2p.utils.threading.Signal(
+            self,
+            ['in_' + i for i in STREAM_SIGNAL_NAMES]
+            + ['out_' + i for i in STREAM_SIGNAL_NAMES]
+            )
+
+        self.in_xml_target = None
+        self.out_xml_target = None
+
+        self._in_xml_parser = None
+        self._out_xml_parser = None
+
+        self._transport = None
+
+        self._started = False
+
+        self._working_event = threading.Event()
+        self._stopped_event = threading.Event()
+        self._stopped_event.set()
+
+        # guards _writing_paused and _output_pending_bytes
+        self._output_condition = threading.Condition()
+        self._writing_paused = False
+        self._output_pending_bytes = 0
+
+        return
+
+    def set_transport(self, transport):
+
+        if transport is not None:
+            transport.set_write_buffer_limits(
+                high=self._high_watermark,
+                low=self._low_watermark
+                )
+
+        self._transport = transport
+
+        with self._output_condition:
+            self._writing_paused = False
+
+        self._update_state()
+
+        return
+
+    def pause_writing(self):
+        """
+        Called by protocol when transport write buffer is over
+        high_watermark
+        """
+        with self._output_condition:
+            self._writing_paused = True
+        return
+
+    def resume_writing(self):
+        """
+        Called by protocol when transport write buffer is drained to
+        low_watermark
+        """
+        with self._output_condition:
+            self._writing_paused = False
+            self._output_condition.notify_all()
+        return
+
+    def _update_state(self):
+
+        if self.stat() == 'working':
+            self._stopped_event.clear()
+            self._working_event.set()
+        else:
+            self._working_event.clear()
+            self._stopped_event.set()
+
+        # blocked senders must not wait for stopped transport
+        with self._output_condition:
+            self._output_condition.notify_all()
+
+        return
+
+    def _in_stream_signal_proxy(self, signal_name, *args, **kwargs):
+        self.signal.emit('in_' + signal_name, *args, **kwargs)
+
+    def _out_stream_signal_proxy(self, signal_name, *args, **kwargs):
+        self.signal.emit('out_' + signal_name, *args, **kwargs)
+
+    def _reset_parsers(self):
+
+        if self.in_xml_target is not None:
+            self.in_xml_target.signal.disconnect(self._in_stream_signal_proxy)
+
+        if self.out_xml_target is not None:
+            self.out_xml_target.signal.disconnect(
+                self._out_stream_signal_proxy
+                )
+
+        self.in_xml_target = wayround_i2p.xmpp.core.XMPPStreamParserTarget()
+        self.in_xml_target.signal.connect(True, self._in_stream_signal_proxy)
+
+        self.out_xml_target = wayround_i2p.xmpp.core.XMPPStreamParserTarget()
+        self.out_xml_target.signal.connect(True, self._out_stream_signal_proxy)
+
+        self._in_xml_parser = lxml.etree.XMLParser(
+            target=self.in_xml_target,
+            huge_tree=True
+            )
+
+        if self._reparse_output:
+            self._out_xml_parser = lxml.etree.XMLParser(
+                target=self.out_xml_target,
+                huge_tree=True
+                )
+
+        return
+
+    def start(self):
+        """
+        Synchronous
+        """
+        call_in_loop(self._loop, self._reset_parsers)
+        self._started = True
+        self._update_state()
+        return
+
+    def stop(self):
+        """
+        Synchronous
+        """
+        self._started = False
+        self._update_state()
+        return
+
+    def restart(self):
+        """
+        Synchronous
+
+        Only parsers are replaced: there is no threads to restart
+        """
+        self.start()
+        return
+
+    def reset(self, timeout=10):
+        """
+        Synchronous. Same as restart(): outgoing data is written at once, so
+        there is nothing to wait for. Returns True, see
+        XMPPStreamMachine.reset()
+        """
+        self.restart()
+        return True
+
+    def wait(self, what='stopped', timeout=None):
+        """
+        Returns False if timeout (in seconds) expired, True otherwise
+        """
+
+        allowed_what = ['stopped', 'working']
+
+        if not what in allowed_what:
+            raise ValueError("`what' must be in {}".format(allowed_what))
+
+        if what == 'working':
+            ret = self._working_event.wait(timeout)
+        else:
+            ret = self._stopped_event.wait(timeout)
+
+        return ret
+
+    def stat(self):
+
+        ret = 'stopped'
+
+        if (self._started
+                and self._transport is not None
+                and not self._transport.is_closing()):
+            ret = 'working'
+
+        return ret
+
+    def data_received(self, data):
+
+        tracer = wayround_i2p.xmpp.core.get_stream_tracer()
+        if tracer is not None:
+            tracer.trace('in', id(self), data)
+
+        try:
+            self._in_xml_parser.feed(data)
+        except:
+            logging.exception(
+                "{} :: data_received {}".format(
+                    type(self).__name__, repr(data)
+                    )
+                )
+
+        return
+
+    def send(self, obj):
+        """
+        Thread safe. Returns XMPPOutputJob immediately
+        """
+
+        snd_obj = None
+
+        if isinstance(obj, bytes):
+            snd_obj = obj
+        elif isinstance(obj, str):
+            snd_obj = bytes(obj, encoding='utf-8')
+        elif wayround_i2p.utils.lxml.is_lxml_tag_element(obj):
+            snd_obj = lxml.etree.tostring(obj, encoding='utf-8')
+        else:
+            raise Exception(
+                "Wrong obj type. Can be bytes, str or lxml.etree.Element"
+                )
+
+        events = None
+        if not self._reparse_output:
+            events = wayround_i2p.xmpp.core.get_outgoing_object_events(
+                obj,
+                snd_obj
+                )
+
+        ret = wayround_i2p.xmpp.core.XMPPOutputJob(obj, snd_obj, events)
+
+        if _is_loop_thread(self._loop):
+            # loop can not be blocked: data is left in transport buffer
+            self._write(ret)
+        else:
+
+            with self._output_condition:
+
+                while ((self._writing_paused
+                        or self._output_pending_bytes >= self._high_watermark)
+                       and self.stat() == 'working'):
+                    self._output_condition.wait()
+
+                self._output_pending_bytes += len(snd_obj)
+
+            self._loop.call_soon_threadsafe(self._write_pending, ret)
+
+        return ret
+
+    def _write_pending(self, job):
+
+        with self._output_condition:
+            self._output_pending_bytes -= len(job.data)
+            self._output_condition.notify_all()
+
+        self._write(job)
+
+        return
+
+    def _write(self, job):
+
+        snd_obj = job.data
+
+        if self._transport is None or self._transport.is_closing():
+            logging.error(
+                "{} :: transport is closed. data not sent".format(
+                    type(self).__name__
+                    )
+                )
+            job.set_done(error=RuntimeError("Transport is closed"))
+        else:
+
+            self._transport.write(snd_obj)
+
+            job.set_done()
+
+            tracer = wayround_i2p.xmpp.core.get_stream_tracer()
+            if tracer is not None:
+                tracer.trace('out', id(self), snd_obj)
+
+            try:
+                if self._reparse_output:
+                    self._out_xml_parser.feed(snd_obj)
+                else:
+                    wayround_i2p.xmpp.core.apply_outgoing_object_events(
+                        self.out_xml_target,
+                        job.events
+                        )
+            except:
+                logging.exception(
+                    "Exception while reporting outgoing data"
+                    )
+
+        return
+
+
+class XMPPStreamProtocol(asyncio.Protocol):
+
+    """
+    asyncio protocol passing connection events and data to
+    XMPPAsyncC2SClient
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def connection_made(self, transport):
+        self._client._connection_made(transport)
+
+    def data_received(self, data):
+        self._client.io_machine.data_received(data)
+
+    def eof_received(self):
+        # returning false value makes transport close itself
+        return False
+
+    def connection_lost(self, exc):
+        self._client._connection_lost(exc)
+
+    def pause_writing(self):
+        self._client.io_machine.pause_writing()
+
+    def resume_writing(self):
+        self._client.io_machine.resume_writing()
+
+
+class XMPPAsyncC2SClient:
+
+    """
+    asyncio counterpart of XMPPC2SClient
+
+    Signals: same as of XMPPC2SClient. 'streamer_*' signals are emitted with
+    (self, transport) arguments.
+    """
+
+    def __init__(
+            self,
+            loop,
+            ssl_context=None,
+            reparse_output=False,
+            dispatcher=None,
+            output_parameters=None
+            ):
+        """
+        :param asyncio.AbstractEventLoop loop:
+        :param ssl.SSLContext ssl_context: context used by start_ssl(). if
+            None - ssl.create_default_context() is used
+        :param bool reparse_output: see XMPPAsyncIOStreamRWMachine
+        :param wayround_i2p.xmpp.core.StanzaDispatcher dispatcher: used
+            to call 'new_stanza' handlers. StanzaDispatcher('inline') runs
+            them in loop thread, which is fastest, but handlers then must
+            not block (e.g. must not wait for responses). If None, dispatcher
+            shared by all clients is used, and its worker threads are
+            stopped when no client is connected
+        :param dict output_parameters: additional keyword arguments for
+            XMPPAsyncIOStreamRWMachine (high_watermark, low_watermark)
+        """
+
+        if output_parameters is None:
+            output_parameters = {}
+
+        self._loop = loop
+
+        self._ssl_context = ssl_context
+
+        self.io_machine = XMPPAsyncIOStreamRWMachine(
+            self._loop,
+            reparse_output=reparse_output,
+            **output_parameters
+            )
+        self.io_machine.signal.connect(True, self._io_event_proxy)
+
+        self._own_dispatcher = dispatcher is None
+        self._dispatcher_acquired = False
+
+        if self._own_dispatcher:
+            dispatcher = _get_shared_dispatcher()
+
+        self.stanza_processor = wayround_i2p.xmpp.core.StanzaProcessor(
+            dispatcher=dispatcher
+            )
+        self.stanza_processor.connect_io_machine(self.io_machine)
+        self.stanza_processor.signal.connect(
+            True,
+            self._stanza_processor_proxy
+            )
+
+        self.signal = wayround_i2p.utils.threading.Signal(
+            self,
+            ['streamer_' + i for i in STREAMER_SIGNAL_NAMES] +
+            self.io_machine.signal.get_names(add_prefix='io_') +
+            self.stanza_processor.signal.get_names(
+                add_prefix='stanza_processor_'
+                ) +
+            ['features']
+            )
+
+        self._transport = None
+        self._protocol = None
+        self._server_hostname = None
+
+        self._working_event = threading.Event()
+        self._stopped_event = threading.Event()
+        self._stopped_event.set()
+
+        return
+
+    def get_transport(self):
+        return self._transport
+
+    async def connect(
+            self, from_jid, to_jid, host=None, port=5222, sock=None
+            ):
+        """
+        Connect to host:port (or use already connected sock) and open
+        output stream
+
+        :param str host: defaults to to_jid
+        """
+
+        if host is None and sock is None:
+            host = to_jid
+
+        self._server_hostname = host or to_jid
+
+        self._protocol = XMPPStreamProtocol(self)
+
+        if self._own_dispatcher and not self._dispatcher_acquired:
+            _acquire_shared_dispatcher()
+            self._dispatcher_acquired = True
+
+        self.io_machine.start()
+
+        if sock is not None:
+            await self._loop.create_connection(
+                lambda: self._protocol,
+                sock=sock
+                )
+        else:
+            await self._loop.create_connection(
+                lambda: self._protocol,
+                host,
+                port
+                )
+
+        self.io_machine.send(
+            wayround_i2p.xmpp.core.start_stream_tpl(
+                from_jid=from_jid,
+                to_jid=to_jid
+                )
+            )
+
+        logging.debug("Stream opening tag was sent")
+
+        return
+
+    def start(self, from_jid, to_jid, host=None, port=5222, sock=None):
+        """
+        Synchronous version of connect(). Must not be called from loop
+        thread
+        """
+
+        asyncio.run_coroutine_threadsafe(
+            self.connect(
+                from_jid, to_jid, host=host, port=port, sock=sock
+                ),
+            self._loop
+            ).result()
+
+        return
+
+    def stop(self):
+        """
+        Send stream closing tag and close transport. Thread safe
+        """
+
+        if self.has_stream_out():
+            self.io_machine.send(wayround_i2p.xmpp.core.stop_stream_tpl())
+
+        if self._transport is not None:
+            self._loop.call_soon_threadsafe(self._transport.close)
+        else:
+            # not connected: _connection_lost() will not be called
+            self._release_dispatcher()
+
+        return
+
+    def _release_dispatcher(self):
+        if self._own_dispatcher and self._dispatcher_acquired:
+            self._dispatcher_acquired = False
+            _release_shared_dispatcher()
+        return
+
+    def wait(self, what='stopped', timeout=None):
+        """
+        Returns False if timeout (in seconds) expired, True otherwise
+        """
+
+        allowed_what = ['stopped', 'working']
+
+        if not what in allowed_what:
+            raise ValueError("`what' must be in {}".format(allowed_what))
+
+        if what == 'working':
+            ret = self._working_event.wait(timeout)
+        else:
+            ret = self._stopped_event.wait(timeout)
+
+        return ret
+
+    def stat(self):
+
+        ret = 'stopped'
+
+        if self._working_event.is_set():
+            ret = 'working'
+
+        return ret
+
+    def restart(self):
+        self.io_machine.restart()
+
+    def send(self, data):
+        return self.io_machine.send(data)
+
+    def start_ssl(self):
+        """
+        Start TLS on current transport. Returns immediately.
+
+        'streamer_ssl wrapped' or 'streamer_ssl wrap error' signal is emitted
+        on result
+        """
+
+        asyncio.run_coroutine_threadsafe(self._start_ssl(), self._loop)
+
+        return
+
+    async def _start_ssl(self):
+
+        ssl_context = self._ssl_context
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context()
+
+        try:
+            transport = await self._loop.start_tls(
+                self._transport,
+                self._protocol,
+                ssl_context,
+                server_hostname=self._server_hostname
+                )
+        except:
+            logging.exception("Can't wrap connection with TLS")
+            self.signal.emit('streamer_ssl wrap error', self, self._transport)
+        else:
+            self._transport = transport
+            self.io_machine.set_transport(transport)
+            self.signal.emit('streamer_ssl wrapped', self, transport)
+
+        return
+
+    def has_connection(self):
+        return self.stat() == 'working'
+
+    def has_stream_in(self):
+        ret = False
+        if self.io_machine.in_xml_target is not None:
+            ret = self.io_machine.in_xml_target.open
+        return ret
+
+    def has_stream_out(self):
+        ret = False
+        if self.io_machine.out_xml_target is not None:
+            ret = self.io_machine.out_xml_target.open
+        return ret
+
+    def _connection_made(self, transport):
+
+        self._transport = transport
+        self.io_machine.set_transport(transport)
+
+        self._stopped_event.clear()
+        self._working_event.set()
+
+        self.signal.emit('streamer_start', self, transport)
+
+        return
+
+    def _connection_lost(self, exc):
+
+        transport = self._transport
+
+        self.io_machine.set_transport(None)
+        self.io_machine.stop()
+
+        self._release_dispatcher()
+
+        self._working_event.clear()
+        self._stopped_event.set()
+
+        if exc is not None:
+            logging.error(
+                "{} :: connection lost: {}".format(type(self).__name__, exc)
+                )
+            self.signal.emit('streamer_error', self, transport)
+
+        self.signal.emit('streamer_stop', self, transport)
+
+        return
+
+    def _io_event_proxy(self, event, parser_target, attrs):
+        self.signal.emit('io_' + event, parser_target, attrs)
+
+        if event == 'in_element_readed':
+            el = attrs
+            if wayround_i2p.xmpp.core.is_features_element(el):
+                self.signal.emit('features', self, el)
+
+    def _stanza_processor_proxy(self, event, stanza_processor, stanza):
+        self.signal.emit('stanza_processor_' + event, stanza_processor, stanza)
@@ -373,33 +373,38 @@ class Bot:
         if (not self._disconnection_flag.is_set()
                 and ret == 0):
 
-            res = wayround_i2p.xmpp.client.bind(
+            self.client.stanza_processor.add_route(
+                self._on_message,
+                tag='message',
+                typ='chat'
+                )
+
+            # bind, session and initial presence are sent at once
+            res = wayround_i2p.xmpp.client.bootstrap(
                 self.client,
-                self.jid.resource
+                last_features,
+                self.jid.domain,
+                resource=self.jid.resource,
+                presence=self.presence_client
                 )
-            if not isinstance(res, str):
-                logging.debug("bind error {}".format(res.gen_error()))
+
+            if not isinstance(res['jid'], str):
+                logging.debug("bind error {}".format(res['jid']))
                 ret = 4
             else:
                 self.jid.update(
-                    wayround_i2p.xmpp.core.JID.new_from_str(res)
+                    wayround_i2p.xmpp.core.JID.new_from_str(res['jid'])
                     )
                 logging.debug(
                     "Bound jid is: {}".format(self.jid.full())
                     )
 
         if (not self._disconnection_flag.is_set()
-                and ret == 0):
-
-            logging.debug("Starting session")
+                and ret == 0
+                and res['session'] is not None):
 
-            res = wayround_i2p.xmpp.client.session(
-                self.client,
-                self.jid.domain
-                )
-
-            if (not isinstance(res, wayround_i2p.xmpp.core.Stanza)
-                    or res.is_error()):
+            if (not isinstance(res['session'], wayround_i2p.xmpp.core.Stanza)
+                    or res['session'].is_error()):
                 logging.debug("Session establishing error")
                 ret = 5
             else:
@@ -408,12 +413,6 @@ class Bot:
         if (not self._disconnection_flag.is_set()
                 and ret == 0):
 
-            self.message_client.signal.connect(
-                ['message'], self._on_message
-                )
-
-            self.presence_client.presence()
-
             logging.info("XMPP bot connected")
 
         self.is_driven = False
@@ -644,7 +643,7 @@ class Bot:
 
         return ret
 
-    def _on_message(self, event, message_client, stanza):
+    def _on_message(self, event, stanza_processor, stanza):
         self._inbound_stanzas(stanza)
 
     def _inbound_stanzas(self, obj):
@@ -676,12 +675,13 @@ class Bot:
                         wayround_i2p.xmpp.core.MessageBody(
                             text=''
                             )
-                        ]
+                        ],
+                    validation='trusted'
                     )
 
-                asker_jid = wayround_i2p.xmpp.core.JID.new_from_str(
+                asker_jid = wayround_i2p.xmpp.core.jid_to_bare(
                     obj.get_from_jid()
-                    ).bare()
+                    )
 
                 res = wayround_i2p.utils.program.command_processor(
                     command_name=None,
@@ -1,10 +1,15 @@
 
+import collections
+import concurrent.futures
+import copy
+import functools
+import itertools
 import logging
+import os
 import queue
 import re
 import threading
 import time
-import uuid
 import xml.sax.saxutils
 
 import lxml.etree
@@ -91,12 +96,32 @@ VALID_JID_MATCHES = ['full', 'bare', 'domain', 'resource', 'unknown']
 VALID_JID_CONVERSION = ['full', 'bare', 'domain', 'resource']
 
 
-def jid_is_x(string_or_jid, x):
+def _jid_x_argument(string_or_jid):
+    """
+    jid_is_x() and jid_to_x() accept any string, which has domainpart,
+    as they did before parse_jid() checks were introduced: strings,
+    failing the checks, are split without them
+    """
 
     if isinstance(string_or_jid, str):
-        string_or_jid = JID.new_from_string(string_or_jid)
 
-    if not isinstance(string_or_jid, JID):
+        in_str = string_or_jid
+
+        string_or_jid = FrozenJID.new_from_string(in_str)
+
+        if string_or_jid is None:
+            user, domain, resource = _split_jid(in_str)
+            if domain != '':
+                string_or_jid = FrozenJID(user, domain, resource)
+
+    return string_or_jid
+
+
+def jid_is_x(string_or_jid, x):
+
+    string_or_jid = _jid_x_argument(string_or_jid)
+
+    if not isinstance(string_or_jid, (JID, FrozenJID)):
         raise ValueError("invalid `string_or_jid' value")
 
     if not x in VALID_JID_MATCHES:
@@ -132,10 +157,9 @@ def jid_to_x(string_or_jid, x):
 
     ret = None
 
-    if isinstance(string_or_jid, str):
-        string_or_jid = JID.new_from_string(string_or_jid)
+    string_or_jid = _jid_x_argument(string_or_jid)
 
-    if not isinstance(string_or_jid, JID):
+    if not isinstance(string_or_jid, (JID, FrozenJID)):
         raise ValueError("invalid `string_or_jid' value")
 
     if not x in VALID_JID_CONVERSION:
@@ -175,6 +199,173 @@ def jid_to_resource(string_or_jid):
     return jid_to_x(string_or_jid, 'resource')
 
 
+JID_PART_MAX_BYTES = 1023
+
+_LOCALPART_FORBIDDEN_RE = re.compile(r'[\x00-\x20\x7f"&\'/:<>@]')
+_DOMAINPART_FORBIDDEN_RE = re.compile(r'[\x00-\x20\x7f@/]')
+_RESOURCEPART_FORBIDDEN_RE = re.compile(r'[\x00-\x1f\x7f]')
+
+
+def _check_jid_part(name, value, forbidden_re):
+
+    if value == '':
+        raise ValueError("empty {}".format(name))
+
+    # up to 4 bytes per character in UTF-8
+    if (len(value) * 4 > JID_PART_MAX_BYTES
+            and len(value.encode('utf-8')) > JID_PART_MAX_BYTES):
+        raise ValueError(
+            "{} is longer than {} bytes".format(name, JID_PART_MAX_BYTES)
+            )
+
+    if forbidden_re.search(value) is not None:
+        raise ValueError("forbidden character in {}".format(name))
+
+    return
+
+
+def parse_jid(in_str):
+    """
+    Split JID string to (localpart, domainpart, resourcepart) tuple, as
+    RFC 7622 prescribes: resourcepart is everything after first '/',
+    localpart is everything before first '@' of the rest. Missing parts
+    are None. Trailing dot of domainpart is removed.
+
+    Parts are checked for emptiness, length (1023 bytes) and characters,
+    which can not appear in them (spaces and control characters,
+    localpart additionally can't contain any of '"&\'/:<>@'). This is not
+    complete PRECIS validation: case is left as is and Unicode classes
+    are not checked.
+
+    Raises ValueError. Results, including failures, are cached.
+    """
+
+    if not isinstance(in_str, str):
+        raise TypeError("`in_str' must be str")
+
+    ret = _parse_jid_cached(in_str)
+
+    if isinstance(ret, str):
+        raise ValueError(ret)
+
+    return ret
+
+
+@functools.lru_cache(maxsize=(64 * 1024))
+def _parse_jid_cached(in_str):
+    """
+    Returns parse_jid() result or error message: lru_cache does not cache
+    exceptions
+    """
+
+    try:
+        ret = _parse_jid(in_str)
+    except ValueError as e:
+        ret = str(e)
+
+    return ret
+
+
+def _split_jid(in_str):
+    """
+    Split part of parse_jid(), without checks
+    """
+
+    localpart = None
+    resourcepart = None
+
+    slash = in_str.find('/')
+    if slash != -1:
+        resourcepart = in_str[slash + 1:]
+        in_str = in_str[:slash]
+
+    at = in_str.find('@')
+    if at != -1:
+        localpart = in_str[:at]
+        domainpart = in_str[at + 1:]
+    else:
+        domainpart = in_str
+
+    if domainpart.endswith('.'):
+        domainpart = domainpart[:-1]
+
+    return localpart, domainpart, resourcepart
+
+
+def _parse_jid(in_str):
+    """
+    Uncached parse_jid()
+    """
+
+    localpart, domainpart, resourcepart = _split_jid(in_str)
+
+    if localpart is not None:
+        _check_jid_part('localpart', localpart, _LOCALPART_FORBIDDEN_RE)
+
+    _check_jid_part('domainpart', domainpart, _DOMAINPART_FORBIDDEN_RE)
+
+    if resourcepart is not None:
+        _check_jid_part(
+            'resourcepart',
+            resourcepart,
+            _RESOURCEPART_FORBIDDEN_RE
+            )
+
+    return localpart, domainpart, resourcepart
+
+
+def jids_to_bare(jid_strings):
+    """
+    Convert iterable of JID strings to list of bare JID strings in one pass.
+    None is placed for invalid JIDs
+    """
+
+    from_str = _frozen_jid_from_str
+
+    ret = []
+
+    for i in jid_strings:
+        jid = from_str(FrozenJID, i)
+        if jid is not None:
+            jid = jid.bare()
+        ret.append(jid)
+
+    return ret
+
+
+def jids_to_domain(jid_strings):
+    """
+    Same as jids_to_bare(), but for domain parts
+    """
+
+    from_str = _frozen_jid_from_str
+
+    ret = []
+
+    for i in jid_strings:
+        jid = from_str(FrozenJID, i)
+        if jid is not None:
+            jid = jid.domain
+        ret.append(jid)
+
+    return ret
+
+
+def jids_to_frozen(jid_strings):
+    """
+    Same as jids_to_bare(), but for FrozenJID objects
+    """
+
+    from_str = _frozen_jid_from_str
+
+    ret = []
+
+    for i in jid_strings:
+        ret.append(from_str(FrozenJID, i))
+
+    return ret
+
+
 class JID:
 
     """
@@ -193,19 +384,12 @@ class JID:
 
         ret = None
 
-        res = re.match(
-            (r'^((?P<localpart>.+?)@)?(?P<domainpart>.+?)'
-             r'(/(?P<resourcepart>.+?))?$'),
-            in_str
-            )
-
-        if res:
-
-            ret = cls(
-                res.group('localpart'),
-                res.group('domainpart'),
-                res.group('resourcepart')
-                )
+        try:
+            res = parse_jid(in_str)
+        except ValueError:
+            pass
+        else:
+            ret = cls(*res)
 
         return ret
 
@@ -259,11 +443,14 @@ class JID:
     def __eq__(self, other):
 
         if isinstance(other, str):
-            other = JID.new_from_str(other)
+            other = FrozenJID.new_from_str(other)
+        elif isinstance(other, FrozenJID):
+            # FrozenJID is equal only to FrozenJID (see FrozenJID.__eq__())
+            other = None
 
         ret = False
 
-        if isinstance(other, JID):
+        if isinstance(other, (JID, FrozenJID)):
 
             if other.user == self.user and \
                     other.domain == self.domain and \
@@ -485,6 +672,179 @@ class JID:
             )
 
 
+class FrozenJID:
+
+    """
+    Immutable and hashable JID, to be used as dict key and set member.
+
+    Parsing and normalization are same as of JID: domain and user parts are
+    converted to low register. bare(), full() and str() values are computed
+    once, on creation.
+
+    Use FrozenJID.new_from_str(): created objects are cached by class and
+    source string, so parsing of same string is done only once and equal
+    JIDs usually are same objects. Subclasses get objects of own class. Mutable JID is left for those who need its
+    change signals.
+
+    FrozenJID is equal only to FrozenJID, so it is not equal to str or JID
+    with same value: they can't be used to find FrozenJID in dict or set.
+    Convert them with FrozenJID.new_from_str() or FrozenJID.new_from_jid().
+    """
+
+    __slots__ = (
+        'user', 'domain', 'resource', '_bare', '_full', '_str', '_hash'
+        )
+
+    @classmethod
+    def new_from_string(cls, in_str):
+        """
+        Returns None in case of error. Results are cached
+
+        :rtype FrozenJID:
+        """
+        return _frozen_jid_from_str(cls, in_str)
+
+    new_from_str = new_from_string
+
+    @classmethod
+    def new_from_jid(cls, jid):
+        """
+        :param JID jid:
+        """
+        return _frozen_jid_from_parts(
+            cls, jid.user, jid.domain, jid.resource
+            )
+
+    def __init__(self, user=None, domain=None, resource=None):
+
+        if user == '':
+            user = None
+
+        if domain == '':
+            domain = None
+
+        if resource == '':
+            resource = None
+
+        if user is not None:
+            user = str(user).lower()
+
+        if domain is not None:
+            domain = str(domain).lower()
+
+        if resource is not None:
+            resource = str(resource)
+
+        set_ = object.__setattr__
+
+        set_(self, 'user', user)
+        set_(self, 'domain', domain)
+        set_(self, 'resource', resource)
+
+        bare = domain or ''
+        if user is not None:
+            bare = '{}@{}'.format(user, bare)
+
+        set_(self, '_bare', bare)
+        set_(self, '_full', '{}/{}'.format(bare, resource or 'default'))
+
+        str_ = bare
+        if resource is not None:
+            str_ = '{}/{}'.format(bare, resource)
+
+        set_(self, '_str', str_)
+        set_(self, '_hash', hash((user, domain, resource)))
+
+        return
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenJID is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FrozenJID is immutable")
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+
+        if other is self:
+            return True
+
+        ret = False
+
+        if isinstance(other, FrozenJID):
+            ret = (
+                other._hash == self._hash
+                and other.user == self.user
+                and other.domain == self.domain
+                and other.resource == self.resource
+                )
+
+        return ret
+
+    def __str__(self):
+        return self._str
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self._str)
+
+    def bare(self):
+        return self._bare
+
+    def full(self):
+        return self._full
+
+    def bare_obj(self):
+        ret = self
+        if self.resource is not None:
+            ret = _frozen_jid_from_parts(
+                type(self), self.user, self.domain, None
+                )
+        return ret
+
+    def domain_obj(self):
+        return _frozen_jid_from_parts(type(self), None, self.domain, None)
+
+    def with_resource(self, resource):
+        return _frozen_jid_from_parts(
+            type(self), self.user, self.domain, resource
+            )
+
+    def to_jid(self):
+        """
+        Mutable JID copy
+        """
+        return JID(self.user, self.domain, self.resource)
+
+    get_type = JID.get_type
+    is_full = JID.is_full
+    is_bare = JID.is_bare
+    is_domain = JID.is_domain
+    is_resource = JID.is_resource
+    is_unknown = JID.is_unknown
+
+
+@functools.lru_cache(maxsize=(64 * 1024))
+def _frozen_jid_from_str(cls, in_str):
+
+    ret = None
+
+    try:
+        res = parse_jid(in_str)
+    except ValueError:
+        pass
+    else:
+        ret = _frozen_jid_from_parts(cls, *res)
+
+    return ret
+
+
+@functools.lru_cache(maxsize=(64 * 1024))
+def _frozen_jid_from_parts(cls, user, domain, resource):
+    return cls(user, domain, resource)
+
+
 class Authentication:
 
     def __init__(
@@ -519,6 +879,108 @@ class C2SConnectionInfo:
         self.priority = priority
 
 
+class StreamTracer:
+
+    """
+    Records stream traffic for post-mortem analysis.
+
+    Tracing is off by default. Enable it with
+    set_stream_tracer(StreamTracer(...)); while no tracer set, stream hot
+    paths only check one module global.
+
+    Records are (time, kind, source, data) tuples, where kind is
+
+    'in'     - bytes fed to input parser
+    'out'    - bytes written to output
+    'parser' - parser target events, if parser_events is True. data is
+               (event name, value) tuple
+
+    source is id() of reader, writer or parser target object.
+
+    Last `size' records are kept in memory (get_records(), dump()). If
+    `file' (text file object) is given, records are also written to it
+    as soon as they made.
+    """
+
+    def __init__(self, size=10000, file=None, parser_events=False):
+
+        self.parser_events = parser_events
+
+        self._records = collections.deque(maxlen=size)
+        self._file = file
+        self._lock = threading.Lock()
+
+        return
+
+    def trace(self, kind, source, data):
+
+        record = (time.time(), kind, source, data)
+
+        with self._lock:
+            self._records.append(record)
+            if self._file is not None:
+                self._file.write(self.format_record(record))
+                self._file.flush()
+
+        return
+
+    def get_records(self):
+        with self._lock:
+            ret = list(self._records)
+        return ret
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+        return
+
+    def dump(self, file):
+        """
+        Write records, kept in memory, to text file object
+        """
+        for i in self.get_records():
+            file.write(self.format_record(i))
+        return
+
+    @staticmethod
+    def format_record(record):
+        return "{:.6f} {:>6} {:x} {!r}\n".format(
+            record[0],
+            record[1],
+            record[2],
+            record[3]
+            )
+
+
+_stream_tracer = None
+
+
+def set_stream_tracer(tracer):
+    """
+    :param StreamTracer tracer: None disables tracing
+    """
+
+    global _stream_tracer
+
+    if tracer is not None and not isinstance(tracer, StreamTracer):
+        raise TypeError("`tracer' must be None or StreamTracer")
+
+    _stream_tracer = tracer
+
+    return
+
+
+def get_stream_tracer():
+    return _stream_tracer
+
+
+def _trace_parser_event(target, event, value):
+    tracer = _stream_tracer
+    if tracer is not None and tracer.parser_events:
+        tracer.trace('parser', id(target), (event, value))
+    return
+
+
 class XMPPStreamParserTargetClosed(Exception):
 
     """
@@ -577,13 +1039,8 @@ class XMPPStreamParserTarget:
         Target receiving tag starts
         """
 
-        logging.debug(
-            "{} :: start tag: `{}'; attrs: {}".format(
-                type(self).__name__,
-                name,
-                attributes
-                )
-            )
+        if _stream_tracer is not None:
+            _trace_parser_event(self, 'start', (name, dict(attributes)))
 
         if self.target_closed:
             raise XMPPStreamParserTargetClosed()
@@ -633,7 +1090,8 @@ class XMPPStreamParserTarget:
         Target receiving tag ends
         """
 
-        logging.debug("{} :: end `{}'".format(type(self).__name__, name))
+        if _stream_tracer is not None:
+            _trace_parser_event(self, 'end', name)
 
         if self.target_closed:
             raise XMPPStreamParserTargetClosed()
@@ -669,7 +1127,8 @@ class XMPPStreamParserTarget:
         Target receiving data
         """
 
-        logging.debug("{} :: data `{}'".format(type(self).__name__, data))
+        if _stream_tracer is not None:
+            _trace_parser_event(self, 'data', data)
 
         if self.target_closed:
             raise XMPPStreamParserTargetClosed()
@@ -684,7 +1143,8 @@ class XMPPStreamParserTarget:
         Target receiving comment
         """
 
-        logging.debug("{} :: comment `{}'".format(type(self).__name__, text))
+        if _stream_tracer is not None:
+            _trace_parser_event(self, 'comment', text)
 
         if self.target_closed:
             raise XMPPStreamParserTargetClosed()
@@ -694,6 +1154,21 @@ class XMPPStreamParserTarget:
 
         return
 
+    def complete_element(self, element):
+        """
+        Target receiving already built element. Used by
+        XMPPOutputStreamWriter to report outgoing elements without parsing
+        them
+        """
+
+        if self.target_closed:
+            raise XMPPStreamParserTargetClosed()
+
+        if len(self._depth_tracker) == 1:
+            self.signal.emit('element_readed', self, element)
+
+        return
+
     def close(self):
         """
         This target is reacting on stream end and calls callback function
@@ -722,10 +1197,13 @@ class XMPPInputStreamReader:
         self._read_from = read_from
         self._xml_parser = xml_parser
 
+        # notified on worker threads exit
+        self._state_condition = threading.Condition()
+
         self._clear(init=True)
 
-        self._feed_pool = queue.Queue()
-#        self._feed_lock = threading.Lock()
+        self._feed_pool = collections.deque()
+        self._feed_pool_condition = threading.Condition()
         self._feed_pool_thread = None
 
         return
@@ -821,6 +1299,9 @@ class XMPPInputStreamReader:
 
             self._termination_event.set()
 
+            with self._feed_pool_condition:
+                self._feed_pool_condition.notify_all()
+
             self.wait('stopped')
 
             self._clear()
@@ -852,87 +1333,359 @@ class XMPPInputStreamReader:
         if not what in allowed_what:
             raise ValueError("`what' must be in {}".format(allowed_what))
 
-        while True:
+        with self._state_condition:
+            while self.stat() != what:
+                self._state_condition.wait()
 
-            logging.debug(
-                "{} :: waiting for {}".format(type(self).__name__, what)
-                )
+        return
 
-            if self.stat() == what:
-                break
+    def reset(self, xml_parser):
+        """
+        Feed data, which is not fed to parser yet, to new xml_parser. This
+        includes data already received and waiting in pool. Reading threads
+        are kept working
+        """
 
-            time.sleep(0.1)
+        with self._feed_pool_condition:
+            self._xml_parser = xml_parser
 
         return
 
     def _on_stream_reader_thread_exit(self):
-        self._stream_reader_thread = None
+        with self._state_condition:
+            self._stream_reader_thread = None
+            self._state_condition.notify_all()
+        return
 
     def _feed(self, bytes_text):
 
         if not isinstance(bytes_text, bytes):
             raise TypeError("bytes_text must be bytes type")
 
-        self._feed_pool.put(bytes_text)
+        with self._feed_pool_condition:
+            self._feed_pool.append(bytes_text)
+            self._feed_pool_condition.notify()
 
         return len(bytes_text)
 
     def _feed_pool_worker_thread(self):
+        """
+        Feeds data to XML parser as soon as it is received by _feed()
+
+        Sleeps on condition while there is no data, so wakes up only on new
+        data or on termination. All chunks accumulated while parser was busy
+        are joined and fed at once.
+        """
 
         while True:
 
-            if self._termination_event.is_set():
-                break
+            with self._feed_pool_condition:
 
-            while not self._feed_pool.empty():
+                while (len(self._feed_pool) == 0
+                        and not self._termination_event.is_set()):
+                    self._feed_pool_condition.wait()
 
                 if self._termination_event.is_set():
                     break
 
-                try:
-                    bb = self._feed_pool.get()
-                except queue.Empty:
-                    pass
+                if len(self._feed_pool) == 1:
+                    bb = self._feed_pool.popleft()
                 else:
-                    logging.debug(
-                        "{}::\n--in---\n{}\n-------".format(
-                            type(self).__name__, repr(bb)
-                            )
-                        )
+                    bb = b''.join(self._feed_pool)
+                    self._feed_pool.clear()
 
-                    try:
-                        self._xml_parser.feed(bb)
-                    except:
-                        logging.exception(
-                            "{} :: _feed {}".format(
-                                type(self).__name__, str(bb, encoding='utf-8')
-                                )
-                            )
-                    self._feed_pool.task_done()
+                # parser is taken together with data: data, taken from
+                # pool after reset(), goes to new parser, even if it was
+                # received before reset()
+                xml_parser = self._xml_parser
 
-            time.sleep(0.2)
+            tracer = _stream_tracer
+            if tracer is not None:
+                tracer.trace('in', id(self), bb)
 
-            if self._termination_event.is_set():
-                break
+            try:
+                xml_parser.feed(bb)
+            except:
+                logging.exception(
+                    "{} :: _feed {}".format(
+                        type(self).__name__, str(bb, encoding='utf-8')
+                        )
+                    )
 
-        self._feed_pool_thread = None
+        with self._state_condition:
+            self._feed_pool_thread = None
+            self._state_condition.notify_all()
 
         return
 
 
-class XMPPOutputStreamWriter:
-
+def get_outgoing_object_events(obj, data):
+    """
+    Determine parser target events which outgoing object produces, without
+    feeding it to parser of outgoing stream.
+
+    obj - object passed for sending, data - obj converted to bytes
+
+    Returns list of tuples:
+        ('start', attributes) - stream opening tag
+        ('element', element)  - stanza
+        ('stop', None)        - stream closing tag
+
+    lxml elements are reported as they are passed for sending, without
+    copying: tags of elements, generated without namespace, are not
+    qualified with namespace of stream (see qualify_outgoing_element()).
+
+    str and bytes are not parsed, except stream opening tag: stanzas sent
+    as str or bytes produce no events. Feed data to parser (reparse mode of
+    XMPPOutputStreamWriter) to get them.
+    """
+
+    ret = []
+
+    if wayround_i2p.utils.lxml.is_lxml_tag_element(obj):
+        ret.append(('element', obj))
+
+    else:
+
+        stripped = data.strip()
+
+        if (stripped.startswith(b'<?xml')
+                or stripped.startswith(b'<stream:stream')):
+
+            header_start = stripped.find(b'<stream:stream')
+
+            if header_start != -1:
+
+                header_end = stripped.find(b'>', header_start)
+
+                try:
+                    header = lxml.etree.fromstring(
+                        stripped[header_start:header_end + 1]
+                        + b'</stream:stream>'
+                        )
+                except:
+                    logging.exception(
+                        "Can't parse outgoing stream header: {}".format(
+                            stripped
+                            )
+                        )
+                else:
+                    ret.append(('start', dict(header.attrib)))
+
+        elif stripped == b'</stream:stream>':
+            ret.append(('stop', None))
+
+    return ret
+
+
+def qualify_outgoing_element(element, namespace):
+    """
+    Returns `element' with tags, which parser of stream with default
+    namespace `namespace' would give to it after serialization: elements
+    without namespace get default namespace of their scope (`namespace' for
+    topmost ones).
+
+    `element' is not changed: copy is returned if tags are changed.
+
+    Elements, reported for outgoing stream without reparse, are not
+    qualified (see get_outgoing_object_events()): listeners, which need
+    same tags as peer gets, call this function for them.
+    """
+
+    tags = []
+    changed = False
+
+    for i in element.iter(tag=lxml.etree.Element):
+
+        tag = i.tag
+
+        if not tag.startswith('{'):
+            i_namespace = i.nsmap.get(None, namespace)
+            if i_namespace is not None:
+                tag = '{{{}}}{}'.format(i_namespace, tag)
+                changed = True
+
+        tags.append(tag)
+
+    ret = element
+
+    if changed:
+        ret = copy.deepcopy(element)
+        for i, tag in zip(ret.iter(tag=lxml.etree.Element), tags):
+            i.tag = tag
+
+    return ret
+
+
+def apply_outgoing_object_events(xml_target, events):
+    """
+    Pass events returned by get_outgoing_object_events() to
+    XMPPStreamParserTarget
+    """
+
+    for event, value in events:
+
+        if event == 'start':
+            xml_target.start(
+                '{http://etherx.jabber.org/streams}stream',
+                value
+                )
+
+        elif event == 'element':
+            xml_target.complete_element(value)
+
+        elif event == 'stop':
+            if xml_target.open:
+                xml_target.end('{http://etherx.jabber.org/streams}stream')
+
+        else:
+            raise Exception("Programming error")
+
+    return
+
+
+class XMPPOutputJob:
+
+    """
+    Completion handle of object queued by XMPPOutputStreamWriter.send()
+    """
+
+    def __init__(self, obj, data=None, events=None):
+        """
+        obj - object passed to send()
+
+        data - obj converted to bytes
+
+        events - get_outgoing_object_events() result, or None if data is
+        to be fed to parser of outgoing stream
+        """
+
+        self.obj = obj
+        self.data = data
+        self.events = events
+        self.error = None
+
+        self._done_event = threading.Event()
+
+        return
+
+    def is_done(self):
+        return self._done_event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Returns True if object is written (or failed, see `error'), False on
+        timeout
+        """
+        return self._done_event.wait(timeout)
+
+    def set_done(self, error=None):
+        self.error = error
+        self._done_event.set()
+        return
+
+
+class XMPPOutputResetJob(XMPPOutputJob):
+
+    """
+    Queued by XMPPOutputStreamWriter.reset(). Switches writer to new parser
+    and target after all objects, queued before it, are written and
+    reported to old target
+    """
+
+    def __init__(self, xml_parser, xml_target):
+
+        super().__init__(None, b'', [])
+
+        self.xml_parser = xml_parser
+        self.xml_target = xml_target
+
+        return
+
+
+class XMPPOutputStreamWriter:
+
     """
     Class for functions related to writing data to socket streamer
+
+    Objects are written by single writer thread in order of send() calls.
+
+    Objects are converted to bytes by send(). When size of queued data
+    reaches high_watermark, send() callers are blocked until writer reduces
+    it to low_watermark.
+
+    In coalescing mode writer joins all queued objects (up to
+    coalesce_max_bytes) and writes them with single write() call. If
+    coalesce_delay is not 0, writer waits up to coalesce_delay seconds for
+    more objects before writing.
+
+    Written data is reported to xml_parser target, as in old versions: all
+    written data is fed to xml_parser. If xml_target (target of xml_parser)
+    is passed and reparse is not True, stream start, stop and sent lxml
+    elements are reported to xml_target directly instead, without parsing
+    (see get_outgoing_object_events() for differences).
     """
 
-    def __init__(self, write_to, xml_parser):
+    def __init__(
+            self,
+            write_to,
+            xml_parser,
+            high_watermark=(4 * 1024 ** 2),
+            low_watermark=(1 * 1024 ** 2),
+            coalesce=False,
+            coalesce_max_bytes=(64 * 1024),
+            coalesce_delay=0,
+            xml_target=None,
+            reparse=None
+            ):
         """
         read_from - xml stream input
+
+        high_watermark, low_watermark, coalesce_max_bytes - in bytes
+
+        coalesce_delay - in seconds
+
+        xml_target - target of xml_parser. If None, written data is fed to
+        xml_parser
+
+        reparse - feed written data to xml_parser even if xml_target is
+        passed
         """
 
+        if low_watermark > high_watermark:
+            raise ValueError("`low_watermark' must be <= `high_watermark'")
+
+        if coalesce_delay < 0:
+            raise ValueError("`coalesce_delay' must be >= 0")
+
         self._write_to = write_to
         self._xml_parser = xml_parser
+        self._xml_target = xml_target
+        self._reparse = bool(reparse) or xml_target is None
+
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
+
+        self._coalesce = coalesce
+        self._coalesce_max_bytes = coalesce_max_bytes
+        self._coalesce_delay = coalesce_delay
+
+        self._output_stat_lock = threading.Lock()
+        self._output_stat = {
+            'objects': 0,
+            'writes': 0,
+            'bytes': 0,
+            'coalesced_objects': 0,
+            'coalesced_writes': 0,
+            'coalesced_bytes': 0
+            }
+
+        self._output_lock = threading.Lock()
+        self._output_not_empty = threading.Condition(self._output_lock)
+        self._output_not_full = threading.Condition(self._output_lock)
+
+        # notified on writer thread exit
+        self._state_condition = threading.Condition()
 
         self._clear(init=True)
 
@@ -949,7 +1702,9 @@ class XMPPOutputStreamWriter:
 
         self._stream_writer_thread = None
 
-        self._output_queue = []
+        self._output_queue = collections.deque()
+        self._output_queue_bytes = 0
+        self._backpressure = False
 
         self._stat = 'stopped'
 
@@ -1001,7 +1756,11 @@ class XMPPOutputStreamWriter:
             self._stopping = True
             self._stat = 'stopping'
 
-            self._stop_flag = True
+            # writer thread exits after writing already queued objects
+            with self._output_lock:
+                self._stop_flag = True
+                self._output_not_empty.notify_all()
+                self._output_not_full.notify_all()
 
             self.wait('stopped')
 
@@ -1032,95 +1791,248 @@ class XMPPOutputStreamWriter:
         if not what in allowed_what:
             raise ValueError("`what' must be in {}".format(allowed_what))
 
-        while True:
+        with self._state_condition:
+            while self.stat() != what:
+                self._state_condition.wait()
 
-            logging.debug(
-                "{} :: waiting for {}".format(type(self).__name__, what)
-                )
+        return
 
-            if self.stat() == what:
-                break
+    def send(self, obj):
+        """
+        Queue object for writing and return XMPPOutputJob without waiting
+        for it to be written.
 
-            time.sleep(0.1)
+        Blocks while queue is over high watermark
+        """
 
-        return
+        data = self._obj_to_bytes(obj)
 
-    def send(self, obj):
+        events = None
+        if not self._reparse:
+            events = get_outgoing_object_events(obj, data)
 
-        if self._stop_flag:
-            raise RuntimeError("Stopping. Sending not allowed")
+        ret = XMPPOutputJob(obj, data, events)
 
-        self._output_queue.append(obj)
+        with self._output_lock:
 
-        while True:
+            while self._backpressure and not self._stop_flag:
+                self._output_not_full.wait()
 
             if self._stop_flag:
-                break
+                raise RuntimeError("Stopping. Sending not allowed")
 
-            if not obj in self._output_queue:
-                break
+            self._output_queue.append(ret)
+            self._output_queue_bytes += len(ret.data)
 
-            time.sleep(0.1)
+            if self._output_queue_bytes >= self._high_watermark:
+                self._backpressure = True
 
-        return
+            self._output_not_empty.notify()
+
+        return ret
+
+    def reset(self, xml_parser, xml_target=None):
+        """
+        Switch to new xml_parser and xml_target (see __init__()) without
+        stopping writer thread and dropping queued objects. Objects, sent
+        before reset(), are reported to old ones.
+
+        If xml_target is None, data sent after reset() is fed to
+        xml_parser.
+
+        Returns XMPPOutputResetJob, which is done when switch is done
+        """
+
+        ret = XMPPOutputResetJob(xml_parser, xml_target)
+
+        with self._output_lock:
+
+            if self._stop_flag:
+                raise RuntimeError("Stopping. Reset not allowed")
+
+            if xml_target is None:
+                self._reparse = True
+
+            self._output_queue.append(ret)
+
+            self._output_not_empty.notify()
+
+        return ret
+
+    def get_output_queue_stat(self):
+        """
+        Returns dict with 'objects', 'bytes' and 'backpressure' keys
+        """
+        with self._output_lock:
+            ret = {
+                'objects': len(self._output_queue),
+                'bytes': self._output_queue_bytes,
+                'backpressure': self._backpressure
+                }
+        return ret
+
+    def get_output_stat(self):
+        """
+        Writing counters. Returns dict with following keys:
+
+        'objects'           - objects written
+        'writes'            - write() calls done
+        'bytes'             - bytes written
+        'coalesced_objects' - objects written together with other objects
+        'coalesced_writes'  - write() calls with more than one object
+        'coalesced_bytes'   - bytes written by such calls
+        """
+        with self._output_stat_lock:
+            ret = dict(self._output_stat)
+        return ret
+
+    def _take_jobs(self):
+        """
+        Must be called with self._output_lock acquired and nonempty queue
+        """
+
+        ret = [self._output_queue.popleft()]
+        size = len(ret[0].data)
+
+        if self._coalesce and not isinstance(ret[0], XMPPOutputResetJob):
+            while (len(self._output_queue) != 0
+                    and not isinstance(
+                        self._output_queue[0],
+                        XMPPOutputResetJob
+                        )
+                    and (size + len(self._output_queue[0].data)
+                         <= self._coalesce_max_bytes)):
+                job = self._output_queue.popleft()
+                size += len(job.data)
+                ret.append(job)
+
+        self._output_queue_bytes -= size
+
+        if (self._backpressure
+                and self._output_queue_bytes <= self._low_watermark):
+            self._backpressure = False
+            self._output_not_full.notify_all()
+
+        return ret
 
     def _output_worker(self):
 
         while True:
-            if len(self._output_queue) != 0:
 
-                while len(self._output_queue) != 0:
-                    self._send_object(self._output_queue[0])
-                    del self._output_queue[0]
+            with self._output_lock:
 
-            else:
+                while (len(self._output_queue) == 0
+                        and not self._stop_flag):
+                    self._output_not_empty.wait()
 
-                if self._stop_flag:
+                if len(self._output_queue) == 0:
                     break
 
-                time.sleep(0.1)
+                if self._coalesce and self._coalesce_delay != 0:
 
-        self._stream_writer_thread = None
+                    deadline = time.monotonic() + self._coalesce_delay
+
+                    while (not self._stop_flag
+                            and (self._output_queue_bytes
+                                 < self._coalesce_max_bytes)):
+
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+
+                        self._output_not_empty.wait(timeout)
+
+                jobs = self._take_jobs()
+
+                if isinstance(jobs[0], XMPPOutputResetJob):
+                    self._xml_parser = jobs[0].xml_parser
+                    self._xml_target = jobs[0].xml_target
+                    jobs[0].set_done()
+                    continue
+
+            if len(jobs) == 1:
+                data = jobs[0].data
+            else:
+                data = b''.join([i.data for i in jobs])
+
+            error = None
+
+            try:
+                self._send_object(data)
+            except Exception as e:
+                logging.exception(
+                    "{} :: error writing object".format(type(self).__name__)
+                    )
+                error = e
+            else:
+                for i in jobs:
+                    self._report_job(i)
+
+            with self._output_stat_lock:
+                self._output_stat['objects'] += len(jobs)
+                self._output_stat['writes'] += 1
+                self._output_stat['bytes'] += len(data)
+                if len(jobs) > 1:
+                    self._output_stat['coalesced_objects'] += len(jobs)
+                    self._output_stat['coalesced_writes'] += 1
+                    self._output_stat['coalesced_bytes'] += len(data)
+
+            for i in jobs:
+                i.set_done(error=error)
+
+        with self._state_condition:
+            self._stream_writer_thread = None
+            self._state_condition.notify_all()
 
         return
 
-    def _send_object(self, obj):
+    def _obj_to_bytes(self, obj):
 
-        snd_obj = None
+        ret = None
 
         if isinstance(obj, bytes):
-            snd_obj = obj
+            ret = obj
         elif isinstance(obj, str):
-            snd_obj = bytes(obj, encoding='utf-8')
+            ret = bytes(obj, encoding='utf-8')
         elif wayround_i2p.utils.lxml.is_lxml_tag_element(obj):
-            snd_obj = bytes(
-                lxml.etree.tostring(
-                    obj,
-                    encoding='utf-8'
-                    ),
-                encoding='utf-8'
-                )
+            ret = lxml.etree.tostring(obj, encoding='utf-8')
         else:
             raise Exception(
                 "Wrong obj type. Can be bytes, str or lxml.etree.Element"
                 )
 
+        return ret
+
+    def _send_object(self, snd_obj):
+
         self._write_to.write(snd_obj)
 
-        logging.debug(
-            "Feeding data to self._xml_parser.feed:"
-            "\n--out--\n{}\n-------".format(
-                snd_obj
-                )
-            )
+        tracer = _stream_tracer
+        if tracer is not None:
+            tracer.trace('out', id(self), snd_obj)
 
-        try:
-            # Do not make this threaded or it will jam parser
-            self._xml_parser.feed(snd_obj)
-        except:
-            logging.exception(
-                "Exception while starting thread of self._xml_parser.feed"
-                )
+        return
+
+    def _report_job(self, job):
+
+        if job.events is None:
+            try:
+                # Do not make this threaded or it will jam parser
+                self._xml_parser.feed(job.data)
+            except:
+                logging.exception(
+                    "Exception while starting thread of self._xml_parser.feed"
+                    )
+
+        else:
+            try:
+                apply_outgoing_object_events(self._xml_target, job.events)
+            except:
+                logging.exception(
+                    "{} :: error reporting written object".format(
+                        type(self).__name__
+                        )
+                    )
 
         return
 
@@ -1135,12 +2047,20 @@ class XMPPStreamMachine:
     'stop' (self, attrs=attributes)
     """
 
-    def __init__(self, mode='reader'):
+    def __init__(self, mode='reader', output_parameters=None):
+        """
+        output_parameters - dict of additional keyword arguments for
+        XMPPOutputStreamWriter (used in 'writer' mode)
+        """
 
         if not mode in ['reader', 'writer']:
             raise ValueError("Invalid Mode selected")
 
+        if output_parameters is None:
+            output_parameters = {}
+
         self.mode = mode
+        self.output_parameters = output_parameters
 
         self.signal = wayround_i2p.utils.threading.Signal(
             self,
@@ -1172,23 +2092,25 @@ class XMPPStreamMachine:
         self.signal.emit(signal_name, *args, **kwargs)
 
     def send(self, obj):
+        """
+        Returns XMPPOutputJob
+        """
+
+        ret = None
 
         if (self.stream_worker
                 and hasattr(self.stream_worker, 'send')
                 and callable(self.stream_worker.send)
             ):
 
-            threading.Thread(
-                target=self.stream_worker.send,
-                args=(obj,)
-                ).start()
+            ret = self.stream_worker.send(obj)
 
         else:
             raise Exception(
                 "Current stream worker doesn't support send function"
                 )
 
-        return
+        return ret
 
     def start(self):
         """
@@ -1204,16 +2126,7 @@ class XMPPStreamMachine:
 
             self._starting = True
 
-            self.xml_target = XMPPStreamParserTarget()
-
-            self.xml_target.signal.connect(True, self._signal_proxy)
-
-            self._xml_parser = lxml.etree.XMLParser(
-                target=self.xml_target,
-                huge_tree=True
-                #                strip_cdata=False,
-                #                resolve_entities=False
-                )
+            self._new_parser()
 
             self.stream_worker = None
 
@@ -1226,7 +2139,9 @@ class XMPPStreamMachine:
             elif self.mode == 'writer':
                 self.stream_worker = XMPPOutputStreamWriter(
                     self._sock_streamer.strin,
-                    self._xml_parser
+                    self._xml_parser,
+                    xml_target=self.xml_target,
+                    **self.output_parameters
                     )
 
             else:
@@ -1282,6 +2197,66 @@ class XMPPStreamMachine:
         self.start()
         return
 
+    def reset(self, timeout=10):
+        """
+        Synchronous. Start new stream on same connection (after STARTTLS or
+        SASL): replace parser and parser target, keeping stream worker, its
+        threads and queues. Objects, sent before reset(), are reported by
+        old target.
+
+        Does restart() if not working
+
+        Returns False if writer did not write objects, sent before reset(),
+        in `timeout' seconds (or if machine is not working after restart()),
+        True otherwise
+        """
+
+        ret = True
+
+        if self._starting or self._stopping or self.stat() != 'working':
+            self.restart()
+            ret = self.stat() == 'working'
+
+        else:
+
+            old_xml_target = self.xml_target
+
+            self._new_parser()
+
+            if self.mode == 'reader':
+                self.stream_worker.reset(self._xml_parser)
+            else:
+                ret = self.stream_worker.reset(
+                    self._xml_parser,
+                    xml_target=self.xml_target
+                    ).wait(timeout)
+
+                if not ret:
+                    logging.error(
+                        "{} :: writer reset timeout".format(
+                            type(self).__name__
+                            )
+                        )
+
+            old_xml_target.signal.disconnect(self._signal_proxy)
+
+        return ret
+
+    def _new_parser(self):
+
+        self.xml_target = XMPPStreamParserTarget()
+
+        self.xml_target.signal.connect(True, self._signal_proxy)
+
+        self._xml_parser = lxml.etree.XMLParser(
+            target=self.xml_target,
+            huge_tree=True
+            #                strip_cdata=False,
+            #                resolve_entities=False
+            )
+
+        return
+
 
 class XMPPIOStreamRWMachine:
 
@@ -1299,10 +2274,16 @@ class XMPPIOStreamRWMachine:
     'out_stop'           (parser_target, attrs=attributes)
     """
 
-    def __init__(self):
+    def __init__(self, output_parameters=None):
+        """
+        output_parameters - see XMPPStreamMachine
+        """
 
         self.in_machine = XMPPStreamMachine(mode='reader')
-        self.out_machine = XMPPStreamMachine(mode='writer')
+        self.out_machine = XMPPStreamMachine(
+            mode='writer',
+            output_parameters=output_parameters
+            )
 
         logging.debug("XMPPIOStreamRWMachine __init__()")
         self.signal = wayround_i2p.utils.threading.Signal(
@@ -1351,6 +2332,14 @@ class XMPPIOStreamRWMachine:
         self.out_machine.restart()
         return
 
+    def reset(self, timeout=10):
+        """
+        Synchronous. See XMPPStreamMachine.reset()
+        """
+        in_ret = self.in_machine.reset(timeout=timeout)
+        out_ret = self.out_machine.reset(timeout=timeout)
+        return in_ret and out_ret
+
     def wait(self, what='stopped'):
         self.in_machine.wait(what=what)
         self.out_machine.wait(what=what)
@@ -1363,12 +2352,13 @@ class XMPPIOStreamRWMachine:
         v1 = self.in_machine.stat()
         v2 = self.out_machine.stat()
 
-        logging.debug("""
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("""
 IO Machine:
 self.in_machine.stat()  == {}
 self.out_machine.stat() == {}
 """.format(v1, v2)
-            )
+                )
 
         if v1 == v2 == 'working':
             ret = 'working'
@@ -1382,14 +2372,11 @@ self.out_machine.stat() == {}
         return ret
 
     def send(self, obj):
-
-        threading.Thread(
-            target=self.out_machine.send,
-            args=(obj,),
-            name="XMPPIOStreamRWMachine send thread"
-            ).start()
-
-        return
+        """
+        Queue object for sending. Returns XMPPOutputJob without waiting for
+        object to be written
+        """
+        return self.out_machine.send(obj)
 
 
 class Driver:
@@ -1424,8 +2411,36 @@ class StanzaMalformed(Exception):
     """
 
 
+STANZA_VALIDATION_MODES = ['strict', 'normal', 'trusted']
+
+
 class Stanza:
 
+    """
+    Message, presence or iq stanza.
+
+    `validation' selects, how much stanza checks itself:
+
+        'strict'  - every set_*() call checks value, new_from_element() and
+                    gen_element() check whole stanza again (old behavior);
+
+        'normal'  - constructor and set_*() calls check values,
+                    new_from_element() checks whole stanza once, gen_element()
+                    does not check again. Lists, returned by get_*() and
+                    changed in place, are not rechecked;
+
+        'trusted' - nothing is checked. For stanzas, which are built by
+                    library itself from values known to be correct. check()
+                    still can be called explicitly.
+    """
+
+    __slots__ = (
+        '_validation',
+        '_element', '_objects', '_tag', '_ide', '_from_jid', '_to_jid',
+        '_typ', '_xmlns', '_xmllang', '_thread', '_subject', '_body',
+        '_show', '_status', '_priority'
+        )
+
     def __init__(
         self,
 
@@ -1434,9 +2449,16 @@ class Stanza:
 
         thread=None, subject=None, body=None, objects=None,
 
-            priority=None, show=None, status=None
+            priority=None, show=None, status=None,
+
+            validation='normal'
             ):
 
+        if not validation in STANZA_VALIDATION_MODES:
+            raise ValueError(
+                "`validation' must be in {}".format(STANZA_VALIDATION_MODES)
+                )
+
         if body is None:
             body = []
 
@@ -1449,27 +2471,43 @@ class Stanza:
         if status is None:
             status = []
 
-        self.set_element(None)
-        self.set_objects(objects)
+        self._validation = validation
 
-        self.set_tag(tag)
-        self.set_ide(ide)
-        self.set_from_jid(from_jid)
-        self.set_to_jid(to_jid)
-        self.set_typ(typ)
-        self.set_xmlns(xmlns)
-        self.set_xmllang(xmllang)
+        self._element = None
+        self._objects = objects
 
-        self.set_thread(thread)
-        self.set_subject(subject)
-        self.set_body(body)
+        self._tag = tag
+        self._ide = ide
+        self._from_jid = from_jid
+        self._to_jid = to_jid
+        self._typ = typ
+        self._xmlns = xmlns
+        self._xmllang = xmllang
+
+        self._thread = thread
+        self._subject = subject
+        self._body = body
 
-        self.set_show(show)
-        self.set_status(status)
-        self.set_priority(priority)
+        self._show = show
+        self._status = status
+        self._priority = priority
+
+        if validation != 'trusted':
+            self.check()
 
         return
 
+    def get_validation(self):
+        return self._validation
+
+    def set_validation(self, value):
+        if not value in STANZA_VALIDATION_MODES:
+            raise ValueError(
+                "`validation' must be in {}".format(STANZA_VALIDATION_MODES)
+                )
+        self._validation = value
+        return
+
     def __str__(self):
         return self.to_str()
 
@@ -1496,11 +2534,11 @@ class Stanza:
 
     def check_from_jid(self, value):
         if value is not None:
-            JID.new_from_str(value)
+            FrozenJID.new_from_str(value)
 
     def check_to_jid(self, value):
         if value is not None:
-            JID.new_from_str(value)
+            FrozenJID.new_from_str(value)
 
     def check_typ(self, value):
 
@@ -1554,13 +2592,32 @@ class Stanza:
 
     def check_priority(self, value):
         if (value is not None
-                and (not isinstance(value, int) or not value in range(255))):
+                and (not isinstance(value, int)
+                     or not -128 <= value <= 127)):
             raise ValueError(
-                "`priority' must be byte and 0 <= `priority' 255"
+                "`priority' must be int and -128 <= `priority' <= 127"
                 )
 
+    def check(self):
+        self.check_element(self._element)
+        self.check_objects(self._objects)
+        self.check_tag(self._tag)
+        self.check_ide(self._ide)
+        self.check_from_jid(self._from_jid)
+        self.check_to_jid(self._to_jid)
+        self.check_typ(self._typ)
+        self.check_xmlns(self._xmlns)
+        self.check_xmllang(self._xmllang)
+        self.check_thread(self._thread)
+        self.check_subject(self._subject)
+        self.check_body(self._body)
+        self.check_show(self._show)
+        self.check_status(self._status)
+        self.check_priority(self._priority)
+        return
+
     @classmethod
-    def new_from_element(cls, element):
+    def new_from_element(cls, element, validation='normal'):
 
         tag, ns = wayround_i2p.utils.lxml.parse_element_tag(
             element,
@@ -1571,9 +2628,22 @@ class Stanza:
         if tag is None:
             raise ValueError("invalid element")
 
+        if not validation in STANZA_VALIDATION_MODES:
+            raise ValueError(
+                "`validation' must be in {}".format(STANZA_VALIDATION_MODES)
+                )
+
+        # in 'normal' mode values are not checked one by one, but whole
+        # stanza is checked once in the end
+
+        fill_validation = validation
+        if fill_validation == 'normal':
+            fill_validation = 'trusted'
+
         cl = cls(
             tag=tag,
-            xmlns=ns
+            xmlns=ns,
+            validation=fill_validation
             )
 
         cl.set_element(element)
@@ -1617,16 +2687,17 @@ class Stanza:
 
         priority_el = element.find('{{{}}}priority'.format(ns))
         if priority_el is not None:
-            prio = 255
+            # RFC 6121 4.7.2.3: -128..127, 0 if not set
+            prio = 0
             prio_error = False
             try:
                 prio = int(priority_el.text)
             except:
-                prio = 255
+                prio = 0
                 prio_error = True
             else:
-                if not (0 <= prio <= 255):
-                    prio = 255
+                if not (-128 <= prio <= 127):
+                    prio = 0
                     prio_error = True
 
             if prio_error:
@@ -1638,13 +2709,17 @@ class Stanza:
 
             cl.set_priority(prio)
 
-        cl.check()
+        cl.set_validation(validation)
+
+        if validation != 'trusted':
+            cl.check()
 
         return cl
 
     def gen_element(self):
 
-        self.check()
+        if self._validation == 'strict':
+            self.check()
 
         el = lxml.etree.Element(self.get_tag())
 
@@ -1682,9 +2757,9 @@ class Stanza:
             el.append(i.gen_element())
 
         priority = self.get_priority()
-        if priority:
+        if priority is not None:
             priority_el = lxml.etree.Element('priority')
-            priority_el.text = priority
+            priority_el.text = str(priority)
             el.append(priority_el)
 
         return el
@@ -1697,6 +2772,12 @@ class Stanza:
 
     to_string = to_str
 
+    def to_bytes(self):
+        """
+        UTF-8 serialization of gen_element() result, ready to be written
+        """
+        return lxml.etree.tostring(self.gen_element(), encoding='utf-8')
+
     def gen_error(self):
         return StanzaError.new_from_stanza(self)
 
@@ -1766,20 +2847,190 @@ class Stanza:
         """
         return self.get_typ() == 'error'
 
-wayround_i2p.utils.factory.class_generate_attributes(
-    Stanza,
-    [
-        'element', 'objects', 'tag', 'ide', 'from_jid', 'to_jid', 'typ',
-        'xmlns', 'xmllang', 'thread', 'subject', 'body', 'show', 'status',
-        'priority']
-    )
-wayround_i2p.utils.factory.class_generate_check(
-    Stanza,
-    [
-        'element', 'objects', 'tag', 'ide', 'from_jid', 'to_jid', 'typ',
-        'xmlns', 'xmllang', 'thread', 'subject', 'body', 'show', 'status',
-        'priority']
-    )
+
+_STANZA_ATTRIBUTES = [
+    'element', 'objects', 'tag', 'ide', 'from_jid', 'to_jid', 'typ',
+    'xmlns', 'xmllang', 'thread', 'subject', 'body', 'show', 'status',
+    'priority'
+    ]
+
+
+def _stanza_generate_accessors(name):
+
+    slot_name = '_' + name
+    checker = getattr(Stanza, 'check_' + name)
+
+    def getter(self):
+        return getattr(self, slot_name)
+
+    def setter(self, value):
+        if self._validation != 'trusted':
+            checker(self, value)
+        setattr(self, slot_name, value)
+        return
+
+    setattr(Stanza, 'get_' + name, getter)
+    setattr(Stanza, 'set_' + name, setter)
+
+    return
+
+for _i in _STANZA_ATTRIBUTES:
+    _stanza_generate_accessors(_i)
+
+del _i
+
+
+class LazyStanza(Stanza):
+
+    """
+    Stanza view of received element.
+
+    tag, ide, from_jid, to_jid, typ, xmlns and xmllang are read from element
+    attributes, without checks. Children (thread, subject, body, show,
+    status and priority) are parsed and whole stanza is checked on first
+    access to any of them, on first set_*() call and on check(),
+    gen_element() and other methods using them.
+    """
+
+    __slots__ = (
+        '_lazy_element', '_lazy_tag', '_lazy_xmlns', '_lazy_materialized'
+        )
+
+    def __init__(self, element, validation='normal'):
+
+        tag, ns = wayround_i2p.utils.lxml.parse_element_tag(
+            element,
+            ['message', 'presence', 'iq'],
+            ['jabber:client', 'jabber:server']
+            )
+
+        if tag is None:
+            raise ValueError("invalid element")
+
+        if not validation in STANZA_VALIDATION_MODES:
+            raise ValueError(
+                "`validation' must be in {}".format(STANZA_VALIDATION_MODES)
+                )
+
+        self._validation = validation
+
+        self._lazy_element = element
+        self._lazy_tag = tag
+        self._lazy_xmlns = ns
+        self._lazy_materialized = False
+
+        return
+
+    @classmethod
+    def new_from_element(cls, element, validation='normal'):
+        return cls(element, validation=validation)
+
+    def is_materialized(self):
+        return self._lazy_materialized
+
+    def check_received(self):
+        """
+        Cheap check, done by StanzaProcessor before stanza is given to
+        handlers: raises ValueError for elements, which materialize() would
+        fail on, without parsing children, which are parsed in any case
+        """
+
+        if self._lazy_materialized:
+            self.check()
+
+        else:
+
+            self.check_typ(self.get_typ())
+            self.check_from_jid(self.get_from_jid())
+            self.check_to_jid(self.get_to_jid())
+
+            for i in self._lazy_element.iterchildren(
+                    '{{{}}}thread'.format(self._lazy_xmlns)
+                    ):
+                if i.text is None:
+                    raise ValueError("`thread' must be str")
+
+        return
+
+    def materialize(self):
+        """
+        Parse children. Raises same exceptions as Stanza.new_from_element()
+        """
+
+        if not self._lazy_materialized:
+
+            full = Stanza.new_from_element(
+                self._lazy_element,
+                validation=self._validation
+                )
+
+            # full is already checked, so values are copied as is
+
+            for i in _STANZA_ATTRIBUTES:
+                slot_name = '_' + i
+                setattr(self, slot_name, getattr(full, slot_name))
+
+            self._lazy_materialized = True
+
+        return
+
+
+_LAZY_STANZA_ELEMENT_ATTRIBUTES = {
+    'ide': 'id',
+    'from_jid': 'from',
+    'to_jid': 'to',
+    'typ': 'type',
+    'xmllang': '{{{}}}lang'.format(XML_NAMESPACE)
+    }
+
+
+def _lazy_stanza_generate_accessors(name):
+
+    stanza_getter = getattr(Stanza, 'get_' + name)
+    stanza_setter = getattr(Stanza, 'set_' + name)
+
+    def getter(self):
+
+        if not self._lazy_materialized:
+
+            if name == 'element':
+                return self._lazy_element
+
+            if name == 'tag':
+                return self._lazy_tag
+
+            if name == 'xmlns':
+                return self._lazy_xmlns
+
+            if name in _LAZY_STANZA_ELEMENT_ATTRIBUTES:
+                return self._lazy_element.get(
+                    _LAZY_STANZA_ELEMENT_ATTRIBUTES[name]
+                    )
+
+            self.materialize()
+
+        return stanza_getter(self)
+
+    def setter(self, value):
+        self.materialize()
+        return stanza_setter(self, value)
+
+    setattr(LazyStanza, 'get_' + name, getter)
+    setattr(LazyStanza, 'set_' + name, setter)
+
+    return
+
+for _i in _STANZA_ATTRIBUTES:
+    _lazy_stanza_generate_accessors(_i)
+
+del _i
+
+
+def _lazy_stanza_check(self):
+    self.materialize()
+    return Stanza.check(self)
+
+LazyStanza.check = _lazy_stanza_check
 
 
 class MessageBody:
@@ -2245,6 +3496,436 @@ wayround_i2p.utils.factory.class_generate_check(
     )
 
 
+class TimerWheel:
+
+    """
+    Calls callbacks after their timeouts with `resolution' accuracy.
+
+    Timers are kept in hashed wheel of `slots' slots, so add() and remove()
+    do not depend on number of timers and each tick looks only into one
+    slot. Thread is started by add() and exits when no timers left
+    """
+
+    def __init__(self, resolution=0.1, slots=512):
+
+        if resolution <= 0:
+            raise ValueError("`resolution' must be > 0")
+
+        if not isinstance(slots, int) or slots < 1:
+            raise ValueError("`slots' must be int >= 1")
+
+        self._resolution = resolution
+        self._wheel = []
+        for i in range(slots):
+            self._wheel.append({})
+
+        self._count = 0
+        self._start_time = time.monotonic()
+        self._current_tick = 0
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+        return
+
+    def __len__(self):
+        return self._count
+
+    def _tick_of(self, monotonic_time):
+        return int((monotonic_time - self._start_time) / self._resolution) + 1
+
+    def add(self, timeout, callback, *args):
+        """
+        Call callback(*args) in wheel thread after timeout seconds.
+        Returns handle for remove()
+        """
+
+        with self._lock:
+
+            if self._thread is None:
+                self._current_tick = self._tick_of(time.monotonic()) - 1
+
+            tick = max(
+                self._tick_of(time.monotonic() + timeout),
+                self._current_tick + 1
+                )
+
+            handle = (tick, callback, args)
+
+            self._wheel[tick % len(self._wheel)][id(handle)] = handle
+            self._count += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker,
+                    name="{} worker".format(type(self).__name__),
+                    daemon=True
+                    )
+                self._thread.start()
+
+        return handle
+
+    def remove(self, handle):
+        """
+        Returns False if timer already fired or removed
+        """
+
+        ret = False
+
+        with self._lock:
+            slot = self._wheel[handle[0] % len(self._wheel)]
+            if slot.pop(id(handle), None) is not None:
+                self._count -= 1
+                ret = True
+
+        return ret
+
+    def _worker(self):
+
+        while True:
+
+            expired = []
+
+            with self._lock:
+
+                if self._count == 0:
+                    self._thread = None
+                    break
+
+                delay = (
+                    self._start_time
+                    + (self._current_tick + 1) * self._resolution
+                    - time.monotonic()
+                    )
+
+                if delay <= 0:
+
+                    self._current_tick += 1
+
+                    slot = self._wheel[self._current_tick % len(self._wheel)]
+
+                    for i in list(slot.values()):
+                        if i[0] <= self._current_tick:
+                            del slot[id(i)]
+                            expired.append(i)
+
+                    self._count -= len(expired)
+
+            if len(expired) == 0 and delay > 0:
+                time.sleep(delay)
+
+            for i in expired:
+                try:
+                    i[1](*i[2])
+                except:
+                    logging.exception(
+                        "{} :: error in timer callback".format(
+                            type(self).__name__
+                            )
+                        )
+
+        return
+
+
+# shared by all StanzaProcessor instances: pending requests of any number
+# of processors are timed by single thread
+_request_timer_wheel = TimerWheel()
+
+
+class StanzaDispatcher:
+
+    """
+    Calls callbacks for received stanzas in one of following modes:
+
+    'thread'  - new thread for each call
+    'inline'  - in thread calling dispatch() (stream reader thread)
+    'pool'    - by `workers' threads, taking calls from shared queue
+    'ordered' - by `workers' lanes (threads with own queue). calls with
+                same key (stanza sender) are always done by same lane in
+                order of dispatch() calls, calls with different keys are
+                done in parallel
+
+    dispatch() never blocks: it is called by stream reader thread (or
+    event loop thread), which must keep reading, as callbacks can wait for
+    responses to stanzas they send. So queues are not bounded: calls,
+    dispatched while more than queue_size calls are waiting (queue_size
+    divided by number of lanes in 'ordered' mode), are counted as
+    'overflows' in get_stat(). Worker threads are started on first
+    dispatch()
+    """
+
+    def __init__(self, mode='ordered', workers=8, queue_size=10000):
+
+        if not mode in ['thread', 'inline', 'pool', 'ordered']:
+            raise ValueError("invalid `mode'")
+
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("`workers' must be int >= 1")
+
+        self.mode = mode
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self._lock = threading.Lock()
+
+        self._queues = []
+        self._threads = []
+        self._lane_size = queue_size
+
+        self._stat = {
+            'dispatched': 0,
+            'overflows': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0
+            }
+
+        return
+
+    def _start_workers(self):
+        """
+        Must be called with self._lock acquired
+        """
+
+        if len(self._threads) == 0:
+
+            queue_count = 1
+            if self.mode == 'ordered':
+                queue_count = self.workers
+
+            self._lane_size = max(1, self.queue_size // queue_count)
+
+            self._queues = []
+            for i in range(queue_count):
+                self._queues.append(queue.Queue())
+
+            for i in range(self.workers):
+                thr = threading.Thread(
+                    target=self._worker,
+                    args=(self._queues[i % queue_count],),
+                    name="{} {} worker {}".format(
+                        type(self).__name__, self.mode, i
+                        ),
+                    daemon=True
+                    )
+                self._threads.append(thr)
+                thr.start()
+
+        return
+
+    def stop(self):
+        """
+        Synchronous. Waits for already dispatched calls to be done.
+        Dispatcher can be used again after stop()
+        """
+
+        with self._lock:
+            queues = self._queues
+            threads = self._threads
+            self._queues = []
+            self._threads = []
+
+        if len(queues) != 0:
+            for i in range(len(threads)):
+                queues[i % len(queues)].put(None)
+
+        for i in threads:
+            if i is not threading.current_thread():
+                i.join()
+
+        return
+
+    def dispatch(self, key, callback, *args):
+
+        item = (time.monotonic(), callback, args)
+
+        if self.mode == 'inline':
+            self._call(item)
+
+        elif self.mode == 'thread':
+            threading.Thread(
+                target=self._call,
+                args=(item,),
+                name="Input Stanza Object Processing Thread"
+                ).start()
+
+        else:
+
+            with self._lock:
+                self._start_workers()
+                queues = self._queues
+                lane_size = self._lane_size
+
+            if self.mode == 'ordered':
+                q = queues[hash(key) % len(queues)]
+            else:
+                q = queues[0]
+
+            q.put(item)
+
+            if q.qsize() > lane_size:
+                with self._lock:
+                    self._stat['overflows'] += 1
+
+        return
+
+    def get_stat(self):
+        """
+        Returns dict with keys:
+
+        'mode', 'workers'
+        'queue_depth'  - calls waiting for execution
+        'dispatched'   - calls started
+        'overflows'    - calls dispatched while their queue was over
+                         queue_size
+        'latency_avg'  - average time between dispatch() and call start
+        'latency_max'  - maximum of same
+        """
+
+        with self._lock:
+
+            queue_depth = 0
+            for i in self._queues:
+                queue_depth += i.qsize()
+
+            latency_avg = 0.0
+            if self._stat['dispatched'] != 0:
+                latency_avg = (
+                    self._stat['latency_total'] / self._stat['dispatched']
+                    )
+
+            ret = {
+                'mode': self.mode,
+                'workers': self.workers,
+                'queue_depth': queue_depth,
+                'dispatched': self._stat['dispatched'],
+                'overflows': self._stat['overflows'],
+                'latency_avg': latency_avg,
+                'latency_max': self._stat['latency_max']
+                }
+
+        return ret
+
+    def _worker(self, q):
+
+        while True:
+
+            item = q.get()
+
+            if item is None:
+                break
+
+            self._call(item)
+
+        return
+
+    def _call(self, item):
+
+        dispatch_time, callback, args = item
+
+        latency = time.monotonic() - dispatch_time
+
+        with self._lock:
+            self._stat['dispatched'] += 1
+            self._stat['latency_total'] += latency
+            if latency > self._stat['latency_max']:
+                self._stat['latency_max'] = latency
+
+        try:
+            callback(*args)
+        except:
+            logging.exception(
+                "{} :: error in dispatched call".format(type(self).__name__)
+                )
+
+        return
+
+
+_BASE32_ALPHABET = '0123456789abcdefghijklmnopqrstuv'
+
+
+def int_to_base32(value):
+    """
+    Compact lowercase base32 (RFC 4648 'extended hex' alphabet) of
+    non-negative int
+    """
+
+    if value < 0:
+        raise ValueError("`value' must be >= 0")
+
+    ret = []
+
+    while True:
+        ret.append(_BASE32_ALPHABET[value & 31])
+        value >>= 5
+        if value == 0:
+            break
+
+    ret.reverse()
+
+    return ''.join(ret)
+
+
+class StanzaIDGenerator:
+
+    """
+    Callable, returning new stanza id on each call: prefix, unique for
+    session, and counter value, joined by '-'.
+
+    Thread safe: next() of itertools.count is atomic.
+
+    For replay tests use explicit prefix, e.g. StanzaIDGenerator('test')
+    gives 'test-1', 'test-2', ...
+    """
+
+    def __init__(self, prefix=None, start=1, compact=False):
+        """
+        :param str prefix: random if None
+        :param bool compact: base32 counter and 80 bit random prefix, instead
+            of hex counter and 128 bit random prefix
+        """
+
+        if prefix is None:
+            if compact:
+                prefix = int_to_base32(int.from_bytes(os.urandom(10), 'big'))
+            else:
+                prefix = os.urandom(16).hex()
+
+        if not isinstance(prefix, str):
+            raise TypeError("`prefix' must be None or str")
+
+        self.prefix = prefix
+
+        if compact:
+            self._format = int_to_base32
+        else:
+            self._format = '{:x}'.format
+
+        self._counter = itertools.count(start)
+
+        return
+
+    def __call__(self):
+        return '{}-{}'.format(self.prefix, self._format(next(self._counter)))
+
+
+def _set_future_result(future, result):
+    try:
+        future.set_result(result)
+    except concurrent.futures.InvalidStateError:
+        # cancelled
+        pass
+    return
+
+
+def _set_future_exception(future, exception):
+    try:
+        future.set_exception(exception)
+    except concurrent.futures.InvalidStateError:
+        # cancelled
+        pass
+    return
+
+
 class StanzaProcessor:
 
     """
@@ -2252,21 +3933,156 @@ class StanzaProcessor:
     ('new_stanza', self, stanza)
     ('new_stanza_to_send, self, stanza')
     ('response_stanza', self, stanza)
+
+    Besides 'new_stanza' signal, received stanzas are passed to callbacks
+    registered with add_route() for matching tag, type and child element.
+    Callbacks are called same way as 'new_stanza' signal callbacks:
+    callback('new_stanza', self, stanza)
     """
 
-    def __init__(self):
+    def __init__(self, dispatcher=None, id_generator=None):
+        """
+        :param StanzaDispatcher dispatcher: used to emit 'new_stanza' signal.
+            StanzaDispatcher() (ordered lanes) is created if None.
+            Dispatcher can be shared by many StanzaProcessor instances
+        :param id_generator: callable without arguments, returning new
+            unique str for each call. StanzaIDGenerator() if None
+        """
 
         self.signal = wayround_i2p.utils.threading.Signal(
             self,
             ['new_stanza', 'defective_stanza']
             )
 
+        if dispatcher is None:
+            dispatcher = StanzaDispatcher()
+
+        self.dispatcher = dispatcher
+
         self._io_machine = None
 
-        self._stanza_id_generation_unifire = uuid.uuid4().hex
-        self._stanza_id_generation_counter = 0
+        if id_generator is None:
+            id_generator = StanzaIDGenerator()
+
+        if not callable(id_generator):
+            raise TypeError("`id_generator' must be callable")
+
+        self.id_generator = id_generator
 
         self._wait_callbacks = {}
+        self._wait_callbacks_lock = threading.Lock()
+
+        self._timer_wheel = _request_timer_wheel
+
+        self._routes = {}
+        self._routes_children = set()
+        self._routes_lock = threading.Lock()
+
+    def add_route(self, callback, tag=None, typ=None, child=None):
+        """
+        Call callback for received stanzas matching all not None parameters
+
+        :param str tag: 'message', 'presence' or 'iq'
+        :param str typ: stanza type attribute value
+        :param str child: first level child element tag in
+            '{namespace}localname' form, e.g. '{jabber:iq:roster}query'
+
+        Lookup for received stanza is done by dict keys, so it does not
+        depend on number of added routes
+        """
+
+        if not callable(callback):
+            raise TypeError("`callback' must be callable")
+
+        if tag is not None and not tag in ['message', 'presence', 'iq']:
+            raise ValueError("`tag' must be in ['message', 'presence', 'iq']")
+
+        if child is not None and not child.startswith('{'):
+            raise ValueError("`child' must be in '{namespace}localname' form")
+
+        key = (tag, typ, child)
+
+        with self._routes_lock:
+
+            callbacks = list(self._routes.get(key, []))
+            if not callback in callbacks:
+                callbacks.append(callback)
+
+            self._routes[key] = callbacks
+
+            if child is not None:
+                self._routes_children.add(child)
+
+        return
+
+    def remove_route(self, callback, tag=None, typ=None, child=None):
+        """
+        Remove callback, added by add_route() with same parameters
+        """
+
+        key = (tag, typ, child)
+
+        with self._routes_lock:
+
+            callbacks = list(self._routes.get(key, []))
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+            if len(callbacks) == 0:
+                if key in self._routes:
+                    del self._routes[key]
+            else:
+                self._routes[key] = callbacks
+
+            self._routes_children = set(
+                i[2] for i in self._routes.keys() if i[2] is not None
+                )
+
+        return
+
+    def get_route_callbacks(self, stanza):
+        """
+        Get list of callbacks routed for stanza
+        """
+
+        ret = []
+
+        routes = self._routes
+
+        if len(routes) != 0:
+
+            tag = stanza.get_tag()
+            typ = stanza.get_typ()
+
+            children = [None]
+            routes_children = self._routes_children
+            if len(routes_children) != 0:
+                for i in stanza.get_element():
+                    if i.tag in routes_children and not i.tag in children:
+                        children.append(i.tag)
+
+            for i in (tag, None):
+                for j in (typ, None):
+                    for k in children:
+                        for l in routes.get((i, j, k), ()):
+                            if not l in ret:
+                                ret.append(l)
+
+        return ret
+
+    def _emit_new_stanza(self, stanza):
+
+        self.signal.emit('new_stanza', self, stanza)
+
+        for i in self.get_route_callbacks(stanza):
+            try:
+                i('new_stanza', self, stanza)
+            except:
+                logging.exception(
+                    "{} :: error in routed callback {}".format(self, i)
+                    )
+
+        return
 
     def connect_io_machine(self, io_machine):
         """
@@ -2341,9 +4157,6 @@ class StanzaProcessor:
 
         ret = None
 
-        self._stanza_id_generation_unifire = uuid.uuid4().hex
-        self._stanza_id_generation_counter += 1
-
         # ===== parameters checks
 
         if wait is not None and not isinstance(wait, (bool, int,)):
@@ -2375,10 +4188,7 @@ class StanzaProcessor:
             if ((not stanza_obj.get_ide() and ide_mode == 'generate')
                     or ide_mode == 'generate_implicit'):
 
-                new_stanza_ide = '{}-stanza-{}'.format(
-                    self._stanza_id_generation_unifire,
-                    hex(self._stanza_id_generation_counter)
-                    )
+                new_stanza_ide = self.id_generator()
 
         elif ide_mode == 'implicit':
             new_stanza_ide = ide
@@ -2390,82 +4200,193 @@ class StanzaProcessor:
 
         stanza_obj.set_ide(new_stanza_ide)
 
-        # ===== callback routines
+        # ===== finally send stanza and wait for response if needed
 
         if wait == 0:
+
+            # nobody will wait for response, so nothing to register in
+            # wait_callbacks: emit_reply_* are meaningless here
+
             ret = new_stanza_ide
 
-        if self._is_wait_in_sand(wait, emit_reply_anyway, emit_reply_message):
+            # element is serialized only once - by output stream writer
+            self._io_machine.send(stanza_obj.gen_element())
+
+        else:
+
+            future = self._add_wait_callback(
+                new_stanza_ide,
+                None,
+                emit_reply_anyway,
+                emit_reply_message
+                )
+
+            try:
+                self._io_machine.send(stanza_obj.gen_element())
+                ret = future.result(wait)
+            except concurrent.futures.TimeoutError:
+                ret = False
+            finally:
+                self._remove_wait_callback(new_stanza_ide, future)
+
+        return ret
+
+    def send_request(
+            self, stanza_obj, timeout=10,
+            emit_reply_anyway=False,
+            emit_reply_message=True
+            ):
+        """
+        Send stanza with newly generated id and return
+        concurrent.futures.Future without waiting for response.
+
+        Future result is response Stanza. If no response received in
+        `timeout' seconds, future gets concurrent.futures.TimeoutError.
+        timeout=None means no timeout: such request is forgotten only when
+        response comes or future is cancelled.
+
+        Use asyncio.wrap_future() to await result in asyncio code.
+        """
+
+        if timeout is not None and timeout <= 0:
+            raise ValueError("`timeout' must be None or > 0")
+
+        ide = self.id_generator()
+
+        stanza_obj.set_ide(ide)
+
+        ret = self._add_wait_callback(
+            ide,
+            timeout,
+            emit_reply_anyway,
+            emit_reply_message
+            )
+
+        try:
+            self._io_machine.send(stanza_obj.gen_element())
+        except Exception as e:
+            self._remove_wait_callback(ide, ret)
+            _set_future_exception(ret, e)
+
+        return ret
+
+    def get_wait_callbacks_count(self):
+        """
+        Number of sent stanzas waiting for response
+        """
+        return len(self._wait_callbacks)
+
+    def _add_wait_callback(
+            self, ide, timeout, emit_reply_anyway, emit_reply_message
+            ):
+
+        if logging.root.isEnabledFor(logging.DEBUG):
             logging.debug(
-                "{} :: send :: adding {} to wait_callbacks".format(
-                    self,
-                    new_stanza_ide
-                    )
+                "{} :: adding {} to wait_callbacks".format(self, ide)
                 )
-            self._wait_callbacks[new_stanza_ide] = {
-                'event': threading.Event(),
-                'response': None,
+
+        future = concurrent.futures.Future()
+
+        with self._wait_callbacks_lock:
+
+            if ide in self._wait_callbacks:
+                raise ValueError(
+                    "stanza with id `{}' already waits for response".format(
+                        ide
+                        )
+                    )
+
+            timer = None
+            if timeout is not None:
+                timer = self._timer_wheel.add(
+                    timeout,
+                    self._on_wait_callback_timeout,
+                    ide,
+                    future
+                    )
+
+            self._wait_callbacks[ide] = {
+                'future': future,
+                'timer': timer,
                 'emit_reply_anyway': emit_reply_anyway,
                 'emit_reply_message': emit_reply_message
                 }
 
-        # ===== finally send stanza and wait for response if needed
+        future.add_done_callback(
+            lambda f: self._remove_wait_callback(ide, f)
+            )
+
+        return future
 
-        self._io_machine.send(stanza_obj.to_str())
+    def _remove_wait_callback(self, ide, future):
+        """
+        Returns removed wait_callbacks entry or None
+        """
 
-        if self._is_wait_in_sand(wait, emit_reply_anyway, emit_reply_message):
-            wait_res = self._wait_callbacks[new_stanza_ide]['event'].wait(wait)
+        ret = None
 
-            if wait_res == False:
-                ret = False
-            else:
-                ret = self._wait_callbacks[new_stanza_ide]['response']
+        with self._wait_callbacks_lock:
+            entry = self._wait_callbacks.get(ide)
+            if entry is not None and entry['future'] is future:
+                ret = self._wait_callbacks.pop(ide)
 
-            logging.debug(
-                "{} :: send :: removing {} from wait_callbacks".format(
-                    self,
-                    new_stanza_ide
+        if ret is not None:
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug(
+                    "{} :: removed {} from wait_callbacks".format(self, ide)
                     )
-                )
-            del self._wait_callbacks[new_stanza_ide]
+            if ret['timer'] is not None:
+                self._timer_wheel.remove(ret['timer'])
 
         return ret
 
-    def _is_wait_in_sand(
-            self, wait, emit_reply_anyway, emit_reply_message
-            ):
-        return (wait is None
-                or (isinstance(wait, int) and wait > 0)
-                or emit_reply_anyway == True
-                or emit_reply_message == True
+    def _on_wait_callback_timeout(self, ide, future):
+        if self._remove_wait_callback(ide, future) is not None:
+            _set_future_exception(
+                future,
+                concurrent.futures.TimeoutError(
+                    "no response for stanza `{}'".format(ide)
+                    )
                 )
+        return
 
     def _on_input_object(self, signal_name, io_machine, obj):
 
-        threading.Thread(
-            target=self._process_input_object,
-            args=(obj,),
-            name="Input Stanza Object Processing Thread"
-            ).start()
+        # responses to waited stanzas are resolved right here, in stream
+        # reader thread: waiting callback itself can be running in
+        # dispatcher worker, which would never get to the response queued
+        # after it
+        if obj.get('id') in self._wait_callbacks:
+            self._process_input_object(obj, inline=True)
+        else:
+            self.dispatcher.dispatch(
+                obj.get('from'),
+                self._process_input_object,
+                obj
+                )
 
         return
 
-    def _process_input_object(self, obj):
+    def _process_input_object(self, obj, inline=False):
+
+        debug = logging.root.isEnabledFor(logging.DEBUG)
 
-        logging.debug(
-            "{} :: _process_input_object :: received element `{}' :: `{}'".format(
-                self,
-                obj,
-                obj.tag
+        if debug:
+            logging.debug(
+                "{} :: _process_input_object :: received element `{}' :: `{}'".format(
+                    self,
+                    obj,
+                    obj.tag
+                    )
                 )
-            )
 
         if is_stanza_element(obj):
 
             stanza = None
 
             try:
-                stanza = Stanza.new_from_element(obj)
+                stanza = LazyStanza(obj)
+                stanza.check_received()
             except:
                 logging.exception(
                     "Error generating stanza object sent from `{}'".format(
@@ -2479,42 +4400,53 @@ class StanzaProcessor:
 
                     ide = stanza.get_ide()
 
-                    logging.debug(
-                        "{} :: _process_input_object :: processing {} with wait_callbacks".format(
-                            self,
-                            ide
-                            )
-                        )
-
-                    if (not ide in self._wait_callbacks
-                            or (ide in self._wait_callbacks
-                                and self._wait_callbacks[ide][
-                                    'emit_reply_anyway'
-                                    ] == True)
-                            or (ide in self._wait_callbacks
-                                and self._wait_callbacks[ide][
-                                    'emit_reply_message'
-                                    ] == True
-                                and stanza.get_tag() == 'message'
-                                )
-                        ):
+                    if debug:
                         logging.debug(
-                            "{} :: _process_input_object :: emiting stanza {}".format(
+                            "{} :: _process_input_object :: processing {} with wait_callbacks".format(
                                 self,
                                 ide
                                 )
                             )
-                        self.signal.emit('new_stanza', self, stanza)
 
-                    if ide in self._wait_callbacks:
-                        logging.debug(
-                            "{} :: _process_input_object :: triggering wait callback for stanza {}".format(
-                                self,
-                                ide
+                    # entry can be removed by timeout at any moment, so
+                    # it's taken once
+                    wait_entry = self._wait_callbacks.get(ide)
+
+                    if (wait_entry is None
+                            or wait_entry['emit_reply_anyway'] == True
+                            or (wait_entry['emit_reply_message'] == True
+                                and stanza.get_tag() == 'message'
                                 )
-                            )
-                        self._wait_callbacks[ide]['response'] = stanza
-                        self._wait_callbacks[ide]['event'].set()
+                        ):
+                        if debug:
+                            logging.debug(
+                                "{} :: _process_input_object :: emiting stanza {}".format(
+                                    self,
+                                    ide
+                                    )
+                                )
+                        if inline:
+                            self.dispatcher.dispatch(
+                                stanza.get_from_jid(),
+                                self._emit_new_stanza,
+                                stanza
+                                )
+                        else:
+                            self._emit_new_stanza(stanza)
+
+                    if wait_entry is not None:
+                        if debug:
+                            logging.debug(
+                                "{} :: _process_input_object :: triggering wait callback for stanza {}".format(
+                                    self,
+                                    ide
+                                    )
+                                )
+                        if self._remove_wait_callback(
+                                ide,
+                                wait_entry['future']
+                                ) is not None:
+                            _set_future_result(wait_entry['future'], stanza)
 
                 else:
                     logging.error(
@@ -458,9 +458,11 @@ class DiscoService:
         self._items = items
         self._own_jid = own_jid
 
-        stanza_processor.signal.connect(
-            'new_stanza',
-            self._in_stanza
+        stanza_processor.add_route(
+            self._in_stanza,
+            tag='iq',
+            typ='get',
+            child='{http://jabber.org/protocol/disco#info}query'
             )
 
     def _in_stanza(self, event, stanza_processor, stanza):
@@ -469,29 +471,24 @@ class DiscoService:
         :param wayround_i2p.xmpp.core.Stanza stanza:
         """
 
-        if event == 'new_stanza':
-
-            if stanza.get_tag() == 'iq' and stanza.get_typ() == 'get':
-
-                if not stanza.is_error():
-
-                    query = stanza.get_element().find(
-                        '{http://jabber.org/protocol/disco#info}query'
-                        )
-
-                    if query != None:
+        query = stanza.get_element().find(
+            '{http://jabber.org/protocol/disco#info}query'
+            )
 
-                        if len(query) == 0:
+        if len(query) == 0:
 
-                            rstanza = wayround_i2p.xmpp.core.Stanza('iq')
-                            rstanza.set_ide(stanza.get_ide())
-                            rstanza.set_typ('result')
-                            rstanza.set_from_jid(self._own_jid.full())
-                            rstanza.set_to_jid(stanza.get_from_jid())
+            rstanza = wayround_i2p.xmpp.core.Stanza(
+                'iq',
+                validation='trusted'
+                )
+            rstanza.set_ide(stanza.get_ide())
+            rstanza.set_typ('result')
+            rstanza.set_from_jid(self._own_jid.full())
+            rstanza.set_to_jid(stanza.get_from_jid())
 
-                            rstanza.set_objects(
-                                [self._info]
-                                )
-                            stanza_processor.send(rstanza, wait=False)
+            rstanza.set_objects(
+                [self._info]
+                )
+            stanza_processor.send(rstanza, wait=False)
 
         return
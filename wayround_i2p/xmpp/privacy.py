@@ -430,40 +430,40 @@ class PrivacyClient:
             self, ['push']
             )
 
-        self._client.signal.connect(
-            'stanza_processor_new_stanza',
-            self._push
+        self._client.stanza_processor.add_route(
+            self._push,
+            tag='iq',
+            typ='set',
+            child='{jabber:iq:privacy}query'
             )
 
-    def _push(self, event, client, stanza):
+    def _push(self, event, stanza_processor, stanza):
 
-        if event == 'stanza_processor_new_stanza':
+#        logging.debug("{}::Got stanza".format(self))
 
-#            logging.debug("{}::Got stanza".format(self))
+        if (stanza.get_from_jid() in [None, self._from_jid.bare()]
+            and stanza.get_to_jid() == str(self._from_jid)):
 
-            if (stanza.get_from_jid() in [None, self._from_jid.bare()]
-                and stanza.get_to_jid() == str(self._from_jid)):
+            for i in Query.new_from_stanza_lxml(stanza.get_element()):
 
-                for i in Query.new_from_stanza_lxml(stanza.get_element()):
+                new_stanza = wayround_i2p.xmpp.core.Stanza(
+                    tag='iq',
+                    to_jid=stanza.get_from_jid(),
+                    from_jid=str(self._from_jid),
+                    typ='result',
+                    ide=stanza.get_ide()
+                    )
 
-                    new_stanza = wayround_i2p.xmpp.core.Stanza(
-                        tag='iq',
-                        to_jid=stanza.get_from_jid(),
-                        from_jid=str(self._from_jid),
-                        typ='result',
-                        ide=stanza.get_ide()
-                        )
+                threading.Thread(
+                    target=self._client.stanza_processor.send,
+                    args=(new_stanza,),
+                    kwargs={
+                        'ide_mode': 'from_stanza',
+                        'wait': False
+                        }
+                    ).start()
 
-                    threading.Thread(
-                        target=self._client.stanza_processor.send,
-                        args=(new_stanza,),
-                        kwargs={
-                            'ide_mode': 'from_stanza',
-                            'wait': False
-                            }
-                        ).start()
-
-                    self.signal.emit('push', i)
+                self.signal.emit('push', i)
 
         return
 
@@ -0,0 +1,518 @@
+
+"""
+Roster stores for wayround_i2p.xmpp.client.Roster
+
+Store keeps roster items and roster version (RFC 6121 2.6), so on
+reconnection only changes are transferred from server, and lookups are
+answered without requests.
+
+Two stores are provided: MemoryRosterStore (kept for lifetime of
+process) and SQLiteRosterStore (kept in SQLite database file on local
+disk).
+
+Items are kept as RosterItem records, with indexes by group, subscription
+and ask state.
+
+Other stores can be used too: Roster accepts any object with methods,
+listed in ROSTER_STORE_METHODS (see is_roster_store()), which behave as
+MemoryRosterStore ones.
+"""
+
+import logging
+import sqlite3
+import sys
+import threading
+
+import wayround_i2p.xmpp.core
+
+
+ROSTER_STORE_METHODS = (
+    'get_ver',
+    'get_item',
+    'get_items',
+    'get_groups',
+    'get_jids_by_group',
+    'get_jids_by_subscription',
+    'get_jids_by_ask',
+    'replace',
+    'update'
+    )
+
+
+class RosterItem:
+
+    """
+    Compact read only roster item record.
+
+    groups is tuple of interned group names, so each group name is kept in
+    memory once, however many items are in the group.
+
+    Records are not changed in place by stores: roster push replaces
+    record.
+    """
+
+    __slots__ = ('jid', 'name', 'subscription', 'ask', 'approved', 'groups')
+
+    def __init__(
+            self,
+            jid, name=None, subscription=None, ask=None, approved=None,
+            groups=()
+            ):
+
+        if not isinstance(jid, str):
+            raise TypeError("`jid' must be str")
+
+        if name is not None and not isinstance(name, str):
+            raise TypeError("`name' must be None or str")
+
+        if not subscription in [
+                None, 'both', 'from', 'none', 'remove', 'to'
+                ]:
+            raise ValueError(
+                "`subscription' must be in "
+                "[None, 'both', 'from', 'none', 'remove', 'to']"
+                )
+
+        if ask is not None and ask != 'subscribe':
+            raise ValueError("`ask' can be None or 'subscribe'")
+
+        if approved is not None and not isinstance(approved, bool):
+            raise TypeError("`approved' must be None or bool")
+
+        for i in groups:
+            if not isinstance(i, str):
+                raise TypeError("`groups' must be sequence of str")
+
+        self.jid = jid
+        self.name = name
+        self.subscription = subscription
+        self.ask = ask
+        self.approved = approved
+        self.groups = tuple(sys.intern(i) for i in groups)
+
+        return
+
+    def __repr__(self):
+        return (
+            "<RosterItem jid={!r} name={!r} subscription={!r} ask={!r}"
+            " approved={!r} groups={!r}>".format(
+                self.jid, self.name, self.subscription, self.ask,
+                self.approved, self.groups
+                )
+            )
+
+    @classmethod
+    def new_from_iq_roster_item(cls, item):
+        return cls(
+            jid=item.get_jid(),
+            name=item.get_name(),
+            subscription=item.get_subscription(),
+            ask=item.get_ask(),
+            approved=item.get_approved(),
+            groups=item.get_group()
+            )
+
+    def to_iq_roster_item(self):
+        return wayround_i2p.xmpp.core.IQRosterItem(
+            jid=self.jid,
+            group=list(self.groups),
+            approved=self.approved,
+            ask=self.ask,
+            name=self.name,
+            subscription=self.subscription
+            )
+
+
+class MemoryRosterStore:
+
+    """
+    Roster items (RosterItem), keyed by bare JID, and roster version.
+
+    replace() and update() accept lists of RosterItem or
+    wayround_i2p.xmpp.core.IQRosterItem.
+
+    Thread safe. Methods, returning items or JIDs, return copies of
+    internal structures, but not of items.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ver = None
+        self._set_items({})
+        return
+
+    def _set_items(self, items):
+        """
+        Must be called with self._lock acquired (or from __init__())
+        """
+
+        self._items = items
+
+        self._by_group = {}
+        self._by_subscription = {}
+        self._by_ask = {}
+
+        for i in items.values():
+            self._index_add(i)
+
+        return
+
+    def _index_add(self, item):
+
+        jid = item.jid
+
+        for i in item.groups:
+            self._by_group.setdefault(i, set()).add(jid)
+
+        self._by_subscription.setdefault(item.subscription, set()).add(jid)
+        self._by_ask.setdefault(item.ask, set()).add(jid)
+
+        return
+
+    def _index_remove(self, item):
+
+        jid = item.jid
+
+        for index, keys in [
+                (self._by_group, item.groups),
+                (self._by_subscription, (item.subscription,)),
+                (self._by_ask, (item.ask,))
+                ]:
+            for i in keys:
+                jids = index.get(i)
+                if jids is not None:
+                    jids.discard(jid)
+                    if len(jids) == 0:
+                        del index[i]
+
+        return
+
+    def get_ver(self):
+        """
+        Roster version of stored items, or None if server did not provide
+        one (or nothing stored yet)
+        """
+        with self._lock:
+            ret = self._ver
+        return ret
+
+    def get_item(self, jid):
+        """
+        RosterItem or None
+        """
+        with self._lock:
+            ret = self._items.get(jid)
+        return ret
+
+    def get_items(self):
+        """
+        dict with bare JIDs as keys and RosterItem as values
+        """
+        with self._lock:
+            ret = dict(self._items)
+        return ret
+
+    def get_jids(self):
+        with self._lock:
+            ret = list(self._items.keys())
+        return ret
+
+    def get_groups(self):
+        with self._lock:
+            ret = list(self._by_group.keys())
+        return ret
+
+    def get_jids_by_group(self, group):
+        with self._lock:
+            ret = set(self._by_group.get(group, ()))
+        return ret
+
+    def get_jids_by_subscription(self, subscription):
+        with self._lock:
+            ret = set(self._by_subscription.get(subscription, ()))
+        return ret
+
+    def get_jids_by_ask(self, ask):
+        with self._lock:
+            ret = set(self._by_ask.get(ask, ()))
+        return ret
+
+    def replace(self, items, ver=None):
+        """
+        Replace all items with `items' received in full roster. Returns
+        `items' as list of RosterItem
+        """
+
+        items = _to_roster_items(items)
+        _check_ver(ver)
+
+        with self._lock:
+            self._set_items(dict((i.jid, i) for i in items))
+            self._ver = ver
+
+        return items
+
+    def update(self, items, ver=None):
+        """
+        Apply roster push: items with subscription 'remove' are deleted,
+        others are added or replaced. If `ver' is not None, it is stored
+        as new roster version. Returns `items' as list of RosterItem
+        """
+
+        items = _to_roster_items(items)
+        _check_ver(ver)
+
+        with self._lock:
+
+            for i in items:
+
+                old = self._items.pop(i.jid, None)
+                if old is not None:
+                    self._index_remove(old)
+
+                if i.subscription != 'remove':
+                    self._items[i.jid] = i
+                    self._index_add(i)
+
+            if ver is not None:
+                self._ver = ver
+
+        return items
+
+    def clear(self):
+        with self._lock:
+            self._set_items({})
+            self._ver = None
+        return
+
+    def __len__(self):
+        with self._lock:
+            ret = len(self._items)
+        return ret
+
+
+class SQLiteRosterStore(MemoryRosterStore):
+
+    """
+    MemoryRosterStore, saved to SQLite database file.
+
+    All items are loaded to memory on creation, so lookups do not touch
+    database. Changes are written at once, in single transaction per
+    replace() or update() call.
+
+    One database file keeps one roster, so separate files must be used for
+    separate accounts.
+    """
+
+    def __init__(self, filename):
+
+        super().__init__()
+
+        self._filename = filename
+
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS roster_ver"
+                " (id INTEGER PRIMARY KEY CHECK (id = 0), ver TEXT)"
+                )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS roster_items ("
+                " jid TEXT PRIMARY KEY,"
+                " name TEXT,"
+                " subscription TEXT,"
+                " ask TEXT,"
+                " approved INTEGER"
+                " )"
+                )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS roster_groups ("
+                " jid TEXT NOT NULL,"
+                " grp TEXT NOT NULL"
+                " )"
+                )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS roster_groups_jid"
+                " ON roster_groups (jid)"
+                )
+
+        self._load()
+
+        return
+
+    def _load(self):
+
+        items = {}
+
+        groups = {}
+        for jid, group in self._db.execute(
+                "SELECT jid, grp FROM roster_groups ORDER BY rowid"
+                ):
+            groups.setdefault(jid, []).append(group)
+
+        for jid, name, subscription, ask, approved in self._db.execute(
+                "SELECT jid, name, subscription, ask, approved"
+                " FROM roster_items"
+                ):
+
+            if approved is not None:
+                approved = bool(approved)
+
+            try:
+                items[jid] = RosterItem(
+                    jid=jid,
+                    name=name,
+                    subscription=subscription,
+                    ask=ask,
+                    approved=approved,
+                    groups=groups.get(jid, ())
+                    )
+            except (TypeError, ValueError):
+                logging.exception(
+                    "Skipping invalid roster item `{}' in {}".format(
+                        jid,
+                        self._filename
+                        )
+                    )
+
+        ver = None
+        for i in self._db.execute("SELECT ver FROM roster_ver"):
+            ver = i[0]
+
+        with self._lock:
+            self._set_items(items)
+            self._ver = ver
+
+        return
+
+    def _write_items(self, items):
+
+        for i in items:
+
+            jid = i.jid
+
+            self._db.execute(
+                "DELETE FROM roster_groups WHERE jid = ?",
+                (jid,)
+                )
+
+            if i.subscription == 'remove':
+                self._db.execute(
+                    "DELETE FROM roster_items WHERE jid = ?",
+                    (jid,)
+                    )
+                continue
+
+            approved = i.approved
+            if approved is not None:
+                approved = int(approved)
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO roster_items"
+                " (jid, name, subscription, ask, approved)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (jid, i.name, i.subscription, i.ask, approved)
+                )
+
+            self._db.executemany(
+                "INSERT INTO roster_groups (jid, grp) VALUES (?, ?)",
+                [(jid, j) for j in i.groups]
+                )
+
+        return
+
+    def _write_ver(self, ver):
+        self._db.execute(
+            "INSERT OR REPLACE INTO roster_ver (id, ver) VALUES (0, ?)",
+            (ver,)
+            )
+        return
+
+    def replace(self, items, ver=None):
+
+        with self._lock:
+
+            items = super().replace(items, ver)
+
+            with self._db:
+                self._db.execute("DELETE FROM roster_groups")
+                self._db.execute("DELETE FROM roster_items")
+                self._write_items(items)
+                self._write_ver(ver)
+
+        return items
+
+    def update(self, items, ver=None):
+
+        with self._lock:
+
+            items = super().update(items, ver)
+
+            with self._db:
+                self._write_items(items)
+                if ver is not None:
+                    self._write_ver(ver)
+
+        return items
+
+    def clear(self):
+
+        with self._lock:
+
+            super().clear()
+
+            with self._db:
+                self._db.execute("DELETE FROM roster_groups")
+                self._db.execute("DELETE FROM roster_items")
+                self._db.execute("DELETE FROM roster_ver")
+
+        return
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        return
+
+
+def is_roster_store(obj):
+    """
+    True if `obj' has all methods, listed in ROSTER_STORE_METHODS
+    """
+
+    ret = True
+
+    for i in ROSTER_STORE_METHODS:
+        if not callable(getattr(obj, i, None)):
+            ret = False
+            break
+
+    return ret
+
+
+def _to_roster_items(items):
+    """
+    Returns list of RosterItem
+    """
+
+    if not isinstance(items, list):
+        raise TypeError("`items' must be list")
+
+    ret = []
+
+    for i in items:
+        if isinstance(i, wayround_i2p.xmpp.core.IQRosterItem):
+            i = RosterItem.new_from_iq_roster_item(i)
+        elif not isinstance(i, RosterItem):
+            raise TypeError(
+                "`items' must be list of RosterItem or IQRosterItem"
+                )
+        ret.append(i)
+
+    return ret
+
+
+def _check_ver(ver):
+    if ver is not None and not isinstance(ver, str):
+        raise TypeError("`ver' must be None or str")
+    return
@@ -0,0 +1,374 @@
+
+"""
+Pre-serialized stanza templates for frequently sent stanza shapes
+
+Template is a Stanza, serialized once with placeholders in place of
+variable fields (to, id, body, ...). Rendering only escapes values and
+joins them with ready parts, without building Stanza objects and lxml
+elements. Result is UTF-8 bytes, equal to Stanza.to_bytes() of same
+stanza, which can be passed to client send() (XMPPOutputStreamWriter
+accepts bytes).
+
+Stanzas, rendered from templates, are not passed through StanzaProcessor,
+so no reply waiting is done for them and ide must be provided by caller
+(see StanzaProcessor.id_generator) if replies are needed.
+"""
+
+import re
+import threading
+
+import lxml.etree
+
+import wayround_i2p.xmpp.core
+
+
+_PLACEHOLDER_START = '\ue000'
+_PLACEHOLDER_END = '\ue001'
+
+_PLACEHOLDER_RE = re.compile(
+    re.escape(bytes(_PLACEHOLDER_START, 'utf-8'))
+    + rb'([a-z_]+)'
+    + re.escape(bytes(_PLACEHOLDER_END, 'utf-8'))
+    )
+
+_XML_FORBIDDEN_CHARS_RE = re.compile(
+    '[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]'
+    )
+
+# same escaping, as lxml does
+
+_TEXT_ESCAPE_TABLE = str.maketrans(
+    {
+        '&': '&amp;',
+        '<': '&lt;',
+        '>': '&gt;',
+        '\r': '&#13;'
+        }
+    )
+
+_ATTRIBUTE_ESCAPE_TABLE = str.maketrans(
+    {
+        '&': '&amp;',
+        '<': '&lt;',
+        '>': '&gt;',
+        '"': '&quot;',
+        '\n': '&#10;',
+        '\r': '&#13;',
+        '\t': '&#9;'
+        }
+    )
+
+
+def field(name):
+    """
+    Placeholder for variable field `name' to be used in place of value, while
+    building template stanza
+    """
+
+    if not isinstance(name, str) or re.fullmatch(r'[a-z_]+', name) is None:
+        raise ValueError("`name' must be str of a-z and _")
+
+    return _PLACEHOLDER_START + name + _PLACEHOLDER_END
+
+
+_TEXT_SPECIAL_CHARS_RE = re.compile('[&<>\r]')
+
+_ATTRIBUTE_SPECIAL_CHARS_RE = re.compile('[&<>"\n\r\t]')
+
+
+def escape_text(value):
+    _check_value(value)
+    if _TEXT_SPECIAL_CHARS_RE.search(value) is not None:
+        value = value.translate(_TEXT_ESCAPE_TABLE)
+    return value
+
+
+def escape_attribute(value):
+    _check_value(value)
+    if _ATTRIBUTE_SPECIAL_CHARS_RE.search(value) is not None:
+        value = value.translate(_ATTRIBUTE_ESCAPE_TABLE)
+    return value
+
+
+def _check_value(value):
+
+    if not isinstance(value, str):
+        raise TypeError("field value must be str")
+
+    if _XML_FORBIDDEN_CHARS_RE.search(value) is not None:
+        raise ValueError(
+            "field value must not contain characters, forbidden in XML"
+            )
+
+    return
+
+
+class StanzaTemplate:
+
+    """
+    Stanza, serialized once, with placeholders (see field()) in place of
+    variable fields. Placeholders may be used in attribute values and in
+    text of elements.
+    """
+
+    def __init__(self, stanza):
+
+        if not isinstance(stanza, wayround_i2p.xmpp.core.Stanza):
+            raise TypeError(
+                "`stanza' must be of type wayround_i2p.xmpp.core.Stanza"
+                )
+
+        data = stanza.to_bytes()
+
+        parts = []
+        fields = []
+
+        pos = 0
+        for i in _PLACEHOLDER_RE.finditer(data):
+
+            fixed = data[pos:i.start()]
+            parts.append(fixed)
+
+            # lxml writes attribute values in double quotes
+
+            in_attribute = fixed.endswith(b'"')
+
+            # lxml writes element with empty text as <tag/>, so for text
+            # fields length of closing tag is remembered to do same
+
+            closing_length = 0
+            if not in_attribute:
+                closing_length = data.index(b'>', i.end()) + 1 - i.end()
+
+            fields.append(
+                (str(i.group(1), 'utf-8'), in_attribute, closing_length)
+                )
+
+            pos = i.end()
+
+        parts.append(data[pos:])
+
+        self._parts = parts
+        self._fields = fields
+
+        return
+
+    def get_fields(self):
+        """
+        Names of fields, in order of appearance
+        """
+        return [i[0] for i in self._fields]
+
+    def render(self, **values):
+        """
+        Returns UTF-8 bytes. All fields must be given as str
+        """
+
+        parts = self._parts
+
+        res = [parts[0]]
+
+        for i in range(len(self._fields)):
+
+            name, in_attribute, closing_length = self._fields[i]
+
+            if not name in values:
+                raise KeyError("value for field `{}' missing".format(name))
+
+            if in_attribute:
+                res.append(bytes(escape_attribute(values[name]), 'utf-8'))
+                res.append(parts[i + 1])
+
+            elif values[name] == '':
+                res[-1] = res[-1][:-1] + b'/>'
+                res.append(parts[i + 1][closing_length:])
+
+            else:
+                res.append(bytes(escape_text(values[name]), 'utf-8'))
+                res.append(parts[i + 1])
+
+        return b''.join(res)
+
+    def render_str(self, **values):
+        return str(self.render(**values), 'utf-8')
+
+
+class _Query:
+
+    """
+    Empty query element, for iq_get() templates
+    """
+
+    def __init__(self, xmlns):
+        self.xmlns = xmlns
+
+    def gen_element(self):
+        return lxml.etree.Element('{{{}}}query'.format(self.xmlns))
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def _get_template(key, builder):
+
+    ret = _templates.get(key)
+
+    if ret is None:
+        with _templates_lock:
+            ret = _templates.get(key)
+            if ret is None:
+                ret = StanzaTemplate(builder())
+                _templates[key] = ret
+
+    return ret
+
+
+def _field_or_none(name, value):
+    ret = None
+    if value is not None:
+        ret = field(name)
+    return ret
+
+
+def _present_values(**values):
+    return dict((k, v) for k, v in values.items() if v is not None)
+
+
+def chat_message(to_jid, body, ide=None, from_jid=None, thread=None):
+    """
+    <message type="chat"> with single body. Returns bytes
+    """
+
+    key = (
+        'chat_message',
+        ide is not None, from_jid is not None, thread is not None
+        )
+
+    def builder():
+
+        thread_obj = None
+        if thread is not None:
+            thread_obj = wayround_i2p.xmpp.core.MessageThread(
+                field('thread')
+                )
+
+        return wayround_i2p.xmpp.core.Stanza(
+            tag='message',
+            typ='chat',
+            ide=_field_or_none('ide', ide),
+            from_jid=_field_or_none('from_jid', from_jid),
+            to_jid=field('to_jid'),
+            thread=thread_obj,
+            body=[wayround_i2p.xmpp.core.MessageBody(field('body'))],
+            validation='trusted'
+            )
+
+    return _get_template(key, builder).render(
+        **_present_values(
+            to_jid=to_jid,
+            body=body,
+            ide=ide,
+            from_jid=from_jid,
+            thread=thread
+            )
+        )
+
+
+def presence(
+        to_jid=None, typ=None, show=None, status=None, priority=None,
+        ide=None, from_jid=None
+        ):
+    """
+    <presence> with optional show, single status and priority. Returns
+    bytes
+    """
+
+    if not typ in [
+            None, 'error', 'probe', 'subscribe', 'subscribed',
+            'unavailable', 'unsubscribe', 'unsubscribed'
+            ]:
+        raise ValueError("Invalid `typ' value")
+
+    if not show in [None, 'away', 'chat', 'dnd', 'xa']:
+        raise ValueError("Invalid `show' value")
+
+    if priority is not None:
+        if not isinstance(priority, int):
+            raise TypeError("`priority' must be int")
+        priority = str(priority)
+
+    key = (
+        'presence',
+        typ, show,
+        to_jid is not None, status is not None, priority is not None,
+        ide is not None, from_jid is not None
+        )
+
+    def builder():
+
+        show_obj = None
+        if show is not None:
+            show_obj = wayround_i2p.xmpp.core.PresenceShow(show)
+
+        status_list = []
+        if status is not None:
+            status_list.append(
+                wayround_i2p.xmpp.core.PresenceStatus(field('status'))
+                )
+
+        return wayround_i2p.xmpp.core.Stanza(
+            tag='presence',
+            typ=typ,
+            ide=_field_or_none('ide', ide),
+            from_jid=_field_or_none('from_jid', from_jid),
+            to_jid=_field_or_none('to_jid', to_jid),
+            show=show_obj,
+            status=status_list,
+            priority=_field_or_none('priority', priority),
+            validation='trusted'
+            )
+
+    return _get_template(key, builder).render(
+        **_present_values(
+            to_jid=to_jid,
+            status=status,
+            priority=priority,
+            ide=ide,
+            from_jid=from_jid
+            )
+        )
+
+
+def iq_get(query_xmlns, ide, to_jid=None, from_jid=None):
+    """
+    <iq type="get"> with single empty <query xmlns="`query_xmlns'"/>.
+    Returns bytes
+    """
+
+    if not isinstance(query_xmlns, str):
+        raise TypeError("`query_xmlns' must be str")
+
+    key = (
+        'iq_get',
+        query_xmlns, to_jid is not None, from_jid is not None
+        )
+
+    def builder():
+        return wayround_i2p.xmpp.core.Stanza(
+            tag='iq',
+            typ='get',
+            ide=field('ide'),
+            from_jid=_field_or_none('from_jid', from_jid),
+            to_jid=_field_or_none('to_jid', to_jid),
+            objects=[_Query(query_xmlns)],
+            validation='trusted'
+            )
+
+    return _get_template(key, builder).render(
+        **_present_values(
+            ide=ide,
+            to_jid=to_jid,
+            from_jid=from_jid
+            )
+        )